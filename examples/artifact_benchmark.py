@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example compares the load time of a large mlp saved with `save_model`
+(pickle) and with `save_artifact` (json conf and memory-mapped parameters).
+"""
+import os
+import timeit
+import tempfile
+
+import yadll
+from yadll.artifact import save_artifact, load_artifact
+from yadll.model import save_model, load_model
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+# about 400 MB of parameters
+l_in = yadll.layers.InputLayer(input_shape=(None, 784), name='Input')
+l_hid1 = yadll.layers.DenseLayer(incoming=l_in, n_units=10000, name='Hidden layer 1')
+l_hid2 = yadll.layers.DenseLayer(incoming=l_hid1, n_units=10000, name='Hidden layer 2')
+l_out = yadll.layers.LogisticRegression(incoming=l_hid2, n_class=10, name='Logistic regression')
+net = yadll.network.Network('large mlp', layers=[l_in, l_hid1, l_hid2, l_out])
+hp = yadll.hyperparameters.Hyperparameters()
+hp('batch_size', 100)
+model = yadll.model.Model(network=net, hyperparameters=hp, name='artifact benchmark')
+model.data_shape = ((100, 784), (100, 10))
+
+path = tempfile.mkdtemp()
+pickle_file = os.path.join(path, 'model.ym')
+artifact_path = os.path.join(path, 'artifact')
+save_model(model, pickle_file)
+save_artifact(model, artifact_path)
+
+
+def best_of(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+print('load_model                   : %.3f s' % best_of(lambda: load_model(pickle_file)))
+for mmap_mode in ['r', 'c', None]:
+    print('load_artifact(mmap_mode=%-4s): %.3f s'
+          % (mmap_mode, best_of(lambda: load_artifact(artifact_path, mmap_mode=mmap_mode))))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the training step of bidirectional recurrent layers.
+It compares a forward and a `go_backwards` layer computed by two scans and
+merged by concatenation, with a `Bidirectional` layer computing both
+directions in a single scan over a stacked input projection.
+"""
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+import theano
+import theano.tensor as T
+import yadll
+
+n_batch = 32
+n_time_steps = 50
+n_features = 32
+n_units = 64
+n_steps = 20
+
+x = np.random.random((n_batch, n_time_steps, n_features)).astype(yadll.utils.floatX)
+y = np.random.random((n_batch, 2 * n_units)).astype(yadll.utils.floatX)
+
+
+def step_time(layer_type, bidirectional):
+    x_var, y_var = T.tensor3('x'), T.matrix('y')
+    l_in = yadll.layers.InputLayer(input_shape=(None, n_time_steps, n_features), input=x_var)
+    if bidirectional:
+        layer = yadll.layers.Bidirectional(l_in, n_units=n_units, layer_type=layer_type)
+        output, params = layer.get_output(), layer.params
+    else:
+        forward = getattr(yadll.layers, layer_type)(l_in, n_units=n_units)
+        backward = getattr(yadll.layers, layer_type)(l_in, n_units=n_units, go_backwards=True)
+        output = T.concatenate([forward.get_output(), backward.get_output()], axis=-1)
+        params = forward.params + backward.params
+    cost = T.mean((output - y_var) ** 2)
+    updates = OrderedDict(yadll.updates.sgd(cost, params, learning_rate=0.01))
+    train = theano.function([x_var, y_var], cost, updates=updates)
+    train(x, y)
+    return min(timeit.repeat(lambda: train(x, y), number=n_steps, repeat=3)) / n_steps
+
+
+for layer_type in ['RNN', 'LSTM', 'GRU']:
+    separate = step_time(layer_type, False)
+    bidirectional = step_time(layer_type, True)
+    print('%-5s two layers: %7.2f ms, Bidirectional: %7.2f ms (x%.2f)'
+          % (layer_type, 1e3 * separate, 1e3 * bidirectional, separate / bidirectional))
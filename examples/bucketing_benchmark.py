@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the training of a GRU on variable length sequences.
+It compares minibatches of randomly shuffled sequences padded to the longest
+sequence of the set, with minibatches of sequences of similar length grouped
+by a `BucketSampler` and trimmed to their longest sequence.
+The padding steps are masked, so both trainings compute the same model.
+"""
+import timeit
+
+import numpy as np
+import yadll
+
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+n_samples = 2000
+n_features = 8
+n_class = 4
+max_length = 100
+
+# sequences with a long tail of lengths
+rng = np.random.RandomState(1)
+lengths = np.minimum(rng.geometric(0.05, size=n_samples), max_length)
+x = yadll.data.pad_sequences([rng.rand(n, n_features).astype(yadll.utils.floatX) + 0.1 for n in lengths],
+                             max_length=max_length)
+y = yadll.data.one_hot_encoding(rng.randint(0, n_class, size=n_samples), n_class - 1)
+
+# Hyperparameters
+hp = yadll.hyperparameters.Hyperparameters()
+hp('batch_size', 32)
+hp('n_epochs', 2)
+hp('learning_rate', 0.1)
+hp('patience', 10000)
+
+
+def train(mask_value, sampler=None):
+    data = yadll.data.Data([(x, y), (x[:200], y[:200]), (x[:200], y[:200])], shared=False,
+                           mask_value=mask_value)
+    l_in = yadll.layers.InputLayer(input_shape=(None, None, n_features), name='Input')
+    l_gru = yadll.layers.GRU(incoming=l_in, n_units=32, mask_value=0., name='GRU')
+    l_out = yadll.layers.LogisticRegression(incoming=l_gru, n_class=n_class, name='Logistic regression')
+    net = yadll.network.Network('bucketing', layers=[l_in, l_gru, l_out])
+    model = yadll.model.Model(network=net, data=data, hyperparameters=hp, name='bucketing benchmark')
+    model.compile(compile_arg=['train', 'test', 'validate'])
+    start_time = timeit.default_timer()
+    model.train(sampler=sampler)
+    return timeit.default_timer() - start_time
+
+
+sampler = yadll.data.BucketSampler(yadll.data.sequence_lengths(x), hp.batch_size)
+padded = 1. - lengths.mean() / max_length
+print('padding steps, padded to the set: %.1f%%' % (100 * padded))
+print('padding steps, shuffled batches:  %.1f%%' % (100 * sampler.padding_ratio()))
+print('padding steps, bucketed batches:  %.1f%%' % (100 * sampler.padding_ratio(sampler(rng))))
+
+padded_time = train(mask_value=None)
+bucketed_time = train(mask_value=0., sampler=sampler)
+print('training time, padded to the set: %.2f s' % padded_time)
+print('training time, bucketed batches:  %.2f s (x%.1f)' % (bucketed_time, padded_time / bucketed_time))
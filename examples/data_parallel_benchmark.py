@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the synchronous data-parallel training of the mnist mlp
+of examples/networks.py on 1 to N local processes.
+The throughput is measured on one epoch without early stopping.
+"""
+import timeit
+import multiprocessing
+
+import yadll
+import examples.networks as networks
+from yadll.parallel import train_data_parallel
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+# load the data
+data = yadll.data.Data(yadll.data.mnist_loader())
+n_samples = data.train_set_x.get_value(borrow=True).shape[0]
+
+n_cpus = multiprocessing.cpu_count()
+workers = sorted(set([1, 2, 4, 8, 16, 32, 64, n_cpus]))
+
+results = []
+for n_workers in [n for n in workers if n <= n_cpus]:
+    net, hp = networks.mlp()
+    hp('batch_size', 500)
+    hp('n_epochs', 1)
+    model = yadll.model.Model(network=net, data=data, hyperparameters=hp, name='data parallel benchmark')
+    model.compile(['train', 'validate', 'test'])
+    start_time = timeit.default_timer()
+    train_data_parallel(model, n_workers=n_workers, early_stop=False)
+    duration = timeit.default_timer() - start_time
+    results.append((n_workers, n_samples / duration, model.report['best_validation']))
+
+for n_workers, throughput, validation in results:
+    print('%3i workers: %8.1f samples/s, speedup %.1fx, validation error %.2f %%'
+          % (n_workers, throughput, throughput / results[0][1], validation))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the training step of LSTM and GRU layers with the
+gate parameters stored as separate shared variables, concatenated at each
+call, and with `fused_params` where each block of gates is one contiguous
+shared variable.
+"""
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+import theano
+import theano.tensor as T
+import yadll
+
+n_batch = 32
+n_time_steps = 50
+n_features = 32
+n_units = 128
+n_steps = 20
+
+x = np.random.random((n_batch, n_time_steps, n_features)).astype(yadll.utils.floatX)
+y = np.random.random((n_batch, n_units)).astype(yadll.utils.floatX)
+
+
+def step_time(layer_type, fused_params, **kwargs):
+    x_var, y_var = T.tensor3('x'), T.matrix('y')
+    l_in = yadll.layers.InputLayer(input_shape=(None, n_time_steps, n_features), input=x_var)
+    layer = getattr(yadll.layers, layer_type)(l_in, n_units=n_units, fused_params=fused_params, **kwargs)
+    cost = T.mean((layer.get_output() - y_var) ** 2)
+    updates = OrderedDict(yadll.updates.sgd(cost, layer.params, learning_rate=0.01))
+    train = theano.function([x_var, y_var], cost, updates=updates)
+    train(x, y)
+    return min(timeit.repeat(lambda: train(x, y), number=n_steps, repeat=3)) / n_steps
+
+
+for layer_type, kwargs in [('LSTM', {}), ('LSTM', {'peepholes': True}), ('GRU', {})]:
+    separate = step_time(layer_type, False, **kwargs)
+    fused = step_time(layer_type, True, **kwargs)
+    print('%-15s separate gates: %7.2f ms, fused gates: %7.2f ms (x%.2f)'
+          % (layer_type + (' peepholes' if kwargs else ''), 1e3 * separate, 1e3 * fused, separate / fused))
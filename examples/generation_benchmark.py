@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the generation of a sequence by a stacked LSTM.
+It compares `model.predict` on the whole generated sequence for each new
+token, which recomputes the recurrence from the start, with `model.predict_step`
+which computes one step from the states of the previous one.
+"""
+import timeit
+
+import numpy as np
+import yadll
+
+n_tokens = 200
+n_features = 30
+n_units = 64
+
+hp = yadll.hyperparameters.Hyperparameters()
+hp('batch_size', 1)
+
+l_in = yadll.layers.InputLayer(input_shape=(None, None, n_features), name='Input')
+l_lstm1 = yadll.layers.LSTM(incoming=l_in, n_units=n_units, last_only=False, name='LSTM 1')
+l_lstm2 = yadll.layers.LSTM(incoming=l_lstm1, n_units=n_units, name='LSTM 2')
+l_out = yadll.layers.LogisticRegression(incoming=l_lstm2, n_class=n_features, name='Logistic regression')
+net = yadll.network.Network('generation', layers=[l_in, l_lstm1, l_lstm2, l_out])
+model = yadll.model.Model(network=net, hyperparameters=hp, name='generation benchmark')
+model.data_shape = [((1, n_tokens, n_features), (1, n_features))]
+model.compile(compile_arg=['predict', 'step'])
+
+
+def one_hot(token):
+    x = np.zeros((1, n_features), dtype=yadll.utils.floatX)
+    x[0, token] = 1.
+    return x
+
+
+def generate_predict():
+    sequence = one_hot(0)[:, None]
+    for _ in range(n_tokens):
+        y = model.predict(sequence)
+        sequence = np.concatenate([sequence, one_hot(np.argmax(y))[:, None]], axis=1)
+    return list(np.argmax(sequence[0], axis=1))
+
+
+def generate_step():
+    tokens = [0]
+    y, states = model.predict_step(one_hot(0))
+    for _ in range(n_tokens):
+        tokens.append(int(np.argmax(y)))
+        y, states = model.predict_step(one_hot(tokens[-1]), states)
+    return tokens
+
+
+assert generate_predict() == generate_step()
+predict_time = min(timeit.repeat(generate_predict, number=1, repeat=3))
+step_time = min(timeit.repeat(generate_step, number=1, repeat=3))
+print('%i tokens, predict on the whole sequence: %.3f s' % (n_tokens, predict_time))
+print('%i tokens, predict_step:                  %.3f s (x%.1f)' % (n_tokens, step_time, predict_time / step_time))
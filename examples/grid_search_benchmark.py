@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the parallel grid search.
+The same grid is run with an increasing number of workers and the number of
+trials per hour is reported for each of them.
+"""
+import os
+import timeit
+import tempfile
+import multiprocessing
+
+import numpy as np
+import yadll
+from yadll.hyperparameters import Hyperparameters
+from yadll.search import grid_search
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+
+def build_model(hp):
+    # random data so that the benchmark does not depend on a download
+    rng = np.random.RandomState(1234)
+    data = [[rng.random_sample((n, 100)).astype(yadll.utils.floatX),
+             yadll.data.one_hot_encoding(rng.randint(0, 10, size=n), 9)] for n in [5000, 1000, 1000]]
+    l_in = yadll.layers.InputLayer(input_shape=(None, 100), name='Input')
+    l_hid = yadll.layers.DenseLayer(incoming=l_in, n_units=100, l2=hp.shared('l2_reg'), name='Hidden layer')
+    l_out = yadll.layers.LogisticRegression(incoming=l_hid, n_class=10, name='Logistic regression')
+    net = yadll.network.Network('mlp', layers=[l_in, l_hid, l_out])
+    return yadll.model.Model(network=net, data=yadll.data.Data(data), hyperparameters=hp)
+
+
+if __name__ == '__main__':
+    hps = Hyperparameters()
+    hps('batch_size', 50)
+    hps('n_epochs', 5)
+    hps('learning_rate', 0.1, [0.001, 0.01, 0.1, 0.5])
+    hps('l2_reg', 0.0001, [0, 0.0001, 0.001, 0.01])
+    hps('patience', 10000)
+    n_trials = len(hps.hp_product)
+
+    n_cpus = multiprocessing.cpu_count()
+    workers = sorted(set([1, 2, 4, 8, 16, 32, 64, n_cpus]))
+    print('%i trials, %i cpus' % (n_trials, n_cpus))
+    reference = None
+    for n_workers in [n for n in workers if n <= n_cpus]:
+        results_file = os.path.join(tempfile.mkdtemp(), 'results.jsonl')
+        start_time = timeit.default_timer()
+        grid_search(build_model, hps, results_file, n_workers=n_workers)
+        trials_per_hour = n_trials * 3600. / (timeit.default_timer() - start_time)
+        reference = reference or trials_per_hour
+        print('%3i workers: %8.1f trials/hour, speedup %.1fx' % (n_workers, trials_per_hour,
+                                                                trials_per_hour / reference))
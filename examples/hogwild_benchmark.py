@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example compares the Hogwild! asynchronous sgd on 1 to N local processes
+with the single-process training of the mnist mlp of examples/networks.py.
+Both are trained with sgd for the same number of epochs without early stopping.
+"""
+import timeit
+import multiprocessing
+
+import yadll
+import examples.networks as networks
+from yadll.parallel import train_hogwild
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+# load the data
+data = yadll.data.Data(yadll.data.mnist_loader())
+n_samples = data.train_set_x.get_value(borrow=True).shape[0]
+n_epochs = 5
+
+
+def build_model():
+    net, hp = networks.mlp()
+    hp('batch_size', 100)
+    hp('n_epochs', n_epochs)
+    model = yadll.model.Model(network=net, data=data, hyperparameters=hp, updates=yadll.updates.sgd,
+                              name='hogwild benchmark')
+    model.compile(['train', 'validate', 'test'])
+    return model
+
+# single-process reference
+model = build_model()
+start_time = timeit.default_timer()
+model.train(early_stop=False)
+duration = timeit.default_timer() - start_time
+reference = (n_samples * n_epochs / duration, model.report['validation_values'][-1][1])
+
+n_cpus = multiprocessing.cpu_count()
+workers = sorted(set([1, 2, 4, 8, 16, 32, 64, n_cpus]))
+
+results = []
+for n_workers in [n for n in workers if n <= n_cpus]:
+    model = build_model()
+    report = train_hogwild(model, n_workers=n_workers, eval_frequency=10.)
+    results.append((n_workers, report['samples_per_sec'], report['best_validation']))
+
+print('Model.train  : %8.1f samples/s, validation error %.2f %%' % reference)
+for n_workers, throughput, validation in results:
+    print('%3i workers  : %8.1f samples/s, speedup %.1fx, validation error %.2f %% (%+.2f %%)'
+          % (n_workers, throughput, throughput / reference[0], validation, validation - reference[1]))
@@ -2,6 +2,11 @@
 # -*- coding: UTF-8 -*-
 """
 This example show you how to make a grid search on the Hyperparameters
+
+The scalar hyperparameters (learning_rate, l1_reg, l2_reg, ...) are used as
+shared variables, so the model is compiled once and only its parameters and
+optimizer state are reset between two trials. Hyperparameters changing the
+structure of the graph (batch_size, activation, initialisation) need a new model.
 """
 import os
 import pickle
@@ -22,50 +27,59 @@ data = yadll.data.Data(yadll.data.mnist_loader())
 
 # Hyperparameters
 hps = Hyperparameters()
-hps('batch_size', 500, [50, 100]) #, 500, 1000])
+hps('batch_size', 500)
 hps('n_epochs', 1000)
-hps('learning_rate', 0.1, [0.001, 0.01]) #, 0.1, 1])
+hps('learning_rate', 0.1, [0.001, 0.01, 0.1, 1])
 hps('l1_reg', 0.00) #, [0, 0.0001, 0.001, 0.01])
-hps('l2_reg', 0.0001) #, [0, 0.0001, 0.001, 0.01])
-hps('activation', tanh) #, [tanh, sigmoid, relu])
-hps('initialisation', glorot_uniform) #, [glorot_uniform, glorot_normal])
+hps('l2_reg', 0.0001, [0, 0.0001, 0.001, 0.01])
+hps('activation', tanh)
+hps('initialisation', glorot_uniform)
 hps('patience', 10000)
 
 reports = []
 
 
+def build_model(hp):
+    # create the model
+    model = Model(name='mlp grid search', data=data)
+    # add the hyperparameters to the model
+    model.hp = hp
+    # Create connected layers
+    # Input layer
+    l_in = InputLayer(input_shape=(None, 28 * 28), name='Input')
+    # Dense Layer 1
+    l_hid1 = DenseLayer(incoming=l_in, n_units=5, W=hp.initialisation, l1=hp.shared('l1_reg'),
+                        l2=hp.shared('l2_reg'), activation=hp.activation, name='Hidden layer 1')
+    # Dense Layer 2
+    l_hid2 = DenseLayer(incoming=l_hid1, n_units=5, W=hp.initialisation, l1=hp.shared('l1_reg'),
+                        l2=hp.shared('l2_reg'), activation=hp.activation, name='Hidden layer 2')
+    # Logistic regression Layer
+    l_out = LogisticRegression(incoming=l_hid2, n_class=10, l1=hp.shared('l1_reg'),
+                               l2=hp.shared('l2_reg'), name='Logistic regression')
+
+    # Create network and add layers
+    net = Network('mlp')
+    net.add(l_in)
+    net.add(l_hid1)
+    net.add(l_hid2)
+    net.add(l_out)
+    # add the network to the model
+    model.network = net
+
+    # updates method
+    model.updates = yadll.updates.sgd
+    return model
+
+
 @timer(' Grid Search')
 def grid_search():
+    model = build_model(hps)
+    # compile once for the whole grid search
+    model.compile(['train', 'validate', 'test'])
     for hp in hps:
-        # create the model
-        model = Model(name='mlp grid search', data=data)
-        # add the hyperparameters to the model
-        model.hp = hp
-        # Create connected layers
-        # Input layer
-        l_in = InputLayer(input_shape=(None, 28 * 28), name='Input')
-        # Dense Layer 1
-        l_hid1 = DenseLayer(incoming=l_in, n_units=5, W=hp.initialisation, l1=hp.l1_reg,
-                            l2=hp.l2_reg, activation=hp.activation, name='Hidden layer 1')
-        # Dense Layer 2
-        l_hid2 = DenseLayer(incoming=l_hid1, n_units=5, W=hp.initialisation, l1=hp.l1_reg,
-                            l2=hp.l2_reg, activation=hp.activation, name='Hidden layer 2')
-        # Logistic regression Layer
-        l_out = LogisticRegression(incoming=l_hid2, n_class=10, l1=hp.l1_reg,
-                                   l2=hp.l2_reg, name='Logistic regression')
-
-        # Create network and add layers
-        net = Network('mlp')
-        net.add(l_in)
-        net.add(l_hid1)
-        net.add(l_hid2)
-        net.add(l_out)
-        # add the network to the model
-        model.network = net
-
-        # updates method
-        model.updates = yadll.updates.sgd
-        reports.append((hp, model.train()))
+        # back to the initial parameters and optimizer state
+        model.reset()
+        reports.append((dict(hp.hp_value), dict(model.train())))
 
         with open('reports.pkl', 'wb') as report_file:
             pickle.dump(reports, report_file)
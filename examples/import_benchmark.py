@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example measures the import time of yadll modules, each in a new python
+process. The data and hyperparameters utilities do not import theano.
+"""
+import sys
+import timeit
+import subprocess
+
+STATEMENTS = ['pass',
+              'import yadll',
+              'from yadll.data import one_hot_encoding, normalize',
+              'from yadll.hyperparameters import Hyperparameters',
+              'from yadll.inference import Predictor',
+              'import yadll.model']
+
+
+def import_time(statement, repeat=5):
+    # best of a few runs, the python start-up is included
+    return min(timeit.repeat(lambda: subprocess.check_call([sys.executable, '-c', statement]),
+                             number=1, repeat=repeat))
+
+for statement in STATEMENTS:
+    print('%-55s: %.3f s' % (statement, import_time(statement)))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example compares the cold start, from an artifact on disk to the first
+prediction, and the prediction time of a theano model and of a numpy `Predictor`.
+"""
+import os
+import timeit
+import tempfile
+
+import numpy as np
+import yadll
+from yadll.artifact import save_artifact, load_artifact
+from yadll.inference import Predictor
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+l_in = yadll.layers.InputLayer(input_shape=(None, 784), name='Input')
+l_hid1 = yadll.layers.DenseLayer(incoming=l_in, n_units=500, name='Hidden layer 1')
+l_drop = yadll.layers.Dropout(incoming=l_hid1, corruption_level=0.5, name='Dropout')
+l_hid2 = yadll.layers.DenseLayer(incoming=l_drop, n_units=500, name='Hidden layer 2')
+l_out = yadll.layers.LogisticRegression(incoming=l_hid2, n_class=10, name='Logistic regression')
+net = yadll.network.Network('mlp', layers=[l_in, l_hid1, l_drop, l_hid2, l_out])
+hp = yadll.hyperparameters.Hyperparameters()
+hp('batch_size', 100)
+model = yadll.model.Model(network=net, hyperparameters=hp, name='inference benchmark')
+model.data_shape = [((100, 784), (100, 10))]
+
+path = os.path.join(tempfile.mkdtemp(), 'artifact')
+save_artifact(model, path)
+X = np.random.rand(100, 784).astype(yadll.utils.floatX)
+
+
+def best_of(func, repeat=3, number=1):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+theano_model = load_artifact(path)
+predictor = Predictor.from_artifact(path)
+np.testing.assert_allclose(predictor.predict(X), theano_model.predict(X), rtol=1e-4, atol=1e-6)
+
+print('cold start theano  : %.3f s' % best_of(lambda: load_artifact(path).predict(X)))
+print('cold start numpy   : %.3f s' % best_of(lambda: Predictor.from_artifact(path).predict(X)))
+print('predict theano     : %.2f ms' % (1000 * best_of(lambda: theano_model.predict(X), number=20)))
+print('predict numpy      : %.2f ms' % (1000 * best_of(lambda: predictor.predict(X), number=20)))
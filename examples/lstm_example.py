@@ -14,16 +14,26 @@ logging.basicConfig(level=logging.DEBUG, format='%(message)s')
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
 sequence_length = 2
 number_of_chars = len(alphabet)
-# load the data
-data = yadll.data.Data(yadll.data.alphabet_loader(sequence_length))
+
+
+def one_hot(chars):
+    x = np.zeros((len(chars), number_of_chars), dtype='float32')
+    x[np.arange(len(chars)), [ord(char) - ord('a') for char in chars]] = 1.
+    return x
+
+# load the data: the alphabet is one sequence and the target of each character is the next one
+x = one_hot(alphabet[:-1])[None]
+y = one_hot(alphabet[1:])[None]
+data = yadll.data.Data([(x, y), (x, y), (x, y)], shared=False)
 
 # create the model
-model = yadll.model.Model(name='lstm', data=data)
+model = yadll.model.Model(name='lstm', data=data, objective=yadll.objectives.mean_squared_error)
 
 # Hyperparameters
 hp = yadll.hyperparameters.Hyperparameters()
 hp('batch_size', 1)
 hp('n_epochs', 100)
+hp('learning_rate', 0.05)
 hp('patience', 1000)
 
 # add the hyperparameters to the model
@@ -31,45 +41,37 @@ model.hp = hp
 
 # Create connected layers
 # Input layer
-l_in = yadll.layers.InputLayer(input_shape=(hp.batch_size, sequence_length, number_of_chars))
-# LSTM 1
-l_lstm1 = yadll.layers.BNLSTM(incoming=l_in, n_units=16, last_only=False)
-# LSTM 2
-l_lstm2 = yadll.layers.BNLSTM(incoming=l_lstm1, n_units=16)
-# Logistic regression Layer
-
-l_out = yadll.layers.LogisticRegression(incoming=l_lstm2, n_class=number_of_chars)
+l_in = yadll.layers.InputLayer(input_shape=(hp.batch_size, None, number_of_chars))
+# LSTM 1, stateful so that the windows of the training carry their states
+l_lstm1 = yadll.layers.LSTM(incoming=l_in, n_units=16, last_only=False, stateful=True)
+# LSTM 2, one output per character of the alphabet at each time step
+l_lstm2 = yadll.layers.LSTM(incoming=l_lstm1, n_units=number_of_chars, last_only=False, stateful=True)
 
 # Create network and add layers
 net = yadll.network.Network('stacked lstm')
 net.add(l_in)
 net.add(l_lstm1)
 net.add(l_lstm2)
-net.add(l_out)
 
 # add the network to the model
 model.network = net
 # updates method
 model.updates = yadll.updates.rmsprop
 
-# train the model and save it to file at each best
+# train the model with truncated backpropagation through time on windows of
+# sequence_length characters, each window starts from the states of the previous one
 model.compile(compile_arg='all')
-model.train()
-
-# prime the model with 'ab' sequence and let it generate the learned alphabet
-sentence = alphabet[:sequence_length]
-generated = sentence
-for iteration in range(number_of_chars - sequence_length):
-    x = np.zeros((1, sequence_length, number_of_chars))
-    for t, char in enumerate(sentence):
-        x[0, t, ord(char) - ord('a')] = 1.
-    preds = model.predict(np.asarray(x, dtype='float32'))[0]
+model.train(tbptt=sequence_length)
+
+# prime the model with 'a' and let it generate the learned alphabet.
+# The states are carried from one character to the next as in the training,
+# so each new character costs a single step
+generated = alphabet[0]
+preds, states = model.predict_step(one_hot(generated))
+for iteration in range(number_of_chars - 1):
     next_char = chr(np.argmax(preds) + ord('a'))
     generated += next_char
-    sentence = sentence[1:] + next_char
+    preds, states = model.predict_step(one_hot(next_char), states)
 
 # check that it did generate the alphabet correctly
 assert(generated == alphabet)
-x = model.data.test_set_x.get_value()[0:3]
-model.predict(x)
-chr(np.argmax(model.predict(x)) + ord('a'))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example compares the peak memory and the time of predicting a memory-mapped
+input in one call and by chunks written to a memory-mapped output.
+"""
+import os
+import timeit
+import tempfile
+import tracemalloc
+
+import numpy as np
+import yadll
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+n_samples = 20000
+l_in = yadll.layers.InputLayer(input_shape=(None, 784), name='Input')
+l_hid1 = yadll.layers.DenseLayer(incoming=l_in, n_units=500, name='Hidden layer 1')
+l_hid2 = yadll.layers.DenseLayer(incoming=l_hid1, n_units=500, name='Hidden layer 2')
+l_out = yadll.layers.LogisticRegression(incoming=l_hid2, n_class=10, name='Logistic regression')
+net = yadll.network.Network('mlp', layers=[l_in, l_hid1, l_hid2, l_out])
+model = yadll.model.Model(network=net, hyperparameters=yadll.hyperparameters.Hyperparameters(),
+                          name='predict benchmark')
+model.data_shape = [((100, 784), (100, 10))]
+model.compile(compile_arg='predict')
+
+path = tempfile.mkdtemp()
+x_file = os.path.join(path, 'x.npy')
+x = np.lib.format.open_memmap(x_file, mode='w+', dtype=yadll.utils.floatX, shape=(n_samples, 784))
+x[:] = np.random.rand(n_samples, 784)
+x.flush()
+del x
+
+
+def measure(func):
+    tracemalloc.start()
+    start_time = timeit.default_timer()
+    func()
+    duration = timeit.default_timer() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 2. ** 20
+
+
+def one_call():
+    model.predict(np.load(x_file, mmap_mode='r')[:])
+
+
+def by_chunks(memory):
+    out = np.lib.format.open_memmap(os.path.join(path, 'y.npy'), mode='w+', dtype=yadll.utils.floatX,
+                                    shape=(n_samples, 10))
+    model.predict(np.load(x_file, mmap_mode='r'), memory=memory, out=out)
+    out.flush()
+
+print('one call            : %.2f s, peak %7.1f MB' % measure(one_call))
+for memory in [2 ** 26, 2 ** 24, 2 ** 22]:
+    print('chunks of %5.1f MB  : %.2f s, peak %7.1f MB' % ((memory / 2. ** 20, ) + measure(lambda: by_chunks(memory))))
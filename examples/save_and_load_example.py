@@ -68,7 +68,7 @@ model.compile(compile_arg='all')
 conf = model.to_conf()    # get the configuration
 model.to_conf('conf.yc')  # or save it to file .yc by convention
 
-# Train the model and save it to file at each best
+# Train the model, checkpoint each best and save it to file at the end
 model.train(save_mode='each')
 
 # Saving network parameters after training
@@ -89,6 +89,9 @@ print(true_values)
 ##########################################################################
 # Loading model from file
 model_2 = yadll.model.load_model('best_model.ym')
+# set it to the best model of the training
+checkpointer = yadll.checkpoint.Checkpointer('best_model_checkpoints')
+checkpointer.restore(model_2, checkpointer.best())
 # model is ready to use we can make prediction directly.
 # Watch out this not the proper way of saving models.
 predicted_values_2 = [np.argmax(prediction) for prediction in model_2.predict(test_set_x[:30])]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example sends single row requests from concurrent clients to an mlp,
+without batching (max_batch_size=1) and with micro-batching, served by the
+theano model and by the numpy `Predictor`.
+"""
+import timeit
+import threading
+
+import numpy as np
+import yadll
+from yadll.serving import BatchPredictor
+from yadll.inference import Predictor
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+l_in = yadll.layers.InputLayer(input_shape=(None, 784), name='Input')
+l_hid1 = yadll.layers.DenseLayer(incoming=l_in, n_units=500, name='Hidden layer 1')
+l_hid2 = yadll.layers.DenseLayer(incoming=l_hid1, n_units=500, name='Hidden layer 2')
+l_out = yadll.layers.LogisticRegression(incoming=l_hid2, n_class=10, name='Logistic regression')
+net = yadll.network.Network('mlp', layers=[l_in, l_hid1, l_hid2, l_out])
+model = yadll.model.Model(network=net, hyperparameters=yadll.hyperparameters.Hyperparameters(),
+                          name='serving benchmark')
+model.data_shape = [((100, 784), (100, 10))]
+model.compile(compile_arg='predict')
+
+n_clients = 32
+n_requests = 20
+X = np.random.rand(n_clients, 1, 784).astype(yadll.utils.floatX)
+
+
+def client(predictor, i):
+    for _ in range(n_requests):
+        predictor.predict(X[i])
+
+for name, backend in [('theano', model), ('numpy', Predictor.from_network(net))]:
+    for max_batch_size in [1, 8, 32]:
+        predictor = BatchPredictor(backend, max_batch_size=max_batch_size, max_latency=0.002)
+        clients = [threading.Thread(target=client, args=(predictor, i)) for i in range(n_clients)]
+        start_time = timeit.default_timer()
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        duration = timeit.default_timer() - start_time
+        predictor.close()
+        stats = predictor.stats()
+        print('%-6s max_batch_size %2i: %7.1f requests/s, p50 %6.1f ms, p99 %6.1f ms, mean batch size %4.1f'
+              % (name, max_batch_size, stats['requests'] / duration, 1000 * stats['latency_p50'],
+                 1000 * stats['latency_p99'], stats['mean_batch_size']))
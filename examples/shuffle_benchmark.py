@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the per step latency of the training function.
+It compares the current signature, where the epoch permutation is kept on
+device in a shared variable and `train_func` only receives the minibatch index,
+with the former signature where the whole permutation was passed at each call.
+"""
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+import theano
+import theano.tensor as T
+import yadll
+
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+n_samples = 1000000
+n_features = 20
+n_class = 10
+n_steps = 500
+
+# random data
+x = np.random.random((n_samples, n_features)).astype(yadll.utils.floatX)
+y = yadll.data.one_hot_encoding(np.random.randint(0, n_class, size=n_samples), n_class - 1)
+data = yadll.data.Data([(x, y), (x[:1000], y[:1000]), (x[:1000], y[:1000])])
+
+# Hyperparameters
+hp = yadll.hyperparameters.Hyperparameters()
+hp('batch_size', 20)
+hp('n_epochs', 1)
+hp('learning_rate', 0.1)
+hp('patience', 10000)
+
+# small logistic regression so that the call overhead dominates
+l_in = yadll.layers.InputLayer(input_shape=(None, n_features), name='Input')
+l_out = yadll.layers.LogisticRegression(incoming=l_in, n_class=n_class, name='Logistic regression')
+net = yadll.network.Network('benchmark', layers=[l_in, l_out])
+
+model = yadll.model.Model(network=net, data=data, hyperparameters=hp, name='shuffle benchmark')
+model.compile(compile_arg='train')
+
+# former signature: the permutation is an input of the function
+epoch_index = T.ivector()
+cost = T.mean(model.objective(prediction=net.get_output(stochastic=True), target=model.y)) + net.reguls
+updates = OrderedDict(model.updates(cost, net.params, learning_rate=hp.learning_rate))
+start, end = model.index * hp.batch_size, (model.index + 1) * hp.batch_size
+legacy_train_func = theano.function(inputs=[model.index, epoch_index], outputs=cost, updates=updates,
+                                    givens={model.x: data.train_set_x[epoch_index[start: end]],
+                                            model.y: data.train_set_y[epoch_index[start: end]]})
+
+train_idx = np.arange((n_samples // hp.batch_size) * hp.batch_size, dtype=yadll.utils.intX)
+yadll.utils.np_rng.shuffle(train_idx)
+model.epoch_index.set_value(train_idx)
+
+
+def per_step(func, *args):
+    start_time = timeit.default_timer()
+    for i in range(n_steps):
+        func(i, *args)
+    return (timeit.default_timer() - start_time) / n_steps
+
+legacy = per_step(legacy_train_func, train_idx)
+shared = per_step(model.train_func)
+
+print('Training set of %i samples, batch size %i' % (n_samples, hp.batch_size))
+print('train_func(index, train_idx) : %.3f ms per step' % (legacy * 1000))
+print('train_func(index)            : %.3f ms per step' % (shared * 1000))
+print('speedup                      : %.1fx' % (legacy / shared))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+This example benchmarks the training throughput of the mlp of examples/networks.py
+when `train_func` is called once per minibatch and when `train_steps_func`
+trains several consecutive minibatches per call.
+"""
+import timeit
+
+import numpy as np
+import yadll
+import examples.networks as networks
+
+import logging
+
+logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+n_samples = 20000
+n_calls = 50
+
+# random data of the mnist shape
+x = np.random.random((n_samples, 28 * 28)).astype(yadll.utils.floatX)
+y = yadll.data.one_hot_encoding(np.random.randint(0, 10, size=n_samples), 9)
+data = yadll.data.Data([(x, y), (x[:1000], y[:1000]), (x[:1000], y[:1000])])
+
+net, hp = networks.mlp()
+model = yadll.model.Model(network=net, data=data, hyperparameters=hp, name='steps benchmark')
+
+results = []
+for steps_per_call in [1, 4, 16, 64]:
+    if steps_per_call == 1:
+        model.compile('train')
+        func = model.train_func
+    else:
+        model.compile('train_steps', steps_per_call=steps_per_call)
+        func = model.train_steps_func
+    func(0)
+    start_time = timeit.default_timer()
+    for i in range(n_calls):
+        func(i * steps_per_call % (n_samples // hp.batch_size - steps_per_call))
+    duration = timeit.default_timer() - start_time
+    results.append((steps_per_call, n_calls * steps_per_call / duration))
+
+for steps_per_call, throughput in results:
+    print('%3i minibatches per call: %8.1f minibatches/s, speedup %.1fx'
+          % (steps_per_call, throughput, throughput / results[0][1]))
@@ -0,0 +1,86 @@
+# -*- coding: UTF-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+
+class TestArtifact:
+    @pytest.fixture(scope='module')
+    def model(self):
+        from yadll.data import Data, one_hot_encoding
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.layers import InputLayer, DenseLayer, Dropout, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        rng = np.random.RandomState(5)
+        data = [[rng.random_sample((n, 20)).astype('float32'),
+                 one_hot_encoding(rng.randint(0, 10, size=(n, )), 9).astype('float32')] for n in [60, 20, 20]]
+        hp = Hyperparameters()
+        hp('batch_size', 10)
+        hp('n_epochs', 2)
+        hp('learning_rate', 0.1)
+        hp('patience', 1000)
+        l_in = InputLayer(input_shape=(None, 20), name='input')
+        l_hid = DenseLayer(incoming=l_in, n_units=7, l2=0.001, name='hidden')
+        l_drop = Dropout(incoming=l_hid, corruption_level=0.2, name='dropout')
+        l_out = LogisticRegression(incoming=l_drop, n_class=10, name='output')
+        model = Model(network=Network('artifact_net', layers=[l_in, l_hid, l_drop, l_out]), data=Data(data),
+                      hyperparameters=hp, name='artifact_model')
+        model.train()
+        return model
+
+    def test_layout(self, model, tmpdir):
+        import json
+        from yadll.artifact import save_artifact, ALIGNMENT
+        path = str(tmpdir.join('artifact'))
+        save_artifact(model, path)
+        assert sorted(os.listdir(path)) == ['model.json', 'params.bin']
+        with open(os.path.join(path, 'model.json')) as f:
+            conf = json.load(f)
+        assert conf['version'] == 1
+        assert conf['buffers'] == []
+        assert [p['shape'] for p in conf['params']] == [list(p.get_value().shape) for p in model.network.params]
+        assert all(p['offset'] % ALIGNMENT == 0 for p in conf['params'])
+
+    @pytest.mark.parametrize('mmap_mode', ['r', 'c', None])
+    def test_load(self, model, tmpdir, mmap_mode):
+        from yadll.artifact import save_artifact, load_artifact
+        path = str(tmpdir.join('artifact'))
+        save_artifact(model, path)
+        loaded = load_artifact(path, mmap_mode=mmap_mode)
+        assert loaded.name == model.name
+        assert loaded.data_shape == model.data_shape
+        assert loaded.network.layers[0].input_shape == (None, 20)
+        for p, v in zip(loaded.network.params, model.network.params):
+            np.testing.assert_array_equal(p.get_value(), v.get_value())
+        x = model.data.test_set_x.get_value()
+        np.testing.assert_allclose(loaded.predict(x), model.predict(x), rtol=1e-6)
+        value = loaded.network.params[0].get_value(borrow=True)
+        assert value.flags.writeable == (mmap_mode != 'r')
+        assert isinstance(value.base, np.memmap) == (mmap_mode is not None)
+
+    def test_skip_initialization(self, model, tmpdir):
+        from yadll.artifact import save_artifact, load_artifact
+        from yadll.utils import np_rng
+        path = str(tmpdir.join('artifact'))
+        save_artifact(model, path)
+        state = np_rng.get_state()[1].copy()
+        load_artifact(path)
+        # no random values were drawn to initialize the parameters
+        np.testing.assert_array_equal(np_rng.get_state()[1], state)
+
+    def test_version(self, model, tmpdir):
+        import json
+        from yadll.artifact import save_artifact, load_artifact
+        from yadll.exceptions import DlException
+        path = str(tmpdir.join('artifact'))
+        save_artifact(model, path)
+        conf_file = os.path.join(path, 'model.json')
+        with open(conf_file) as f:
+            conf = json.load(f)
+        conf['version'] = 99
+        with open(conf_file, 'w') as f:
+            json.dump(conf, f)
+        with pytest.raises(DlException):
+            load_artifact(path)
@@ -0,0 +1,205 @@
+# -*- coding: UTF-8 -*-
+import numpy as np
+import pytest
+
+
+class TestCompileCache:
+    @pytest.fixture(scope='module')
+    def data(self):
+        from yadll.data import Data, one_hot_encoding
+        data = [[np.random.random((100, 25)).astype('float32'), one_hot_encoding(np.random.randint(0, 10, size=(100, )), 9).astype('float32')],
+                [np.random.random((50, 25)).astype('float32'), one_hot_encoding(np.random.randint(0, 10, size=(50, )), 9).astype('float32')],
+                [np.random.random((50, 25)).astype('float32'), one_hot_encoding(np.random.randint(0, 10, size=(50, )), 9).astype('float32')]]
+        return Data(data)
+
+    @pytest.fixture(scope='module')
+    def hp(self):
+        from yadll.hyperparameters import Hyperparameters
+        hp = Hyperparameters()
+        hp('batch_size', 10)
+        hp('n_epochs', 2)
+        hp('learning_rate', 0.1)
+        hp('patience', 100)
+        return hp
+
+    def build_network(self, name):
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        l_in = InputLayer(input_shape=(None, 25), name=name + '_input')
+        l_hid = DenseLayer(incoming=l_in, n_units=10, name=name + '_hidden')
+        l_out = LogisticRegression(incoming=l_hid, n_class=10, name=name + '_output')
+        return Network(name=name, layers=[l_in, l_hid, l_out])
+
+    def build_bn_network(self, name):
+        from yadll.layers import InputLayer, DenseLayer, BatchNormalization, LogisticRegression
+        from yadll.network import Network
+        l_in = InputLayer(input_shape=(None, 25), name=name + '_input')
+        l_hid = DenseLayer(incoming=l_in, n_units=10, name=name + '_hidden')
+        l_bn = BatchNormalization(incoming=l_hid, name=name + '_bn')
+        l_out = LogisticRegression(incoming=l_bn, n_class=10, name=name + '_output')
+        return Network(name=name, layers=[l_in, l_hid, l_bn, l_out])
+
+    def build_dropout_network(self, name):
+        from yadll.layers import InputLayer, DenseLayer, Dropout, LogisticRegression
+        from yadll.network import Network
+        l_in = InputLayer(input_shape=(None, 25), name=name + '_input')
+        l_hid = DenseLayer(incoming=l_in, n_units=10, name=name + '_hidden')
+        l_drop = Dropout(incoming=l_hid, corruption_level=0.5, name=name + '_dropout')
+        l_out = LogisticRegression(incoming=l_drop, n_class=10, name=name + '_output')
+        return Network(name=name, layers=[l_in, l_hid, l_drop, l_out])
+
+    def test_hash_conf(self):
+        from yadll.cache import hash_conf
+        from yadll.updates import sgd
+        assert hash_conf({'a': 1, 'b': sgd}) == hash_conf({'b': sgd, 'a': 1})
+        assert hash_conf({'a': 1}) != hash_conf({'a': 2})
+
+    def test_network_structure(self):
+        from yadll.cache import network_structure
+        assert network_structure(self.build_network('net_1').to_conf()) == \
+            network_structure(self.build_network('net_2').to_conf())
+
+    def test_network_structure_symbolic_shape(self):
+        import theano.tensor as T
+        from yadll.cache import network_structure
+        network = self.build_dropout_network('net_1')
+        structure = network_structure(network.to_conf())
+        network.layers[0].input = T.matrix('x')
+        network.get_output()
+        assert network.layers[2].input_shape[0] is not None
+        assert network_structure(network.to_conf()) == structure
+
+    def test_compile_cache(self, tmpdir, data, hp):
+        from yadll.cache import CompileCache
+        from yadll.model import Model
+        cache = CompileCache(str(tmpdir))
+        model_1 = Model(network=self.build_network('net_1'), data=data, hyperparameters=hp, compile_cache=cache)
+        model_1.compile('all')
+        assert (cache.hits, cache.misses) == (0, 5)
+        assert len(tmpdir.listdir()) == 5
+
+        model_2 = Model(network=self.build_network('net_2'), data=data, hyperparameters=hp,
+                        compile_cache=str(tmpdir))
+        model_2.compile('all')
+        assert model_2.report['compile_cache']['hits'] == 5
+        assert model_2.report['compile_cache']['misses'] == 0
+
+        # cached functions are bound to the shared variables of the new model
+        x = data.test_set_x.get_value()[:5]
+        for p_1, p_2 in zip(model_1.network.params, model_2.network.params):
+            p_2.set_value(p_1.get_value())
+        np.testing.assert_allclose(model_1.predict_func(x), model_2.predict_func(x), rtol=1e-5)
+        init_params = [p.get_value() for p in model_2.network.params]
+        assert np.isfinite(model_2.train_func(0))
+        assert any(not np.allclose(p.get_value(), v) for p, v in zip(model_2.network.params, init_params))
+        assert all(np.allclose(p.get_value(), v) for p, v in zip(model_1.network.params, init_params))
+
+        # a different structure is compiled
+        hp_3 = hp.__class__()
+        for name, value in hp.hp_value.items():
+            hp_3(name, value)
+        hp_3('batch_size', 20)
+        model_3 = Model(network=self.build_network('net_3'), data=data, hyperparameters=hp_3, compile_cache=cache)
+        model_3.compile('train')
+        assert cache.misses == 6
+
+        cache.clear()
+        assert len(tmpdir.listdir()) == 0
+
+    def test_dropout(self, tmpdir, data, hp):
+        from yadll.model import Model
+        model_1 = Model(network=self.build_dropout_network('net_1'), data=data, hyperparameters=hp,
+                        compile_cache=str(tmpdir))
+        model_1.compile('all')
+        model_2 = Model(network=self.build_dropout_network('net_2'), data=data, hyperparameters=hp,
+                        compile_cache=str(tmpdir))
+        model_2.compile('all')
+        assert model_2.report['compile_cache']['hits'] == 5
+        assert model_2.report['compile_cache']['misses'] == 0
+        assert np.isfinite(model_2.train_func(0))
+
+    def test_random_states(self, tmpdir, data):
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.model import Model
+        from yadll.utils import T_rng
+        hp = Hyperparameters()
+        hp('batch_size', 10)
+        hp('learning_rate', 0.)
+        models = []
+        for i, seed in enumerate([None, 1, 2]):
+            if seed is not None:
+                T_rng.seed(seed)
+            models.append(Model(network=self.build_dropout_network('net_%i' % i), data=data, hyperparameters=hp,
+                                compile_cache=str(tmpdir)))
+            models[-1].compile('train')
+        assert models[2].report['compile_cache']['hits'] == 1
+        for model in models:
+            rng = np.random.RandomState(0)
+            for param in model.network.params:
+                param.set_value(rng.uniform(-1, 1, param.get_value().shape).astype(param.dtype))
+        # the functions loaded with different seeds draw different dropout masks
+        assert models[1].train_func(0) != models[2].train_func(0)
+        # and seeding the random streams seeds the loaded functions
+        T_rng.seed(3)
+        cost = models[1].train_func(0)
+        T_rng.seed(3)
+        assert models[1].train_func(0) == cost
+
+    def test_no_data(self, tmpdir, hp):
+        from yadll.model import Model
+        from yadll.exceptions import NoDataFoundException
+        model = Model(network=self.build_network('net_1'), hyperparameters=hp, compile_cache=str(tmpdir))
+        model.data_shape = [((10, 25), (10, 10))]
+        model.compile('predict')
+        assert model.report['compile_cache']['misses'] == 1
+        with pytest.raises(NoDataFoundException):
+            model.cache_key('train')
+
+    def test_recurrent(self, tmpdir, hp):
+        from yadll.data import Data
+        from yadll.layers import InputLayer, LSTM
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.objectives import mean_squared_error
+        x = np.random.RandomState(2).rand(20, 4, 3).astype('float32')
+        y = np.random.RandomState(3).rand(20, 2).astype('float32')
+        data = Data([(x, y), (x, y), (x, y)], shared=False)
+        models = []
+        for name in ['net_1', 'net_2']:
+            l_in = InputLayer(input_shape=(None, 4, 3), name=name + '_input')
+            l_lstm = LSTM(incoming=l_in, n_units=2, name=name + '_lstm')
+            models.append(Model(network=Network(name=name, layers=[l_in, l_lstm]), data=data, hyperparameters=hp,
+                                objective=mean_squared_error, compile_cache=str(tmpdir)))
+            models[-1].compile(['train', 'predict'])
+        model_1, model_2 = models
+        assert model_2.report['compile_cache']['hits'] == 2
+        for p_1, p_2 in zip(model_1.network.params, model_2.network.params):
+            p_2.set_value(p_1.get_value())
+        np.testing.assert_allclose(model_1.predict_func(x), model_2.predict_func(x), rtol=1e-5)
+        np.testing.assert_allclose(model_1.train_func(x[:10], y[:10]), model_2.train_func(x[:10], y[:10]), rtol=1e-5)
+        for p_1, p_2 in zip(model_1.network.params, model_2.network.params):
+            np.testing.assert_allclose(p_1.get_value(), p_2.get_value(), rtol=1e-5)
+
+    def test_buffers(self, tmpdir, data, hp):
+        from yadll.model import Model
+        model_1 = Model(network=self.build_bn_network('net_1'), data=data, hyperparameters=hp,
+                        compile_cache=str(tmpdir))
+        model_1.compile(['train', 'predict'])
+        model_2 = Model(network=self.build_bn_network('net_2'), data=data, hyperparameters=hp,
+                        compile_cache=str(tmpdir))
+        model_2.compile(['train', 'predict'])
+        assert model_2.report['compile_cache']['hits'] == 2
+
+        # the cached training function updates the running averages of the new model
+        init_buffers = [b.get_value() for b in model_2.network.buffers]
+        model_2.train_func(0)
+        assert all(not np.allclose(b.get_value(), v) for b, v in zip(model_2.network.buffers, init_buffers))
+        assert all(np.allclose(b.get_value(), v) for b, v in zip(model_1.network.buffers, init_buffers))
+        assert not any(name.startswith('state_') for name in model_2.state_variables())
+
+        # and the cached prediction function reads them
+        for v_1, v_2 in zip(model_1.network.params + model_1.network.buffers,
+                            model_2.network.params + model_2.network.buffers):
+            v_1.set_value(v_2.get_value())
+        x = data.test_set_x.get_value()[:5]
+        np.testing.assert_allclose(model_1.predict_func(x), model_2.predict_func(x), rtol=1e-5)
@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+import os
+import threading
+
+import numpy as np
+import pytest
+
+
+class TestCheckpointer:
+    @pytest.fixture
+    def model(self):
+        return self.build_model()
+
+    def build_model(self, shared=True):
+        from yadll.data import Data, one_hot_encoding
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.layers import InputLayer, DenseLayer, Dropout, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.updates import adam
+        rng = np.random.RandomState(3)
+        data = [[rng.random_sample((n, 20)).astype('float32'),
+                 one_hot_encoding(rng.randint(0, 10, size=(n, )), 9).astype('float32')] for n in [80, 40, 40]]
+        hp = Hyperparameters()
+        hp('batch_size', 10)
+        hp('n_epochs', 4)
+        hp('learning_rate', 0.01)
+        hp('patience', 1000)
+        l_in = InputLayer(input_shape=(None, 20))
+        l_hid = DenseLayer(incoming=l_in, n_units=15)
+        l_drop = Dropout(incoming=l_hid, corruption_level=0.3)
+        l_out = LogisticRegression(incoming=l_drop, n_class=10)
+        model = Model(network=Network(layers=[l_in, l_hid, l_drop, l_out]), data=Data(data, shared=shared),
+                      hyperparameters=hp, updates=adam)
+        model.compile(['train', 'validate', 'test'])
+        return model
+
+    def test_keep(self, model, tmpdir):
+        from yadll.checkpoint import Checkpointer
+        checkpointer = Checkpointer(str(tmpdir), keep=2)
+        assert checkpointer.latest() is None
+        for step in [10, 20, 30]:
+            checkpointer.save(model, step)
+            checkpointer.wait()
+        checkpointer.close()
+        assert [os.path.basename(f) for f in checkpointer.files()] == ['checkpoint_20.npz', 'checkpoint_30.npz']
+        assert sorted(os.listdir(str(tmpdir))) == ['checkpoint_20.npz', 'checkpoint_30.npz']
+
+    def test_restore(self, model, tmpdir):
+        from yadll.checkpoint import Checkpointer
+        checkpointer = Checkpointer(str(tmpdir))
+        # adam moments and step counter are checkpointed with the parameters
+        assert len(model.state_variables()) > len(model.network.params)
+        model.train(early_stop=False)
+        checkpointer.save(model, 1)
+        checkpointer.close()
+        expected = dict((name, v.get_value()) for name, v in model.state_variables().items())
+        model.reset()
+        assert not np.allclose(model.network.params[0].get_value(), expected['param_0'])
+        checkpointer.restore(model)
+        for name, v in model.state_variables().items():
+            np.testing.assert_array_equal(v.get_value(), expected[name])
+
+    def test_non_blocking(self, model, tmpdir, monkeypatch):
+        from yadll.checkpoint import Checkpointer
+        checkpointer = Checkpointer(str(tmpdir))
+        release = threading.Event()
+        write = checkpointer._write
+
+        def slow_write(step, snapshot):
+            release.wait()
+            write(step, snapshot)
+        monkeypatch.setattr(checkpointer, '_write', slow_write)
+        checkpointer.save(model, 1)
+        checkpointer.save(model, 2)
+        checkpointer.save(model, 3)
+        release.set()
+        checkpointer.close()
+        # the snapshots waiting behind a busy writer are replaced by the latest one
+        assert checkpointer.n_written + checkpointer.n_dropped == 3
+        assert checkpointer.latest().endswith('checkpoint_3.npz')
+
+    def test_train_each(self, model, tmpdir):
+        from yadll.checkpoint import Checkpointer
+        from yadll.model import load_model
+        checkpointer = Checkpointer(str(tmpdir.join('ckpt')), keep=1)
+        model.file = str(tmpdir.join('model.ym'))
+        model.train(checkpoint=checkpointer)
+        assert model.report['checkpoint'] == checkpointer.latest()
+        assert len(checkpointer.files()) == 1
+        assert os.path.isfile(model.file)
+        assert load_model(model.file).report['checkpoint'] == checkpointer.latest()
+
+    def test_best(self, model, tmpdir):
+        from yadll.checkpoint import Checkpointer
+        from yadll.model import load_model
+        checkpointer = Checkpointer(str(tmpdir.join('ckpt')), keep=1)
+        model.file = str(tmpdir.join('model.ym'))
+        # the periodic checkpoints prune the checkpoint of the best model but not its best slot
+        report = model.train(early_stop=False, checkpoint=checkpointer, checkpoint_frequency=1)
+        assert report['best_checkpoint'] == checkpointer.best()
+        assert len(checkpointer.files()) == 1
+        assert report['best_iter'] < 32
+        loaded = load_model(model.file)
+        checkpointer.restore(loaded, checkpointer.best())
+        n_batches = loaded.n_batches(loaded.data.valid_set_x)
+        validation = loaded.evaluate(loaded.validate_func, 'valid', n_batches)
+        assert np.isclose(validation * 100., report['best_validation'])
+
+    def test_state_names(self, model):
+        names = list(model.state_variables().keys())
+        assert names[:4] == ['param_0', 'param_1', 'param_2', 'param_3']
+        assert 'optimizer_t' in names
+        assert 'optimizer_m_0' in names and 'optimizer_v_3' in names
+        # the random generator of the dropout
+        assert 'state_0' in names
+
+    @pytest.mark.parametrize('shared', [True, False])
+    def test_resume(self, tmpdir, shared):
+        from yadll.checkpoint import Checkpointer
+        from yadll.utils import np_rng
+        model = self.build_model(shared)
+        initial = [p.get_value() for p in model.network.params]
+        checkpointer = Checkpointer(str(tmpdir), keep=100)
+        np_rng.seed(12)
+        report = dict(model.train(checkpoint=checkpointer, checkpoint_frequency=5))
+        expected = dict((name, v.get_value()) for name, v in model.state_variables().items())
+        files = checkpointer.files()
+        assert len(files) >= 5
+
+        for file in [files[1], files[len(files) // 2]]:
+            # a new process: another network and another random state
+            resumed = self.build_model(shared)
+            np_rng.seed(99)
+            resumed_report = resumed.train(resume=file)
+            assert resumed_report['validation_values'] == report['validation_values']
+            assert resumed_report['test_values'] == report['test_values']
+            assert resumed_report['best_iter'] == report['best_iter']
+            for name, v in resumed.state_variables().items():
+                np.testing.assert_array_equal(v.get_value(), expected[name], err_msg=name)
+        assert not np.array_equal(initial[0], expected['param_0'])
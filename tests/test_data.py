@@ -140,3 +140,137 @@ class Testdata:
         assert np.asarray(data.dataset()[0][1].eval()) == 2
         assert np.asarray(data.dataset()[2][0].eval()) == 5
         assert np.asarray(data.dataset()[2][1].eval()) == 6
+
+
+class TestMemmapData:
+    @pytest.fixture
+    def arrays(self):
+        x = np.random.random((130, 5)).astype('float32')
+        y = np.random.random((130, 2)).astype('float32')
+        return x, y
+
+    @pytest.fixture
+    def shards(self, tmpdir, arrays):
+        x, y = arrays
+        x_files, y_files = [], []
+        for i, (start, stop) in enumerate([(0, 50), (50, 100), (100, 130)]):
+            x_files.append(str(tmpdir.join('x_%i.npy' % i)))
+            y_files.append(str(tmpdir.join('y_%i.npy' % i)))
+            np.save(x_files[-1], x[start:stop])
+            np.save(y_files[-1], y[start:stop])
+        npz_file = str(tmpdir.join('set.npz'))
+        np.savez(npz_file, x=x, y=y)
+        return (x_files, y_files), npz_file
+
+    def test_sharded_array(self, arrays, shards):
+        from yadll.data import ShardedArray
+        x, _ = arrays
+        sharded = ShardedArray(shards[0][0])
+        assert sharded.shape == x.shape
+        assert len(sharded) == 130
+        idx = np.random.permutation(130)[:40]
+        assert_allclose(sharded[idx], x[idx])
+        assert_allclose(sharded[45:105], x[45:105])
+        assert_allclose(sharded[::7], x[::7])
+        assert_allclose(sharded[120], x[120])
+        assert_allclose(pickle.loads(pickle.dumps(sharded))[idx], x[idx])
+
+    def test_memmap_npz(self, arrays, shards):
+        from yadll.data import memmap_npz
+        x, y = arrays
+        assert isinstance(memmap_npz(shards[1], 'x'), np.memmap)
+        assert_allclose(memmap_npz(shards[1], 'y'), y)
+
+    def test_memmap_data(self, arrays, shards):
+        from yadll.data import MemmapData, Data, standardize
+        x, y = arrays
+        data = MemmapData([shards[0], shards[1], shards[1]], preprocessing='Standardize')
+        assert data.shape() == [(x.shape, y.shape)] * 3
+        batch_x, batch_y = data.get_batch('train', np.arange(10))
+        assert_allclose(batch_x, standardize(x)[0][:10], rtol=1e-4, atol=1e-5)
+        assert_allclose(batch_y, y[:10])
+        in_memory = Data([(x, y), (x, y), (x, y)], preprocessing='Normalize', shared=False)
+        data = MemmapData([shards[0], shards[1]], preprocessing='Normalize')
+        assert data.valid_set_x is None
+        assert_allclose(data.get_batch('test', slice(0, 20))[0], in_memory.get_batch('test', slice(0, 20))[0], rtol=1e-5)
+
+
+def _flip(x, y):
+    return -x, y
+
+
+@pytest.mark.parametrize('depth, workers', [(0, 'thread'), (2, 'thread'), (3, 'process')])
+def test_batch_prefetcher(depth, workers):
+    from yadll.data import Data, BatchPrefetcher
+    x = np.random.random((40, 3)).astype('float32')
+    y = np.random.random((40, 2)).astype('float32')
+    data = Data([(x, y), (x, y)], shared=False)
+    idx = np.random.permutation(40).reshape(8, 5)
+    prefetcher = BatchPrefetcher(depth=depth, n_workers=2, workers=workers, augment=_flip)
+    batches = list(prefetcher.batches(data, 'train', idx))
+    assert len(batches) == 8
+    for (batch_x, batch_y), i in zip(batches, idx):
+        assert_allclose(batch_x, -x[i])
+        assert_allclose(batch_y, y[i])
+    test_x, _ = next(prefetcher.batches(data, 'test', idx))
+    assert_allclose(test_x, x[idx[0]])
+    assert prefetcher.stall_time >= 0
+    prefetcher.close()
+
+
+@pytest.mark.parametrize('workers', ['thread', 'process'])
+def test_batch_prefetchers(workers):
+    from yadll.data import Data, BatchPrefetcher
+    x = np.arange(40 * 3, dtype='float32').reshape(40, 3)
+    y = np.zeros((40, 2), dtype='float32')
+    train_data, valid_data = Data([(x, y), (x, y)], shared=False), Data([(x + 1000, y), (x + 1000, y)], shared=False)
+    idx = np.arange(40).reshape(8, 5)
+    train_prefetcher = BatchPrefetcher(depth=2, workers=workers, augment=_flip)
+    valid_prefetcher = BatchPrefetcher(depth=2, workers=workers)
+    # two prefetchers on different data prepare their own minibatches
+    train_batches = train_prefetcher.batches(train_data, 'train', idx)
+    valid_batches = valid_prefetcher.batches(valid_data, 'train', idx)
+    for i, (train_batch, valid_batch) in enumerate(zip(train_batches, valid_batches)):
+        assert_allclose(train_batch[0], -x[idx[i]])
+        assert_allclose(valid_batch[0], x[idx[i]] + 1000)
+    # and a prefetcher serves several data
+    assert_allclose(next(train_prefetcher.batches(valid_data, 'test', idx))[0], x[idx[0]] + 1000)
+    train_prefetcher.close()
+    valid_prefetcher.close()
+
+
+def test_sequences():
+    from yadll.data import pad_sequences, sequence_lengths, trim_sequences
+    sequences = [np.ones((n, 2), dtype='float32') for n in [3, 1, 4]]
+    x = pad_sequences(sequences, value=-1.)
+    assert x.shape == (3, 4, 2)
+    assert x.dtype == 'float32'
+    assert (x[1, 1:] == -1).all()
+    np.testing.assert_array_equal(sequence_lengths(x, -1.), [3, 1, 4])
+    assert pad_sequences(sequences, max_length=2).shape == (3, 2, 2)
+    assert trim_sequences(x[:2], -1.).shape == (2, 3, 2)
+    # targets of each time step are trimmed with the sequences, other targets are kept
+    y = pad_sequences([np.full((n, 1), n, dtype='float32') for n in [3, 1, 4]], max_length=4)
+    trimmed_x, trimmed_y = trim_sequences(x[:2], -1., y[:2])
+    assert trimmed_y.shape == (2, 3, 1)
+    np.testing.assert_array_equal(trimmed_y[:, :, 0], [[3, 3, 3], [1, 0, 0]])
+    assert trim_sequences(x[:2], -1., y[:2, 0])[1].shape == (2, 1)
+    np.testing.assert_array_equal(sequence_lengths(np.zeros((2, 3, 1))), [0, 0])
+
+
+def test_bucket_sampler():
+    from yadll.data import Data, BucketSampler, pad_sequences, sequence_lengths
+    rng = np.random.RandomState(1)
+    lengths = rng.randint(1, 50, size=1000)
+    x = pad_sequences([np.ones((n, 1), dtype='float32') for n in lengths])
+    sampler = BucketSampler(sequence_lengths(x), batch_size=32)
+    idx = sampler(rng)
+    assert len(idx) == 31 * 32
+    assert len(np.unique(idx)) == len(idx)
+    assert sampler.padding_ratio(idx) < 0.1 < sampler.padding_ratio()
+    data = Data([(x, lengths), (x, lengths)], shared=False, mask_value=0.)
+    batch_x, batch_y = data.get_batch('train', idx[:32])
+    assert batch_x.shape == (32, batch_y.max(), 1)
+    data = Data([(x, x), (x, x)], shared=False, mask_value=0.)
+    batch_x, batch_y = data.get_batch('train', idx[:32])
+    assert batch_y.shape == batch_x.shape
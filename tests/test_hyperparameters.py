@@ -1,4 +1,6 @@
 # -*- coding: UTF-8 -*-
+import numpy as np
+import pytest
 import yadll
 
 
@@ -39,3 +41,73 @@ def test_hyperparameters():
 
     assert hp.param4 == 1000
 
+
+
+def test_shared_hyperparameters():
+    hp = yadll.hyperparameters.Hyperparameters()
+    hp('learning_rate', 0.1, [0.1, 0.01])
+    hp('l2_reg', 0.001)
+    lr = hp.shared('learning_rate')
+    assert hp.shared('learning_rate') is lr
+    assert np.isclose(lr.get_value(), 0.1)
+    assert [np.isclose(lr.get_value(), h.learning_rate) for h in hp] == [True, True]
+    assert np.isclose(lr.get_value(), 0.01)
+    hp.reset()
+    assert np.isclose(lr.get_value(), 0.1)
+    hp.learning_rate = 0.5
+    assert np.isclose(lr.get_value(), 0.5)
+
+
+def test_lazy_product():
+    import itertools
+    hp = yadll.hyperparameters.Hyperparameters()
+    hp('param1', 1, [1, 2, 3])
+    hp('param2', 20)
+    hp('param3', 300, [100, 200])
+    assert len(hp) == 6
+    expected = [dict(zip(['param1', 'param2', 'param3'], p)) for p in itertools.product([1, 2, 3], [20], [100, 200])]
+    assert [hp[i] for i in range(len(hp))] == expected
+    assert list(hp.hp_product) == expected
+    assert hp[-1] == expected[-1]
+
+    # huge space
+    for i in range(12):
+        hp('big%i' % i, 0, list(range(10)))
+    assert len(hp) == 6 * 10 ** 12
+    assert hp[len(hp) - 1] == dict(param1=3, param2=20, param3=200, **dict(('big%i' % i, 9) for i in range(12)))
+    assert hp[123]['big9'] == 1 and hp[123]['big10'] == 2 and hp[123]['big11'] == 3
+
+
+def test_sample():
+    hp = yadll.hyperparameters.Hyperparameters()
+    hp('param1', 1, list(range(10)))
+    hp('param2', 20)
+    hp('param3', 300, list(range(20)))
+
+    random = hp.sample(50, seed=1)
+    assert len(random) == 50
+    assert random == hp.sample(50, seed=1)
+    assert all(r['param2'] == 20 for r in random)
+
+    # each value of param1 is taken the same number of times
+    lhs = hp.sample(20, method='lhs', seed=1)
+    assert sorted(r['param1'] for r in lhs) == sorted(list(range(10)) * 2)
+    assert sorted(r['param3'] for r in lhs) == list(range(20))
+
+    sobol = hp.sample(16, method='sobol')
+    assert len(set((r['param1'], r['param3']) for r in sobol)) == 16
+    assert len(set(r['param1'] for r in sobol)) == 10
+
+    with pytest.raises(yadll.exceptions.DlException):
+        hp.sample(10, method='grid')
+
+
+def test_sobol():
+    from yadll.hyperparameters import sobol
+    points = sobol(8, 3)
+    np.testing.assert_allclose(points[:4], [[0, 0, 0], [0.5, 0.5, 0.5], [0.75, 0.25, 0.25], [0.25, 0.75, 0.75]])
+    points = sobol(1024, 21)
+    assert points.min() >= 0 and points.max() < 1
+    # every dimension is equidistributed
+    for d in range(21):
+        assert np.all(np.bincount((points[:, d] * 8).astype(int)) == 128)
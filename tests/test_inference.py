@@ -0,0 +1,189 @@
+# -*- coding: UTF-8 -*-
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+
+def theano_output(network, x):
+    import theano
+    import theano.tensor as T
+    from yadll.utils import floatX
+    x_var = T.TensorType(floatX, (False, ) * x.ndim)('x')
+    network.layers[0].input = x_var
+    return theano.function([x_var], network.get_output(stochastic=False))(x)
+
+
+class TestInference:
+    @pytest.fixture
+    def x(self):
+        return np.random.RandomState(3).randn(6, 4, 5).astype('float32')
+
+    @pytest.mark.parametrize('activation', ['tanh', 'sigmoid', 'ultra_fast_sigmoid', 'softplus', 'relu',
+                                            ('relu', {'alpha': 0.1}), ('elu', {'alpha': 0.5}), 'selu'])
+    def test_activations(self, activation):
+        import theano
+        import theano.tensor as T
+        from yadll.activations import get_activation
+        from yadll.inference import get_activation as np_activation
+        x = np.linspace(-5, 5, 101).astype('float32')
+        x_var = T.vector('x')
+        expected = theano.function([x_var], get_activation(activation)(x_var))(x)
+        assert_allclose(np_activation(activation)(x), expected, rtol=1e-5, atol=1e-6)
+
+    def test_dense(self):
+        from yadll.layers import InputLayer, DenseLayer, Dropout, BatchNormalization, LogisticRegression
+        from yadll.network import Network
+        from yadll.inference import Predictor
+        x = np.random.RandomState(3).randn(8, 12).astype('float32')
+        l_in = InputLayer(input_shape=(None, 12), name='input')
+        l_hid = DenseLayer(l_in, n_units=7, activation='relu', name='hidden')
+        l_bn = BatchNormalization(l_hid, name='bn')
+        l_drop = Dropout(l_bn, corruption_level=0.5, name='dropout')
+        l_out = LogisticRegression(l_drop, n_class=3, name='output')
+        network = Network('dense', layers=[l_in, l_hid, l_bn, l_drop, l_out])
+        for variable in [l_bn.gamma, l_bn.beta, l_bn.mean, l_bn.var]:
+            variable.set_value(np.random.RandomState(4).rand(7).astype('float32'))
+        assert_allclose(Predictor.from_network(network).predict(x), theano_output(network, x), rtol=1e-5, atol=1e-6)
+
+    @pytest.mark.parametrize('layer_type, kwargs', [
+        ('RNN', {}),
+        ('RNN', {'last_only': False, 'go_backwards': True}),
+        ('LSTM', {}),
+        ('LSTM', {'peepholes': True, 'last_only': False}),
+        ('LSTM', {'tied_i_f': True, 'go_backwards': True}),
+        ('GRU', {}),
+        ('GRU', {'last_only': False, 'go_backwards': True})])
+    def test_recurrent(self, x, layer_type, kwargs):
+        import yadll
+        from yadll.layers import InputLayer
+        from yadll.network import Network
+        from yadll.inference import Predictor
+        l_in = InputLayer(input_shape=(None, 4, 5), name='input')
+        l_rec = getattr(yadll.layers, layer_type)(l_in, n_units=3, name='recurrent', **kwargs)
+        network = Network('recurrent', layers=[l_in, l_rec])
+        assert_allclose(Predictor.from_network(network).predict(x), theano_output(network, x), rtol=1e-5, atol=1e-6)
+
+    def test_from_artifact(self, tmpdir):
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.artifact import save_artifact
+        from yadll.inference import Predictor
+        x = np.random.RandomState(3).randn(8, 12).astype('float32')
+        l_in = InputLayer(input_shape=(None, 12), name='input')
+        l_hid = DenseLayer(l_in, n_units=7, name='hidden')
+        l_out = LogisticRegression(l_hid, n_class=3, name='output')
+        model = Model(network=Network('artifact', layers=[l_in, l_hid, l_out]), hyperparameters=Hyperparameters(),
+                      name='artifact_model')
+        path = str(tmpdir.join('artifact'))
+        save_artifact(model, path)
+        predictor = Predictor.from_artifact(path)
+        assert isinstance(predictor.layers[1][3]['W'].base, np.memmap)
+        assert_allclose(predictor.predict(x), theano_output(model.network, x), rtol=1e-5, atol=1e-6)
+
+    def test_batch_normalization_artifact(self, tmpdir):
+        from yadll.data import Data, one_hot_encoding
+        from yadll.layers import InputLayer, DenseLayer, BatchNormalization, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.artifact import save_artifact
+        from yadll.inference import Predictor
+        rng = np.random.RandomState(3)
+        data = Data([[rng.randn(n, 12).astype('float32') * 3 + 1,
+                      one_hot_encoding(rng.randint(0, 3, size=(n, )), 2).astype('float32')] for n in [40, 20, 20]])
+        hp = Hyperparameters()
+        hp('batch_size', 10)
+        hp('n_epochs', 2)
+        hp('learning_rate', 0.1)
+        hp('patience', 1000)
+        l_in = InputLayer(input_shape=(None, 12), name='input')
+        l_bn = BatchNormalization(l_in, name='bn')
+        l_out = LogisticRegression(l_bn, n_class=3, name='output')
+        model = Model(network=Network('bn', layers=[l_in, l_bn, l_out]), data=data, hyperparameters=hp,
+                      name='bn_model')
+        model.train()
+        assert not np.allclose(l_bn.mean.get_value(), 0)
+        path = str(tmpdir.join('artifact'))
+        save_artifact(model, path)
+        x = rng.randn(1, 12).astype('float32')
+        assert_allclose(Predictor.from_artifact(path).predict(x), model.predict(x), rtol=1e-5, atol=1e-6)
+
+    @pytest.mark.parametrize('border_mode, subsample', [('valid', (1, 1)), ('full', (1, 1)), ('valid', (2, 1))])
+    def test_conv2d(self, border_mode, subsample):
+        from yadll.inference import conv2d
+        rng = np.random.RandomState(3)
+        x = rng.randn(2, 3, 7, 6)
+        w = rng.randn(4, 3, 3, 2)
+        if border_mode == 'full':
+            x_pad = np.pad(x, ((0, 0), (0, 0), (2, 2), (1, 1)), mode='constant')
+        else:
+            x_pad = x
+        out_h, out_w = x_pad.shape[2] - 2, x_pad.shape[3] - 1
+        expected = np.zeros((2, 4, out_h, out_w))
+        for i in range(out_h):
+            for j in range(out_w):
+                patch = x_pad[:, :, i: i + 3, j: j + 2]
+                expected[:, :, i, j] = np.tensordot(patch, w[:, :, ::-1, ::-1], axes=([1, 2, 3], [1, 2, 3]))
+        expected = expected[:, :, ::subsample[0], ::subsample[1]]
+        assert_allclose(conv2d(x, w, border_mode, subsample), expected)
+
+    @pytest.mark.parametrize('ws, stride, ignore_border, pad, mode, expected', [
+        ((2, 2), None, True, (0, 0), 'max', [[6, 8], [16, 18]]),
+        ((2, 2), None, False, (0, 0), 'max', [[6, 8, 9], [16, 18, 19], [21, 23, 24]]),
+        ((2, 2), None, False, (0, 0), 'sum', [[12, 20, 13], [52, 60, 33], [41, 45, 24]]),
+        ((3, 3), (2, 2), True, (0, 0), 'average_exc_pad', [[6, 8], [16, 18]]),
+        ((2, 2), None, True, (1, 1), 'average_exc_pad', [[0, 1.5, 3.5], [7.5, 9, 11], [17.5, 19, 21]]),
+        ((2, 2), None, True, (1, 1), 'average_inc_pad', [[0, 0.75, 1.75], [3.75, 9, 11], [8.75, 19, 21]])])
+    def test_pool_2d(self, ws, stride, ignore_border, pad, mode, expected):
+        from yadll.inference import pool_2d
+        x = np.arange(25, dtype='float32').reshape(1, 1, 5, 5)
+        assert_allclose(pool_2d(x, ws, stride, ignore_border, pad, mode)[0, 0], expected)
+
+    def test_unsupported_layer(self):
+        from yadll.exceptions import DlException
+        from yadll.inference import Predictor
+        conf = {'layers': {'input': {'type': 'InputLayer', 'input_layer': None},
+                           'custom': {'type': 'CustomLayer', 'input_layer': 'input'}}}
+        with pytest.raises(DlException):
+            Predictor(conf, [])
+
+    @pytest.mark.parametrize('layer_type, kwargs', [
+        ('RNN', {}),
+        ('LSTM', {'peepholes': True, 'last_only': False}),
+        ('GRU', {'go_backwards': True})])
+    def test_mask_value(self, x, layer_type, kwargs):
+        import yadll
+        from yadll.layers import InputLayer
+        from yadll.network import Network
+        from yadll.inference import Predictor
+        x[:, 2:][np.arange(6) % 2 == 0] = 0.
+        l_in = InputLayer(input_shape=(None, 4, 5), name='input')
+        l_rec = getattr(yadll.layers, layer_type)(l_in, n_units=3, name='recurrent', mask_value=0., **kwargs)
+        network = Network('masked', layers=[l_in, l_rec])
+        assert_allclose(Predictor.from_network(network).predict(x), theano_output(network, x), rtol=1e-5, atol=1e-6)
+
+    @pytest.mark.parametrize('layer_type, kwargs', [
+        ('LSTM', {'peepholes': True}),
+        ('GRU', {'last_only': False})])
+    def test_fused_params(self, x, layer_type, kwargs):
+        import yadll
+        from yadll.layers import InputLayer
+        from yadll.network import Network
+        from yadll.inference import Predictor
+        l_in = InputLayer(input_shape=(None, 4, 5), name='input')
+        l_rec = getattr(yadll.layers, layer_type)(l_in, n_units=3, name='recurrent', fused_params=True, **kwargs)
+        network = Network('fused', layers=[l_in, l_rec])
+        assert_allclose(Predictor.from_network(network).predict(x), theano_output(network, x), rtol=1e-5, atol=1e-6)
+
+    @pytest.mark.parametrize('layer_type, merge_mode', [('LSTM', 'concat'), ('GRU', 'average')])
+    def test_bidirectional(self, x, layer_type, merge_mode):
+        from yadll.layers import InputLayer, Bidirectional
+        from yadll.network import Network
+        from yadll.inference import Predictor
+        l_in = InputLayer(input_shape=(None, 4, 5), name='input')
+        l_bi = Bidirectional(l_in, n_units=3, layer_type=layer_type, merge_mode=merge_mode, last_only=False,
+                             layer_conf={'fused_params': True}, name='bidirectional')
+        network = Network('bidirectional', layers=[l_in, l_bi])
+        assert_allclose(Predictor.from_network(network).predict(x), theano_output(network, x), rtol=1e-5, atol=1e-6)
@@ -509,6 +509,31 @@ class TestBatchNormalization:
     def test_get_output(self, layer):
         output = layer.get_output().eval()
 
+    def test_per_feature(self, batch_normalization, input_layer):
+        from yadll.layers import InputLayer
+        layer = batch_normalization(incoming=input_layer)
+        assert layer.gamma.get_value().shape == (20, )
+        assert layer.buffers == [layer.mean, layer.var]
+        conv = batch_normalization(incoming=InputLayer((None, 3, 8, 8)))
+        assert conv.axes == (0, 2, 3)
+        assert conv.mean.get_value().shape == (3, )
+
+    def test_running_averages(self, batch_normalization, input_data, input_layer):
+        import theano
+        layer = batch_normalization(incoming=input_layer, alpha=0.5)
+        output = layer.get_output(stochastic=True)
+        train = theano.function([], output, updates=layer.get_updates())
+        x = input_data.get_value()
+        train()
+        assert_allclose(layer.mean.get_value(), 0.5 * x.mean(axis=0), rtol=1e-5)
+        assert_allclose(layer.var.get_value(), 0.5 + 0.5 * x.var(axis=0), rtol=1e-5)
+        # inference uses the running averages and works on any batch size
+        x_var = theano.tensor.matrix('x')
+        input_layer.input = x_var
+        predict = theano.function([x_var], layer.get_output(stochastic=False))
+        expected = (x[:1] - layer.mean.get_value()) / np.sqrt(layer.var.get_value() + layer.epsilon)
+        assert_allclose(predict(x[:1]), expected, rtol=1e-4)
+
 
 class TestRNN:
     @pytest.fixture
@@ -592,4 +617,126 @@ class TestGRU:
         return gru(incoming=input_layer, n_units=10)
 
     def test_get_output(self, layer):
-        output = layer.get_output().eval()
\ No newline at end of file
+        output = layer.get_output().eval()
+
+class TestSequenceMask:
+    @pytest.fixture
+    def sequences(self):
+        rng = np.random.RandomState(5)
+        return [rng.rand(n, 4).astype('float32') + 0.1 for n in [6, 3, 1]]
+
+    @pytest.mark.parametrize('layer_type', ['RNN', 'LSTM', 'GRU'])
+    @pytest.mark.parametrize('go_backwards', [False, True])
+    def test_mask_value(self, sequences, layer_type, go_backwards):
+        import theano
+        import theano.tensor as T
+        import yadll
+        from yadll.layers import InputLayer
+        from yadll.data import pad_sequences
+        x_var = T.tensor3('x')
+        l_in = InputLayer((None, None, 4), input=x_var)
+        layer = getattr(yadll.layers, layer_type)(l_in, n_units=3, mask_value=0., go_backwards=go_backwards)
+        last = theano.function([x_var], layer.get_output())
+        layer.last_only = False
+        steps = theano.function([x_var], layer.get_output())
+        padded = pad_sequences(sequences)
+        padded_last, padded_steps = last(padded), steps(padded)
+        for i, seq in enumerate(sequences):
+            np.testing.assert_allclose(padded_last[i], last(seq[None])[0], rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(padded_steps[i, :len(seq)], steps(seq[None])[0], rtol=1e-5, atol=1e-6)
+        assert layer.to_conf()['mask_value'] == 0.
+
+
+class TestFusedParams:
+    @pytest.mark.parametrize('layer_type, kwargs', [('LSTM', {}), ('LSTM', {'peepholes': True}), ('GRU', {})])
+    def test_fused_params(self, layer_type, kwargs):
+        import theano
+        import theano.tensor as T
+        import yadll
+        from yadll.layers import InputLayer
+        from yadll.utils import np_rng
+        x = np.random.RandomState(2).rand(5, 7, 4).astype('float32')
+        x_var = T.tensor3('x')
+        l_in = InputLayer((None, 7, 4), input=x_var)
+        outputs, grads = [], []
+        for fused_params in [False, True]:
+            np_rng.seed(42)
+            np.random.seed(42)
+            layer = getattr(yadll.layers, layer_type)(l_in, n_units=3, fused_params=fused_params, **kwargs)
+            output = layer.get_output()
+            grad = T.concatenate([T.grad(output.sum(), layer.W).flatten(), T.grad(output.sum(), layer.U).flatten()])
+            outputs.append(theano.function([x_var], output)(x))
+            grads.append(theano.function([x_var], grad)(x))
+        np.testing.assert_allclose(outputs[0], outputs[1], rtol=1e-5)
+        np.testing.assert_allclose(grads[0], grads[1], rtol=1e-4, atol=1e-6)
+        assert len(layer.params) == len(layer.gates)
+        assert layer.to_conf()['fused_params']
+        gate_name = layer.gates['W'][1]
+        values = layer.gate_values()
+        np.testing.assert_allclose(values[gate_name], getattr(layer, gate_name).eval())
+        values[gate_name][:] = 0
+        assert not layer.W.get_value()[:, 3: 6].any()
+
+
+class TestStateful:
+    @pytest.mark.parametrize('layer_type', ['RNN', 'LSTM', 'GRU'])
+    def test_stateful(self, layer_type):
+        import theano
+        import theano.tensor as T
+        import yadll
+        from yadll.layers import InputLayer
+        x = np.random.RandomState(2).rand(3, 8, 4).astype('float32')
+        x_var = T.tensor3('x')
+        l_in = InputLayer((None, None, 4), input=x_var)
+        layer = getattr(yadll.layers, layer_type)(l_in, n_units=5, last_only=False, stateful=True)
+        full = theano.function([x_var], layer.get_output(stochastic=False))(x)
+        window = theano.function([x_var], layer.get_output(stochastic=True), updates=layer.get_updates())
+        np.testing.assert_allclose(np.concatenate([window(x[:, :3]), window(x[:, 3:])], axis=1), full,
+                                   rtol=1e-5, atol=1e-6)
+        assert layer.h_state.get_value().shape == (3, 5)
+        # a new batch size or a reset starts from the initial state
+        np.testing.assert_allclose(window(x[:2, :3]), full[:2, :3], rtol=1e-5, atol=1e-6)
+        window(x[:, :3])
+        layer.reset_states()
+        assert layer.h_state.get_value().shape == (0, 5)
+        np.testing.assert_allclose(window(x[:, :3]), full[:, :3], rtol=1e-5, atol=1e-6)
+        assert layer.to_conf()['stateful']
+
+    def test_go_backwards(self):
+        from yadll.layers import InputLayer, LSTM
+        from yadll.exceptions import DlException
+        with pytest.raises(DlException):
+            LSTM(InputLayer((None, 8, 4)), n_units=5, stateful=True, go_backwards=True)
+
+
+class TestBidirectional:
+    @pytest.mark.parametrize('layer_type, merge_mode, last_only, mask_value', [
+        ('RNN', 'concat', True, None),
+        ('LSTM', 'concat', False, None),
+        ('LSTM', 'sum', True, 0.),
+        ('GRU', 'average', False, 0.)])
+    def test_get_output(self, layer_type, merge_mode, last_only, mask_value):
+        import theano
+        import theano.tensor as T
+        from yadll.layers import InputLayer, Bidirectional
+        x = np.random.RandomState(2).rand(3, 6, 4).astype('float32') + 0.1
+        x[0, 4:] = 0.
+        x_var = T.tensor3('x')
+        l_in = InputLayer((None, 6, 4), input=x_var)
+        layer = Bidirectional(l_in, n_units=5, layer_type=layer_type, merge_mode=merge_mode, last_only=last_only,
+                              mask_value=mask_value)
+        assert len(layer.params) == 2 * len(layer.forward.params)
+        output, forward, backward = theano.function([x_var], [layer.get_output(), layer.forward.get_output(),
+                                                              layer.backward.get_output()])(x)
+        expected = {'concat': np.concatenate([forward, backward], axis=-1),
+                    'sum': forward + backward,
+                    'average': (forward + backward) / 2}[merge_mode]
+        assert output.shape == expected.shape
+        assert output.shape[1:] == layer.output_shape[1:]
+        np.testing.assert_allclose(output, expected, rtol=1e-5, atol=1e-6)
+
+    def test_unknown(self):
+        from yadll.layers import InputLayer, Bidirectional
+        from yadll.exceptions import DlException
+        with pytest.raises(DlException):
+            Bidirectional(InputLayer((None, 6, 4)), n_units=5, merge_mode='mul')
@@ -141,6 +141,394 @@ class TestModel:
         model.network.layers[0].input = None
         model.predict(data.test_set_x.eval()[:10])
 
+    def test_predict_iter(self, tmpdir, hp):
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        l_in = InputLayer(input_shape=(None, 25))
+        l_out = LogisticRegression(incoming=DenseLayer(incoming=l_in, n_units=10), n_class=10)
+        model = Model(network=Network(name='predict_network', layers=[l_in, l_out.input_layer, l_out]),
+                      hyperparameters=hp)
+        model.data_shape = [((10, 25), (10, 10))]
+        x = np.random.random((95, 25)).astype('float32')
+        expected = model.predict(x)
+        np.save(str(tmpdir.join('x.npy')), x)
+        x_mmap = np.load(str(tmpdir.join('x.npy')), mmap_mode='r')
+        chunks = list(model.predict_iter(x_mmap, chunk_size=20))
+        assert [len(c) for c in chunks] == [20, 20, 20, 20, 15]
+        np.testing.assert_allclose(np.concatenate(chunks), expected, rtol=1e-6)
+        # the memory budget sets the chunk size
+        chunks = list(model.predict_iter(x, memory=30 * model.bytes_per_sample()))
+        assert [len(c) for c in chunks] == [30, 30, 30, 5]
+        np.testing.assert_allclose(model.predict(x_mmap), expected, rtol=1e-6)
+        np.testing.assert_allclose(model.predict(iter([x[:50], x[50:]]), chunk_size=40), expected, rtol=1e-6)
+        np.testing.assert_allclose(model.predict([x[:50], x[50:]]), expected, rtol=1e-6)
+        out = np.lib.format.open_memmap(str(tmpdir.join('y.npy')), mode='w+', dtype='float32', shape=(95, 10))
+        assert model.predict(x_mmap, chunk_size=32, out=out) is out
+        out.flush()
+        np.testing.assert_allclose(np.load(str(tmpdir.join('y.npy'))), expected, rtol=1e-6)
 
+    def test_compile_arg(self, data, hp):
+        from yadll.layers import InputLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        l_in = InputLayer(input_shape=(None, 25))
+        l_out = LogisticRegression(incoming=l_in, n_class=10)
+        model = Model(network=Network(name='compile_arg', layers=[l_in, l_out]), data=data, hyperparameters=hp)
+        compile_arg = ['train', 'test']
+        model.train(compile_arg=compile_arg, evaluation='fused')
+        assert compile_arg == ['train', 'test']
+        assert model.validate_func is not None and model.evaluate_func is not None
+
+    def test_epoch_index(self, data, model, network):
+        model.network = network
+        model.train()
+        n_train = (data.train_set_x.get_value().shape[0] // model.hp.batch_size) * model.hp.batch_size
+        idx = model.epoch_index.get_value()
+        assert idx.dtype == 'int32'
+        np.testing.assert_array_equal(np.sort(idx), np.arange(n_train))
+        assert np.isfinite(model.train_func(0))
 
+    def test_reset(self, data):
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.updates import momentum
+        from yadll.exceptions import DlException
+        hp = Hyperparameters()
+        hp('batch_size', 10)
+        hp('n_epochs', 2)
+        hp('learning_rate', 0.1, [0.1, 0.2])
+        hp('momentum', 0.9)
+        hp('l2_reg', 0.0)
+        hp('patience', 100)
+        l_in = InputLayer(input_shape=(None, 25))
+        l_hid = DenseLayer(incoming=l_in, n_units=10, l2=hp.shared('l2_reg'))
+        l_out = LogisticRegression(incoming=l_hid, n_class=10, l2=hp.shared('l2_reg'))
+        model = Model(network=Network(layers=[l_in, l_hid, l_out]), data=data,
+                      hyperparameters=hp, updates=momentum)
+        with pytest.raises(DlException):
+            model.reset()
+        model.compile(['train', 'validate', 'test'])
+        train_func = model.train_func
+        init_params = [p.get_value() for p in model.network.params]
+        state = [v for v, _ in model.initial_state]
+        assert len(state) == 2 * len(init_params)
 
+        steps = []
+        for h in hp:
+            model.reset()
+            for p, v in zip(model.network.params, init_params):
+                np.testing.assert_array_equal(p.get_value(), v)
+            assert all(not np.any(v.get_value()) for v in state if v not in model.network.params)
+            model.train_func(0)
+            steps.append([p.get_value() - v for p, v in zip(model.network.params, init_params)])
+        # the learning rate changed without recompiling
+        for s1, s2 in zip(*steps):
+            np.testing.assert_allclose(2 * s1, s2, rtol=1e-4, atol=1e-7)
+        model.reset()
+        model.train()
+        assert model.train_func is train_func
+
+    def test_evaluate_fused(self, data, hp):
+        from yadll.data import Data
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.utils import np_rng, floatX
+        from yadll.exceptions import DlException
+        l_in = InputLayer(input_shape=(None, 25))
+        l_hid = DenseLayer(incoming=l_in, n_units=10)
+        l_out = LogisticRegression(incoming=l_hid, n_class=10)
+        network = Network(layers=[l_in, l_hid, l_out])
+        init_params = [p.get_value() for p in network.params]
+        host_data = Data([[data.train_set_x.get_value(), data.train_set_y.get_value()],
+                          [data.valid_set_x.get_value(), data.valid_set_y.get_value()],
+                          [data.test_set_x.get_value(), data.test_set_y.get_value()]], shared=False)
+        for d in [data, host_data]:
+            network.layers[0].input = None
+            model = Model(network=network, data=d, hyperparameters=hp)
+            model.compile('all')
+            assert model.bytes_per_sample() == 2 * np.dtype(floatX).itemsize * (25 + 10 + 10)
+            expected = [model.evaluate(model.validate_func, 'valid', 5), model.evaluate(model.test_func, 'test', 5)]
+            for memory in [2 ** 28, 1000, 1]:
+                np.testing.assert_allclose(model.evaluate_fused(memory), expected, rtol=1e-6)
+        # a set without a complete minibatch has no error
+        small_data = Data([[host_data.train_set_x, host_data.train_set_y],
+                           [host_data.valid_set_x[:hp.batch_size - 1], host_data.valid_set_y[:hp.batch_size - 1]],
+                           [host_data.test_set_x, host_data.test_set_y]], shared=False)
+        network.layers[0].input = None
+        model = Model(network=network, data=small_data, hyperparameters=hp)
+        model.compile('evaluate')
+        with pytest.raises(DlException):
+            model.evaluate_fused()
+
+        reports = []
+        for evaluation in ['batch', 'fused']:
+            for p, v in zip(network.params, init_params):
+                p.set_value(v)
+            np_rng.seed(1234)
+            network.layers[0].input = None
+            model = Model(network=network, data=data, hyperparameters=hp)
+            reports.append(dict(model.train(evaluation=evaluation, eval_memory=1000)))
+        assert model.evaluate_func is not None
+        np.testing.assert_allclose(reports[0]['validation_values'], reports[1]['validation_values'])
+        np.testing.assert_allclose(reports[0]['test_values'], reports[1]['test_values'])
+
+    def test_steps_per_call(self, data, hp):
+        from yadll.data import Data
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.utils import np_rng
+        l_in = InputLayer(input_shape=(None, 25))
+        l_hid = DenseLayer(incoming=l_in, n_units=10)
+        l_out = LogisticRegression(incoming=l_hid, n_class=10)
+        network = Network(layers=[l_in, l_hid, l_out])
+        init_params = [p.get_value() for p in network.params]
+        host_data = Data([[data.train_set_x.get_value(), data.train_set_y.get_value()],
+                          [data.valid_set_x.get_value(), data.valid_set_y.get_value()],
+                          [data.test_set_x.get_value(), data.test_set_y.get_value()]], shared=False)
+
+        # one call of train_steps_func is the same as steps_per_call calls of train_func
+        network.layers[0].input = None
+        model = Model(network=network, data=data, hyperparameters=hp)
+        model.compile(['train', 'train_steps'], steps_per_call=3)
+        model.epoch_index.set_value(np.random.permutation(100).astype('int32'))
+        single = [model.train_func(i) for i in range(3)]
+        single_params = [p.get_value() for p in network.params]
+        for p, v in zip(network.params, init_params):
+            p.set_value(v)
+        costs = model.train_steps_func(0)
+        assert costs.shape == (3, )
+        np.testing.assert_allclose(costs, single, rtol=1e-5)
+        for p, v in zip(network.params, single_params):
+            np.testing.assert_allclose(p.get_value(), v, rtol=1e-5, atol=1e-6)
+
+        # validation happens at the same iterations
+        hp_steps = hp.__class__()
+        for name, value in hp.hp_value.items():
+            hp_steps(name, value)
+        hp_steps('patience', 8)
+        reports = []
+        for d, steps_per_call in [(data, 1), (data, 3), (host_data, 3)]:
+            for p, v in zip(network.params, init_params):
+                p.set_value(v)
+            np_rng.seed(1234)
+            network.layers[0].input = None
+            model = Model(network=network, data=d, hyperparameters=hp_steps)
+            reports.append(dict(model.train(steps_per_call=steps_per_call)))
+        for report in reports[1:]:
+            assert report['epoch'] == reports[0]['epoch']
+            np.testing.assert_allclose(report['validation_values'], reports[0]['validation_values'], rtol=1e-4)
+            np.testing.assert_allclose(report['test_values'], reports[0]['test_values'], rtol=1e-4)
+
+    def test_memmap_data(self, tmpdir, hp):
+        from yadll.data import Data, MemmapData, BatchPrefetcher, one_hot_encoding
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.utils import np_rng
+        x = np.random.random((100, 25)).astype('float32')
+        y = one_hot_encoding(np.random.randint(0, 10, size=(100, )), 9).astype('float32')
+        np.save(str(tmpdir.join('x_0.npy')), x[:60])
+        np.save(str(tmpdir.join('x_1.npy')), x[60:])
+        np.save(str(tmpdir.join('y_0.npy')), y[:60])
+        np.save(str(tmpdir.join('y_1.npy')), y[60:])
+        train_set = ([str(tmpdir.join('x_0.npy')), str(tmpdir.join('x_1.npy'))],
+                     [str(tmpdir.join('y_0.npy')), str(tmpdir.join('y_1.npy'))])
+        np.savez(str(tmpdir.join('test.npz')), x=x[:50], y=y[:50])
+
+        l_in = InputLayer(input_shape=(None, 25))
+        l_out = LogisticRegression(incoming=DenseLayer(incoming=l_in, n_units=10), n_class=10)
+        network = Network(name='memmap_network', layers=[l_in, l_out.input_layer, l_out])
+        init_params = [p.get_value() for p in network.params]
+
+        def train(data, **kwargs):
+            for param, value in zip(network.params, init_params):
+                param.set_value(value)
+            network.layers[0].input = None
+            np_rng.seed(1234)
+            model = Model(network=network, data=data, hyperparameters=hp)
+            report = model.train(**kwargs)
+            return report, [p.get_value() for p in network.params]
+
+        in_memory_report, in_memory_params = train(Data([(x, y), (x[:50], y[:50]), (x[:50], y[:50])]))
+        memmap_data = MemmapData([train_set, str(tmpdir.join('test.npz')), str(tmpdir.join('test.npz'))])
+        for prefetch in [0, 2, BatchPrefetcher(depth=2, n_workers=2, workers='process')]:
+            memmap_report, memmap_params = train(memmap_data, prefetch=prefetch)
+            assert 'data_stall' in memmap_report
+            assert memmap_report['validation_values'] == in_memory_report['validation_values']
+            for p1, p2 in zip(in_memory_params, memmap_params):
+                np.testing.assert_allclose(p1, p2, rtol=1e-5)
+
+    def test_bucket_sampler(self, hp):
+        from yadll.data import Data, BucketSampler, one_hot_encoding, pad_sequences, sequence_lengths
+        from yadll.layers import InputLayer, GRU, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        rng = np.random.RandomState(2)
+        x = pad_sequences([rng.rand(n, 3).astype('float32') + 0.1 for n in rng.randint(1, 8, size=60)])
+        y = one_hot_encoding(rng.randint(0, 2, size=(60, )), 1).astype('float32')
+        data = Data([(x, y), (x[:20], y[:20]), (x[:20], y[:20])], shared=False, mask_value=0.)
+        l_in = InputLayer(input_shape=(None, None, 3))
+        l_gru = GRU(incoming=l_in, n_units=4, mask_value=0.)
+        l_out = LogisticRegression(incoming=l_gru, n_class=2)
+        model = Model(network=Network(name='bucket_network', layers=[l_in, l_gru, l_out]), data=data,
+                      hyperparameters=hp)
+        sampler = BucketSampler(sequence_lengths(x), hp.batch_size, bucket_size=30)
+        report = model.train(sampler=sampler)
+        assert len(report['validation_values']) > 0
+
+    def test_tbptt(self, hp):
+        from yadll.data import Data
+        from yadll.layers import InputLayer, LSTM
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.objectives import mean_squared_error
+        from yadll.exceptions import DataFormatException
+        rng = np.random.RandomState(2)
+        x = rng.rand(40, 12, 2).astype('float32')
+        y = np.cumsum(x, axis=1) / 12
+        l_in = InputLayer(input_shape=(None, None, 2))
+        l_lstm = LSTM(incoming=l_in, n_units=2, last_only=False, stateful=True)
+        network = Network(name='tbptt_network', layers=[l_in, l_lstm])
+        model = Model(network=network, data=Data([(x, y), (x[:20], y[:20]), (x[:20], y[:20])], shared=False),
+                      hyperparameters=hp, objective=mean_squared_error)
+        model.compile(compile_arg=['train', 'validate', 'test'])
+        windows = []
+        train_func = model.train_func
+        model.train_func = lambda x, y: windows.append(x.shape[1]) or train_func(x, y)
+        report = model.train(tbptt=5)
+        assert windows[:3] == [5, 5, 2]
+        assert len(report['validation_values']) > 0
+        model = Model(network=network, data=Data([(x, y), (x, y)]), hyperparameters=hp)
+        with pytest.raises(DataFormatException):
+            model.train(tbptt=5)
+
+    def test_sequence_targets(self, hp):
+        from yadll.data import Data, pad_sequences
+        from yadll.layers import InputLayer, GRU
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.objectives import mean_squared_error
+        rng = np.random.RandomState(2)
+        sequences = [rng.rand(n, 2).astype('float32') + 0.1 for n in rng.randint(1, 8, size=40)]
+        x = pad_sequences(sequences, max_length=12)
+        y = pad_sequences([np.cumsum(s, axis=0) / 12 for s in sequences], max_length=12)
+        l_in = InputLayer(input_shape=(None, None, 2))
+        l_gru = GRU(incoming=l_in, n_units=2, last_only=False, mask_value=0., stateful=True)
+        model = Model(network=Network(name='sequence_targets', layers=[l_in, l_gru]), hyperparameters=hp,
+                      data=Data([(x, y), (x[:20], y[:20]), (x[:20], y[:20])], shared=False, mask_value=0.),
+                      objective=mean_squared_error)
+        model.compile(compile_arg=['train', 'validate', 'test'])
+        shapes = []
+        train_func = model.train_func
+        model.train_func = lambda x, y: shapes.append((x.shape, y.shape)) or train_func(x, y)
+        model.train(tbptt=3)
+        assert all(x_shape[:2] == y_shape[:2] and x_shape[1] <= 3 for x_shape, y_shape in shapes)
+        assert max(x_shape[1] for x_shape, _ in shapes) == 3
+
+    def test_masked_steps_per_call(self, hp):
+        from yadll.data import Data, pad_sequences
+        from yadll.layers import InputLayer, GRU
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.objectives import mean_squared_error
+        rng = np.random.RandomState(2)
+        sequences = [rng.rand(n, 2).astype('float32') + 0.1 for n in rng.randint(1, 8, size=40)]
+        x = pad_sequences(sequences, max_length=12)
+        y = pad_sequences([np.cumsum(s, axis=0) / 12 for s in sequences], max_length=12)
+        l_in = InputLayer(input_shape=(None, None, 2))
+        l_gru = GRU(incoming=l_in, n_units=2, last_only=False, mask_value=0.)
+        model = Model(network=Network(name='masked_steps', layers=[l_in, l_gru]), hyperparameters=hp,
+                      data=Data([(x, y), (x[:20], y[:20]), (x[:20], y[:20])], shared=False, mask_value=0.),
+                      objective=mean_squared_error)
+        model.compile(compile_arg=['train', 'validate', 'test', 'train_steps'], steps_per_call=2)
+        shapes = []
+        train_steps_func = model.train_steps_func
+        model.train_steps_func = lambda x, y: shapes.append((x.shape, y.shape)) or train_steps_func(x, y)
+        # the minibatches of a call are trimmed to different lengths and padded to the longest one
+        report = model.train(steps_per_call=2)
+        assert len(shapes) > 0
+        assert all(x_shape[:3] == y_shape[:3] and x_shape[1] == hp.batch_size for x_shape, y_shape in shapes)
+        assert np.isfinite(report['best_validation'])
+
+    def test_tbptt_states(self, tmpdir):
+        import theano
+        from yadll.data import Data
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.layers import InputLayer, LSTM
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.objectives import mean_squared_error
+        x = np.random.RandomState(2).rand(4, 12, 2).astype('float32')
+        y = np.cumsum(x, axis=1) / 12
+        hp = Hyperparameters()
+        hp('batch_size', 4)
+        hp('learning_rate', 0.)
+
+        def build():
+            l_in = InputLayer(input_shape=(None, None, 2))
+            l_lstm = LSTM(incoming=l_in, n_units=2, last_only=False, stateful=True)
+            model = Model(network=Network(name='tbptt_network', layers=[l_in, l_lstm]), hyperparameters=hp,
+                          data=Data([(x, y), (x, y), (x, y)], shared=False), objective=mean_squared_error,
+                          compile_cache=str(tmpdir))
+            model.compile(compile_arg='train')
+            return model, l_lstm
+        build()
+        # the states of a function loaded from the compile cache are the states of the layer
+        model, l_lstm = build()
+        assert model.report['compile_cache']['hits'] == 1
+        starts, ends = [], []
+        train_func = model.train_func
+
+        def recorded_train_func(x, y):
+            starts.append(l_lstm.h_state.get_value())
+            cost = train_func(x, y)
+            ends.append(l_lstm.h_state.get_value())
+            return cost
+        model.train_func = recorded_train_func
+        model.train_tbptt(x, y, window=5)
+        assert starts[0].shape == (0, 2)
+        for end, start in zip(ends[:-1], starts[1:]):
+            np.testing.assert_allclose(start, end)
+        # each window continues the recurrence of the whole sequence
+        full = theano.function([model.x], l_lstm.get_output(stochastic=False))(x)
+        for k, end in enumerate(ends):
+            np.testing.assert_allclose(end, full[:, min(5 * (k + 1), 12) - 1], rtol=1e-5, atol=1e-6)
+        model.train_tbptt(x, y, window=5, reset=False)
+        np.testing.assert_allclose(starts[3], ends[2])
+        model.train_tbptt(x, y, window=5)
+        assert starts[6].shape == (0, 2)
+
+    def test_predict_step(self, hp):
+        from yadll.layers import InputLayer, RNN, LSTM, GRU, Dropout, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        x = np.random.RandomState(2).rand(3, 6, 4).astype('float32')
+        l_in = InputLayer(input_shape=(None, None, 4))
+        l_rnn = RNN(incoming=l_in, n_units=5, last_only=False)
+        l_lstm = LSTM(incoming=l_rnn, n_units=5, peepholes=True, last_only=False)
+        l_gru = GRU(incoming=l_lstm, n_units=5, fused_params=True)
+        l_out = LogisticRegression(incoming=Dropout(l_gru, corruption_level=0.5), n_class=3)
+        network = Network(name='step_network', layers=[l_in, l_rnn, l_lstm, l_gru, l_out.input_layer, l_out])
+        model = Model(network=network, hyperparameters=hp)
+        model.data_shape = [((3, 6, 4), (3, 3))]
+        states = model.initial_states(3)
+        assert [s.shape for s in states] == [(3, 5)] * 4
+        for t in range(6):
+            y, states = model.predict_step(x[:, t], states)
+            np.testing.assert_allclose(y, model.predict(x[:, :t + 1]), rtol=1e-5, atol=1e-6)
+        # a bidirectional layer reads the whole sequence
+        from yadll.layers import Bidirectional
+        from yadll.exceptions import DlException
+        l_in = InputLayer(input_shape=(None, None, 4))
+        l_bi = Bidirectional(incoming=l_in, n_units=5)
+        model = Model(network=Network(name='bidirectional', layers=[l_in, l_bi]), hyperparameters=hp)
+        model.data_shape = [((3, 6, 4), (3, 10))]
+        with pytest.raises(DlException):
+            model.predict_step(x[:, 0])
+        with pytest.raises(DlException):
+            model.network.get_step_output(x[:, 0], [])
@@ -0,0 +1,194 @@
+# -*- coding: UTF-8 -*-
+import numpy as np
+import pytest
+
+
+class TestDataParallel:
+    @pytest.fixture(scope='module')
+    def data(self):
+        from yadll.data import Data, one_hot_encoding
+        rng = np.random.RandomState(42)
+        data = [[rng.random_sample((120, 25)).astype('float32'), one_hot_encoding(rng.randint(0, 10, size=(120, )), 9).astype('float32')],
+                [rng.random_sample((60, 25)).astype('float32'), one_hot_encoding(rng.randint(0, 10, size=(60, )), 9).astype('float32')],
+                [rng.random_sample((60, 25)).astype('float32'), one_hot_encoding(rng.randint(0, 10, size=(60, )), 9).astype('float32')]]
+        return data
+
+    def build_model(self, data, shared=True, updates=None):
+        from yadll.data import Data
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.updates import momentum
+        hp = Hyperparameters()
+        hp('batch_size', 12)
+        hp('n_epochs', 3)
+        hp('learning_rate', 0.1)
+        hp('momentum', 0.9)
+        hp('patience', 100)
+        l_in = InputLayer(input_shape=(None, 25))
+        l_hid = DenseLayer(incoming=l_in, n_units=10, l2=0.001)
+        l_out = LogisticRegression(incoming=l_hid, n_class=10)
+        network = Network(layers=[l_in, l_hid, l_out])
+        rng = np.random.RandomState(1)
+        for p in network.params:
+            p.set_value(rng.uniform(-0.1, 0.1, p.get_value().shape).astype('float32'))
+        return Model(network=network, data=Data(data, shared=shared), hyperparameters=hp,
+                     updates=updates or momentum)
+
+    def test_shared_array(self):
+        from yadll.parallel import shared_array
+        a = shared_array((2, 3))
+        assert a.shape == (2, 3) and a.dtype == 'float32'
+        assert not a.any()
+
+    @pytest.mark.parametrize('n_workers, shared', [(2, True), (5, True), (3, False)])
+    def test_train_data_parallel(self, data, n_workers, shared):
+        from yadll.parallel import train_data_parallel
+        from yadll.utils import np_rng
+        model = self.build_model(data, shared)
+        np_rng.seed(1234)
+        expected = dict(model.train())
+        expected_params = [p.get_value() for p in model.network.params]
+
+        model = self.build_model(data, shared)
+        np_rng.seed(1234)
+        report = train_data_parallel(model, n_workers=n_workers)
+        assert report['n_workers'] == n_workers
+        assert report['epoch'] == expected['epoch']
+        np.testing.assert_allclose(report['validation_values'], expected['validation_values'], rtol=1e-4)
+        for p, v in zip(model.network.params, expected_params):
+            np.testing.assert_allclose(p.get_value(), v, rtol=1e-3, atol=1e-5)
+
+    def test_evaluation(self, data, monkeypatch):
+        import multiprocessing
+        from yadll.model import Model
+        from yadll.parallel import train_data_parallel
+        from yadll.utils import np_rng
+        n_calls = multiprocessing.get_context('fork').Value('i', 0)
+        evaluate = Model.evaluate
+
+        def counted_evaluate(*args, **kwargs):
+            with n_calls.get_lock():
+                n_calls.value += 1
+            return evaluate(*args, **kwargs)
+        monkeypatch.setattr(Model, 'evaluate', counted_evaluate)
+        np_rng.seed(1234)
+        self.build_model(data).train()
+        expected, n_calls.value = n_calls.value, 0
+        np_rng.seed(1234)
+        train_data_parallel(self.build_model(data), n_workers=3)
+        # the validation and test sets are only evaluated by one worker
+        assert n_calls.value == expected
+
+    def test_buffers(self, data):
+        from yadll.data import Data
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.layers import InputLayer, DenseLayer, BatchNormalization, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.parallel import train_data_parallel
+        from yadll.utils import np_rng
+        hp = Hyperparameters()
+        hp('batch_size', 12)
+        hp('n_epochs', 2)
+        hp('learning_rate', 0.)
+        hp('patience', 100)
+
+        def build_model():
+            l_in = InputLayer(input_shape=(None, 25))
+            l_hid = DenseLayer(incoming=l_in, n_units=10)
+            l_hid.W.set_value(np.random.RandomState(1).uniform(-1, 1, (25, 10)).astype('float32'))
+            l_bn = BatchNormalization(incoming=l_hid)
+            l_out = LogisticRegression(incoming=l_bn, n_class=10)
+            return Model(network=Network(layers=[l_in, l_hid, l_bn, l_out]), data=Data(data), hyperparameters=hp)
+        model = build_model()
+        np_rng.seed(1234)
+        model.train()
+        expected = model.network.buffers[0].get_value()
+        model = build_model()
+        np_rng.seed(1234)
+        train_data_parallel(model, n_workers=2)
+        # the running mean is linear in the minibatch means, the mean of the
+        # replicas running means is the running mean of the whole minibatches
+        np.testing.assert_allclose(model.network.buffers[0].get_value(), expected, rtol=1e-4, atol=1e-6)
+
+
+class TestHogwild:
+    @pytest.fixture(scope='module')
+    def data(self):
+        from yadll.data import one_hot_encoding
+        rng = np.random.RandomState(42)
+        # learnable labels: the class is marked on the first 10 features
+        data = []
+        for n in [240, 60, 60]:
+            y = rng.randint(0, 10, size=(n, ))
+            x = rng.random_sample((n, 25)).astype('float32')
+            x[np.arange(n), y] += 2
+            data.append([x, one_hot_encoding(y, 9).astype('float32')])
+        return data
+
+    @pytest.mark.parametrize('n_workers, shared', [(1, True), (3, True), (2, False)])
+    def test_train_hogwild(self, data, n_workers, shared):
+        from yadll.parallel import train_hogwild
+        from yadll.updates import sgd
+        model = TestDataParallel().build_model(data, shared, updates=sgd)
+        model.hp.n_epochs = 10
+        model.hp.learning_rate = 0.2
+        report = train_hogwild(model, n_workers=n_workers, eval_frequency=0.01)
+        assert report['n_workers'] == n_workers
+        assert report['samples_per_sec'] > 0
+        # the updates of the workers are seen by the parent
+        assert report['validation_values'][-1][1] < report['validation_values'][0][1] - 40
+        assert report['best_validation'] == report['validation_values'][-1][1]
+        # the parameters are back in private memory
+        for p in model.network.params:
+            assert p.get_value(borrow=True).base is None
+
+    def test_update_rule(self, data):
+        from collections import OrderedDict
+        from yadll.parallel import train_hogwild
+        from yadll.updates import momentum
+
+        def frozen(cost, params, **kwargs):
+            return OrderedDict((param, param) for param in params)
+        # the steps are the ones of the update rule of the model
+        model = TestDataParallel().build_model(data, updates=frozen)
+        init_params = [p.get_value() for p in model.network.params]
+        train_hogwild(model, n_workers=2, eval_frequency=0.01)
+        for p, v in zip(model.network.params, init_params):
+            np.testing.assert_array_equal(p.get_value(), v)
+        model = TestDataParallel().build_model(data, updates=momentum)
+        model.hp.n_epochs = 10
+        report = train_hogwild(model, n_workers=2, eval_frequency=0.01)
+        assert report['validation_values'][-1][1] < report['validation_values'][0][1] - 40
+
+    def test_buffers(self, data):
+        from yadll.data import Data
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.layers import InputLayer, DenseLayer, BatchNormalization, LogisticRegression
+        from yadll.network import Network
+        from yadll.model import Model
+        from yadll.parallel import train_hogwild
+        hp = Hyperparameters()
+        hp('batch_size', 12)
+        hp('n_epochs', 2)
+        hp('learning_rate', 0.1)
+        l_in = InputLayer(input_shape=(None, 25))
+        l_bn = BatchNormalization(incoming=DenseLayer(incoming=l_in, n_units=10))
+        l_out = LogisticRegression(incoming=l_bn, n_class=10)
+        model = Model(network=Network(layers=[l_in, l_bn.input_layer, l_bn, l_out]), data=Data(data),
+                      hyperparameters=hp)
+        init_buffers = [b.get_value() for b in model.network.buffers]
+        train_hogwild(model, n_workers=2, eval_frequency=0.01)
+        # the running averages of all the workers are moved
+        for b, v in zip(model.network.buffers, init_buffers):
+            assert not np.allclose(b.get_value(), v)
+            assert b.get_value(borrow=True).base is None
+
+    def test_not_enough_batches(self, data):
+        from yadll.parallel import train_hogwild
+        from yadll.exceptions import DlException
+        model = TestDataParallel().build_model(data)
+        with pytest.raises(DlException):
+            train_hogwild(model, n_workers=100)
@@ -0,0 +1,122 @@
+# -*- coding: UTF-8 -*-
+import json
+
+import numpy as np
+import pytest
+
+
+def build_model(hp):
+    from yadll.data import Data, one_hot_encoding
+    from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+    from yadll.network import Network
+    from yadll.model import Model
+    rng = np.random.RandomState(42)
+    data = [[rng.random_sample((100, 25)).astype('float32'), one_hot_encoding(rng.randint(0, 10, size=(100, )), 9).astype('float32')],
+            [rng.random_sample((50, 25)).astype('float32'), one_hot_encoding(rng.randint(0, 10, size=(50, )), 9).astype('float32')],
+            [rng.random_sample((50, 25)).astype('float32'), one_hot_encoding(rng.randint(0, 10, size=(50, )), 9).astype('float32')]]
+    l_in = InputLayer(input_shape=(None, 25))
+    l_hid = DenseLayer(incoming=l_in, n_units=hp.n_units, l2=hp.shared('l2_reg'))
+    l_out = LogisticRegression(incoming=l_hid, n_class=10)
+    network = Network(layers=[l_in, l_hid, l_out])
+    return Model(network=network, data=Data(data), hyperparameters=hp)
+
+
+class TestSearch:
+    @pytest.fixture
+    def hp(self):
+        from yadll.hyperparameters import Hyperparameters
+        hp = Hyperparameters()
+        hp('batch_size', 10)
+        hp('n_epochs', 2)
+        hp('learning_rate', 0.1, [0.01, 0.1])
+        hp('l2_reg', 0.0, [0.0, 0.001])
+        hp('n_units', 5)
+        hp('patience', 100)
+        return hp
+
+    def test_reusable(self, hp):
+        from yadll.search import _reusable, build_hyperparameters
+        model = build_model(build_hyperparameters(hp.hp_value))
+        model.compile('train')
+        hp_value = dict(hp.hp_value)
+        assert _reusable(model, hp_value)
+        hp_value['learning_rate'] = 1.
+        hp_value['n_epochs'] = 10
+        assert _reusable(model, hp_value)
+        hp_value['n_units'] = 6
+        assert not _reusable(model, hp_value)
+        assert not _reusable(None, hp.hp_value)
+
+    def test_grid_search(self, tmpdir, hp):
+        from yadll.search import grid_search, load_results
+        results_file = str(tmpdir.join('results.jsonl'))
+        results = grid_search(build_model, hp, results_file, n_workers=0)
+        assert [r['trial'] for r in results] == [0, 1, 2, 3]
+        assert [r['hyperparameters'] for r in results] == [dict(p) for p in hp.hp_product]
+        assert all('best_validation' in r['report'] for r in results)
+        assert sorted(load_results(results_file)) == [0, 1, 2, 3]
+
+        # crash after two trials, the last line is incomplete
+        with open(results_file) as f:
+            lines = f.readlines()
+        with open(results_file, 'w') as f:
+            f.writelines(lines[:2])
+            f.write(lines[2][:10])
+        resumed = grid_search(build_model, hp, results_file, n_workers=2)
+        assert [r['trial'] for r in resumed] == [0, 1, 2, 3]
+        assert [r['hyperparameters'] for r in resumed] == [r['hyperparameters'] for r in results]
+        with open(results_file) as f:
+            new_trials = [json.loads(line)['trial'] for line in f.readlines()[2:]]
+        assert sorted(new_trials) == [2, 3]
+
+    def test_failed_trial(self, tmpdir, hp):
+        from yadll.search import run_trials, load_results
+        results_file = str(tmpdir.join('results.jsonl'))
+        trials = [dict(hp.hp_value), dict(hp.hp_value, n_units=-1)]
+        results = run_trials(build_model, trials, results_file, n_workers=0)
+        assert [r['trial'] for r in results] == [0]
+        with open(results_file) as f:
+            assert 'error' in json.loads(f.readlines()[1])
+        assert list(load_results(results_file)) == [0]
+
+    def test_lazy_trials(self, hp):
+        from yadll.search import run_trials
+        pulled, built = [], []
+
+        def trials():
+            for n_units in [5, 6, 7]:
+                pulled.append(n_units)
+                yield dict(hp.hp_value, n_units=n_units)
+
+        def builder(hp):
+            built.append(len(pulled))
+            return build_model(hp)
+        results = run_trials(builder, trials(), n_workers=0)
+        assert [r['trial'] for r in results] == [0, 1, 2]
+        # a trial is only enumerated when it is run
+        assert built == [1, 2, 3]
+
+    def test_successive_halving(self, hp):
+        from yadll.search import successive_halving
+        hp('learning_rate', 0.1, [0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1., 3., 10.])
+        hp('l2_reg', 0.0)
+        models = []
+        results = successive_halving(build_model, hp.hp_product, min_epochs=1, eta=3, models=models)
+        assert len(results) == 9
+        assert sorted(r['epochs'] for r in results) == [1] * 6 + [3] * 2 + [9]
+        assert results[0]['epochs'] == 9
+        assert sorted(r['trial'] for r in results) == list(range(9))
+        # all the trials only differ by a shared hyperparameter
+        assert len(models) == 1
+        assert all(np.isfinite(r['validation']) for r in results)
+
+    def test_hyperband(self, hp):
+        from yadll.search import hyperband
+        hp('learning_rate', 0.1, [0.001, 0.01, 0.1, 1.])
+        hp('n_units', 5, [5, 6])
+        results = hyperband(build_model, hp, max_epochs=3, eta=3, seed=1)
+        assert len(results) == 5
+        assert sorted(r['bracket'] for r in results) == [0, 0, 1, 1, 1]
+        assert sorted(r['epochs'] for r in results if r['bracket'] == 1) == [1, 1, 3]
+        assert all(r['epochs'] == 3 for r in results if r['bracket'] == 0)
+        assert results == sorted(results, key=lambda r: r['validation'])
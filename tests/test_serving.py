@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+import json
+import socket
+import threading
+import http.client
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+
+class Doubler(object):
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, x):
+        self.calls.append(len(x))
+        if np.any(x < 0):
+            raise ValueError('negative input')
+        return 2 * x
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def request(connection, method, url, body=None):
+    connection.request(method, url, body=None if body is None else json.dumps(body))
+    response = connection.getresponse()
+    return response.status, json.loads(response.read().decode())
+
+
+class TestBatchPredictor:
+    def test_coalesce(self):
+        from yadll.serving import BatchPredictor
+        model = Doubler()
+        predictor = BatchPredictor(model, max_batch_size=16, max_latency=0.2)
+        results = {}
+
+        def client(i):
+            results[i] = predictor.predict(np.full((1, 3), i, dtype='float32'))
+        threads = [threading.Thread(target=client, args=(i, )) for i in range(40)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        predictor.close()
+        for i in range(40):
+            assert_allclose(results[i], np.full((1, 3), 2 * i))
+        assert sum(model.calls) == 40
+        assert 1 < max(model.calls) <= 16
+        stats = predictor.stats()
+        assert stats['requests'] == 40
+        assert stats['batches'] == len(model.calls)
+        assert sum(k * v for k, v in stats['batch_sizes'].items()) == 40
+        assert 0 < stats['latency_p50'] <= stats['latency_p99']
+
+    def test_deadline(self):
+        from yadll.serving import BatchPredictor
+        predictor = BatchPredictor(Doubler(), max_batch_size=64, max_latency=0.01)
+        y = predictor.predict(np.ones((3, 2)))
+        assert y.shape == (3, 2)
+        assert predictor.stats()['latency_p99'] < 1
+        predictor.close()
+
+    def test_error(self):
+        from yadll.serving import BatchPredictor
+        from yadll.exceptions import DlException
+        predictor = BatchPredictor(Doubler(), max_latency=0.001)
+        with pytest.raises(ValueError):
+            predictor.predict(-np.ones((1, 2)))
+        assert_allclose(predictor.predict(np.ones((1, 2))), 2)
+        predictor.close()
+        with pytest.raises(DlException):
+            predictor.predict(np.ones((1, 2)))
+
+    def test_concurrent_stats(self):
+        from yadll.serving import BatchPredictor
+        predictor = BatchPredictor(Doubler(), max_batch_size=4, max_latency=0.0001)
+        errors = []
+
+        def client():
+            for _ in range(200):
+                predictor.predict(np.ones((1, 2)))
+
+        def reader():
+            try:
+                for _ in range(500):
+                    predictor.stats()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=client) for _ in range(4)] + [threading.Thread(target=reader)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        predictor.close()
+        assert errors == []
+        assert predictor.stats()['requests'] == 800
+
+
+class TestInferenceServer:
+    @pytest.fixture(scope='class')
+    def model(self):
+        from yadll.layers import InputLayer, DenseLayer, LogisticRegression
+        from yadll.network import Network
+        from yadll.hyperparameters import Hyperparameters
+        from yadll.model import Model
+        l_in = InputLayer(input_shape=(None, 5), name='input')
+        l_hid = DenseLayer(l_in, n_units=4, name='hidden')
+        l_out = LogisticRegression(l_hid, n_class=3, name='output')
+        model = Model(network=Network('serving', layers=[l_in, l_hid, l_out]),
+                      hyperparameters=Hyperparameters(), name='serving_model')
+        model.data_shape = [((10, 5), (10, 3))]
+        return model
+
+    def test_http(self, model):
+        from yadll.serving import InferenceServer
+        x = np.random.RandomState(1).rand(4, 5).astype('float32')
+        with InferenceServer(model, max_latency=0.001) as server:
+            connection = http.client.HTTPConnection(*server.address)
+            status, body = request(connection, 'POST', '/predict', {'inputs': x.tolist()})
+            assert status == 200
+            assert_allclose(body['outputs'], model.predict(x), rtol=1e-5)
+            status, body = request(connection, 'POST', '/predict', {'rows': []})
+            assert status == 400
+            status, body = request(connection, 'GET', '/stats')
+            assert status == 200
+            assert body['requests'] == 1
+            assert body['batch_sizes'] == {'4': 1}
+            status, body = request(connection, 'GET', '/unknown')
+            assert status == 404
+
+    def test_unix_socket(self, model, tmpdir):
+        import os
+        from yadll.serving import InferenceServer
+        path = str(tmpdir.join('yadll.sock'))
+        x = np.random.RandomState(1).rand(1, 5).astype('float32')
+        with InferenceServer(model, path) as server:
+            assert server.address == path
+            status, body = request(UnixHTTPConnection(path), 'POST', '/predict', {'inputs': x.tolist()})
+            assert status == 200
+            assert_allclose(body['outputs'], model.predict(x), rtol=1e-5)
+        assert not os.path.exists(path)
@@ -74,3 +74,19 @@ class TestUpdateFunctions(object):
         print(self.toy_values[method])
         assert np.allclose(A.get_value(), B.get_value())
         assert np.allclose(A.get_value(), self.toy_values[method])
+
+    @pytest.mark.parametrize('method', ['sgd', 'momentum', 'adagrad', 'adam'])
+    def test_updates_from_grads(self, method):
+        A = yadll.utils.shared_variable([1, 1, 1])
+        B = yadll.utils.shared_variable([1, 1, 1])
+        update_func = getattr(yadll.updates, method)
+        grads = theano.tensor.grad(self.f(A) + self.f(B), [A, B])
+        do_update = theano.function([], [], updates=update_func(grads, [A, B]))
+        for _ in range(10):
+            do_update()
+        C = yadll.utils.shared_variable([1, 1, 1])
+        do_update = theano.function([], [], updates=update_func(self.f(C), [C]))
+        for _ in range(10):
+            do_update()
+        assert np.allclose(A.get_value(), C.get_value())
+        pytest.raises(ValueError, update_func, grads, [A])
@@ -1,5 +1,6 @@
 # -*- coding: UTF-8 -*-
 import time
+import pytest
 import numpy as np
 import theano
 
@@ -48,3 +49,31 @@ def test_timer(caplog):
     assert float(msg_split[2]) >= 1.
     assert msg_split[3] == 's'
 
+
+
+@pytest.mark.parametrize('module', ['yadll', 'yadll.data', 'yadll.hyperparameters', 'yadll.inference'])
+def test_lazy_import(module):
+    import subprocess
+    import sys
+    code = 'import sys, %s; assert "theano" not in sys.modules' % module
+    assert subprocess.call([sys.executable, '-c', code]) == 0
+    code = 'import sys, yadll; yadll.utils.floatX; assert "theano" in sys.modules'
+    assert subprocess.call([sys.executable, '-c', code]) == 0
+
+
+def test_lazy_submodule():
+    import yadll
+    from yadll.layers import DenseLayer
+    assert yadll.layers.DenseLayer is DenseLayer
+    assert 'model' in dir(yadll)
+    with pytest.raises(AttributeError):
+        yadll.not_a_module
+
+
+def test_lazy_python36():
+    # module level __getattr__ is ignored before python 3.7, the lazy names are resolved by the module type
+    import yadll
+    import yadll.utils
+    assert '__getattr__' not in vars(yadll)
+    assert '__getattr__' not in vars(yadll.utils)
+    assert all(hasattr(yadll.utils, name) for name in yadll.utils.__all__)
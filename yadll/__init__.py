@@ -1,16 +1,30 @@
 # -*- coding: UTF-8 -*-
-
-from . import activations
-from . import data
-from . import exceptions
-from . import hyperparameters
-from . import init
-from . import layers
-from . import model
-from . import network
-from . import objectives
-from . import updates
-from . import utils
+"""
+The submodules are imported on first access, i.e. `yadll.data` only loads
+numpy while `yadll.model` loads theano.
+"""
+import sys
+import types
+import importlib
 
 __version__ = '0.0.1'
 
+__all__ = ['activations', 'artifact', 'cache', 'checkpoint', 'data', 'exceptions', 'hyperparameters',
+           'inference', 'init', 'layers', 'model', 'network', 'objectives', 'parallel', 'search', 'serving',
+           'updates', 'utils']
+
+
+class _LazyPackage(types.ModuleType):
+    # a module type with __getattr__ rather than a module level __getattr__ (PEP 562),
+    # which is only supported from python 3.7
+    def __getattr__(self, name):
+        if name not in __all__:
+            raise AttributeError('module %r has no attribute %r' % (__name__, name))
+        # import_module sets the submodule as an attribute of the package
+        return importlib.import_module('.' + name, __name__)
+
+    def __dir__(self):
+        return sorted(list(globals()) + __all__)
+
+
+sys.modules[__name__].__class__ = _LazyPackage
@@ -0,0 +1,178 @@
+# -*- coding: UTF-8 -*-
+"""
+Pickle-free model artifacts.
+
+An artifact is a directory holding two files:
+
+* `model.json`, the version of the format, the conf of the model from
+  :meth:`yadll.model.Model.to_conf` and the layout of the parameters and of
+  the buffers (running averages) of the network
+* `params.bin`, the values of all the parameters then all the buffers in one
+  binary blob, each array starting on an `ALIGNMENT` bytes boundary
+
+The blob can be memory-mapped read-only, so that loading a model does not read
+the weights and the processes serving a model on one host share one copy of them.
+"""
+import os
+import sys
+import json
+
+import numpy as np
+
+import yadll
+from .utils import json_default
+from .exceptions import *
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_VERSION = 1
+ALIGNMENT = 64
+CONF_FILE = 'model.json'
+PARAMS_FILE = 'params.bin'
+
+
+def _encode(obj):
+    # tuples are kept apart from lists so that shapes come back as tuples
+    if isinstance(obj, tuple):
+        return {'__tuple__': [_encode(o) for o in obj]}
+    if isinstance(obj, list):
+        return [_encode(o) for o in obj]
+    if isinstance(obj, dict):
+        return dict((str(k), _encode(v)) for k, v in obj.items())
+    if 'theano' in sys.modules and isinstance(obj, sys.modules['theano'].compile.SharedVariable):
+        return _encode(obj.get_value().tolist())
+    return obj
+
+
+def _decode(obj):
+    if '__tuple__' in obj:
+        return tuple(obj['__tuple__'])
+    return obj
+
+
+def save_artifact(model, path):
+    """
+    Save a model as a pickle-free artifact
+
+    Parameters
+    ----------
+    model : :class:`yadll.model.Model`
+        the model to save, its data is not saved
+    path : `string`
+        directory of the artifact, created if needed. The files are written to
+        temporary files and renamed, so a reader never sees a partial artifact
+
+    Examples
+    --------
+
+    >>> save_artifact(my_model, 'my_model')
+
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    variables = model.network.params + model.network.buffers
+    layout = []
+    offset = 0
+    for variable in variables:
+        value = variable.get_value(borrow=True)
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout.append({'name': variable.name, 'dtype': value.dtype.name, 'shape': list(value.shape),
+                       'offset': offset})
+        offset += value.nbytes
+    params_file = os.path.join(path, PARAMS_FILE)
+    with open(params_file + '.tmp', 'wb') as f:
+        for entry, param in zip(layout, variables):
+            f.write(b'\0' * (entry['offset'] - f.tell()))
+            f.write(np.ascontiguousarray(param.get_value(borrow=True)).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    conf = {'format': 'yadll', 'version': ARTIFACT_VERSION, 'byteorder': sys.byteorder,
+            'model': _encode(model.to_conf()), 'params': layout[:len(model.network.params)],
+            'buffers': layout[len(model.network.params):]}
+    conf_file = os.path.join(path, CONF_FILE)
+    with open(conf_file + '.tmp', 'w') as f:
+        json.dump(conf, f, indent=1, default=json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(params_file + '.tmp', params_file)
+    os.replace(conf_file + '.tmp', conf_file)
+
+
+def read_artifact(path, mmap_mode='r'):
+    """
+    Read the conf and the parameters of an artifact without building the model
+
+    Parameters
+    ----------
+    path : `string`
+        directory of the artifact
+    mmap_mode : {'r', 'c', None}, (default is 'r')
+        see :func:`load_artifact`
+
+    Returns
+    -------
+        the conf of the artifact, the list of the values of the parameters and
+        the list of the values of the buffers
+    """
+    with open(os.path.join(path, CONF_FILE)) as f:
+        conf = json.load(f, object_hook=_decode)
+    if conf.get('format') != 'yadll':
+        raise DlException('%s is not a yadll artifact' % path)
+    if conf['version'] > ARTIFACT_VERSION:
+        raise DlException('Artifact version %i is not supported, latest is %i'
+                          % (conf['version'], ARTIFACT_VERSION))
+    if conf['byteorder'] != sys.byteorder:
+        raise DlException('Artifact was saved on a %s endian machine' % conf['byteorder'])
+    params_file = os.path.join(path, PARAMS_FILE)
+    if mmap_mode is None:
+        blob = np.empty(os.path.getsize(params_file), dtype=np.uint8)
+        with open(params_file, 'rb') as f:
+            f.readinto(blob)
+    else:
+        blob = np.memmap(params_file, dtype=np.uint8, mode=mmap_mode)
+    values = [[np.ndarray(tuple(entry['shape']), dtype=entry['dtype'], buffer=blob, offset=entry['offset'])
+               for entry in conf[key]] for key in ['params', 'buffers']]
+    return conf, values[0], values[1]
+
+
+def load_artifact(path, mmap_mode='r'):
+    """
+    Load a model saved with :func:`save_artifact`
+
+    Parameters
+    ----------
+    path : `string`
+        directory of the artifact
+    mmap_mode : {'r', 'c', None}, (default is 'r')
+        'r', the parameters are read-only views of the memory-mapped blob, shared
+        by all the processes mapping it. The model can predict but not be trained.
+        'c', copy-on-write views, the pages written by the training are private.
+        None, the parameters are read in memory.
+
+    Returns
+    -------
+        a :class:`yadll.model.Model` without data
+
+    Examples
+    --------
+
+    >>> my_model = load_artifact('my_model')
+    >>> my_model.predict(X)
+
+    """
+    conf, values, buffer_values = read_artifact(path, mmap_mode)
+    model = yadll.model.Model()
+    # the parameters are not initialized, their values come from the blob
+    with yadll.init.skip_initialization():
+        model.from_conf(conf['model'])
+    params = model.network.params
+    if len(params) != len(conf['params']):
+        raise DlException('Artifact has %i parameters, network has %i' % (len(conf['params']), len(params)))
+    buffers = model.network.buffers
+    if len(buffers) != len(buffer_values):
+        raise DlException('Artifact has %i buffers, network has %i' % (len(buffer_values), len(buffers)))
+    for variable, value in zip(params + buffers, values + buffer_values):
+        variable.set_value(value, borrow=True)
+    return model
@@ -0,0 +1,258 @@
+# -*- coding: UTF-8 -*-
+"""
+Persistent on-disk cache of compiled Theano functions.
+
+A compiled function is stored with its optimized graph, so loading it from
+the cache skips the graph optimization done by `theano.function`.
+The shared variables of the model (parameters, data, ...) are pickled as
+references to their names, so the cache holds no values and a cached function
+is bound on load to the shared variables of any structurally identical model.
+The random states of a cached function (dropout masks, noise) are drawn on load
+from the random streams of the model, so that seeding them seeds the function.
+"""
+import os
+import sys
+import json
+import pickle
+import hashlib
+import timeit
+
+import numpy as np
+
+from .utils import format_sec, json_default
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the graphs of scan (recurrent layers) are deeper than the default recursion limit of pickle
+RECURSION_LIMIT = 50000
+
+
+def default_cache_dir():
+    """
+    Default location of the cache: `~/.yadll/compile_cache`
+    """
+    return os.path.join(os.path.expanduser('~'), '.yadll', 'compile_cache')
+
+
+def hash_conf(conf):
+    """
+    Stable hash of a conf object
+
+    Parameters
+    ----------
+    conf : json serializable object
+        functions are represented by their module and name
+
+    Returns
+    -------
+        hexadecimal sha1 digest
+    """
+    dump = json.dumps(conf, sort_keys=True, default=json_default)
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+
+def _shape_structure(shape):
+    # symbolic dimensions set while building the graph (i.e. by Dropout) are unknown dimensions
+    if isinstance(shape, (list, tuple)):
+        return [_shape_structure(dim) for dim in shape]
+    if isinstance(shape, (int, np.integer)):
+        return int(shape)
+    return None
+
+
+def network_structure(network_conf):
+    """
+    Remove the names and ids from a :class:`yadll.network.Network` conf so that
+    two networks built the same way share the same structure.
+    Symbolic dimensions of the shapes are replaced by None so that the structure
+    is the same before and after building the graph.
+    """
+    layers = list(network_conf['layers'].values())
+    positions = dict((name, i) for i, name in enumerate(network_conf['layers'].keys()))
+    structure = []
+    for layer_conf in layers:
+        conf = dict((k, v) for k, v in layer_conf.items() if k not in ('id', 'name'))
+        for k in conf:
+            if k.endswith('shape'):
+                conf[k] = _shape_structure(conf[k])
+        input_layer = conf.get('input_layer')
+        if isinstance(input_layer, list):
+            conf['input_layer'] = [positions.get(name) for name in input_layer]
+        elif input_layer is not None:
+            conf['input_layer'] = positions.get(input_layer)
+        structure.append(conf)
+    return structure
+
+
+class _recursion_limit(object):
+    def __enter__(self):
+        self.limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(self.limit, RECURSION_LIMIT))
+
+    def __exit__(self, *args):
+        sys.setrecursionlimit(self.limit)
+
+
+class _Pickler(pickle.Pickler):
+    # the shared variables of the model, their containers, the storage the compiled
+    # functions share with them and their values are pickled as references to their names
+    def __init__(self, file, shared_variables):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.references = {}
+        for name, variable in shared_variables.items():
+            if variable is not None:
+                self.references[id(variable)] = ('variable', name)
+                self.references[id(variable.container)] = ('container', name)
+                self.references[id(variable.container.storage)] = ('storage', name)
+                self.references[id(variable.container.data)] = ('data', name)
+
+    def persistent_id(self, obj):
+        return self.references.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, shared_variables):
+        pickle.Unpickler.__init__(self, file)
+        self.shared_variables = shared_variables
+
+    def persistent_load(self, pid):
+        kind, name = pid
+        variable = self.shared_variables[name]
+        if kind == 'variable':
+            return variable
+        if kind == 'container':
+            return variable.container
+        if kind == 'storage':
+            return variable.container.storage
+        return variable.container.data
+
+
+def _reseed(func, random_streams):
+    # the random states pickled with the function are replaced by new streams of
+    # random_streams and registered to it, as if the graph had been built with it
+    for variable in [i.variable for i in func.maker.inputs]:
+        if getattr(variable.tag, 'is_rng', False) and getattr(variable, 'default_update', None) is not None:
+            n_streams = variable.get_value(borrow=True).shape[0]
+            dtype = variable.default_update.owner.outputs[1].dtype
+            variable.set_value(random_streams.get_substream_rstates(n_streams, dtype), borrow=True)
+            random_streams.state_updates.append((variable, variable.default_update, None, n_streams))
+
+
+class CompileCache(object):
+    """
+    Persistent on-disk cache of compiled Theano functions
+
+    Parameters
+    ----------
+    path : `string`, optional
+        cache directory, default is `~/.yadll/compile_cache`
+
+    Attributes
+    ----------
+    hits : `int`
+        number of functions loaded from the cache
+    misses : `int`
+        number of functions that had to be compiled
+    time_saved : `float`
+        compile time saved in seconds
+
+    Examples
+    --------
+    >>> model = Model(network, data, hp, compile_cache=True)
+    >>> model.compile('all')
+    >>> model.report['compile_cache']
+    {'hits': 3, 'misses': 0, 'time_saved': '42.101 s'}
+
+    """
+    def __init__(self, path=None):
+        self.path = path or default_cache_dir()
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.
+
+    def file(self, key):
+        return os.path.join(self.path, key + '.ytf')
+
+    def load(self, key, shared_variables, random_streams=None):
+        """
+        Load a function from the cache and bind it to shared variables
+
+        Parameters
+        ----------
+        key : `string`
+            the key of the function
+        shared_variables : `dict`
+            name to shared variable of the model
+        random_streams : `MRG_RandomStreams`, optional
+            random streams the random states of the function are drawn from,
+            i.e. :data:`yadll.utils.T_rng`
+
+        Returns
+        -------
+            the compiled function or None if it is not in the cache
+        """
+        file = self.file(key)
+        if not os.path.isfile(file):
+            self.misses += 1
+            return None
+        start_time = timeit.default_timer()
+        try:
+            with open(file, 'rb') as f, _recursion_limit():
+                entry = _Unpickler(f, shared_variables).load()
+            func = entry['function']
+            # pickle returns the outputs as a list, keep the calling convention of the original function
+            func.unpack_single = entry['unpack_single']
+            func.return_none = entry['return_none']
+            if random_streams is not None:
+                _reseed(func, random_streams)
+        except Exception as e:
+            logger.warning('Compile cache entry %s could not be loaded: %s' % (key, e))
+            self.misses += 1
+            return None
+        load_time = timeit.default_timer() - start_time
+        self.hits += 1
+        self.time_saved += max(0., entry['compile_time'] - load_time)
+        return func
+
+    def save(self, key, func, shared_variables, compile_time):
+        """
+        Save a compiled function in the cache
+
+        Parameters
+        ----------
+        key : `string`
+            the key of the function
+        func : compiled theano function
+            the function to cache
+        shared_variables : `dict`
+            name to shared variable of the model. They are not saved with the function
+        compile_time : `float`
+            time it took to compile the function
+        """
+        try:
+            entry = {'function': func, 'compile_time': compile_time,
+                     'unpack_single': func.unpack_single, 'return_none': func.return_none}
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            tmp_file = self.file(key) + '.%i.tmp' % os.getpid()
+            with open(tmp_file, 'wb') as f, _recursion_limit():
+                _Pickler(f, shared_variables).dump(entry)
+            os.replace(tmp_file, self.file(key))
+        except Exception as e:
+            logger.warning('Function could not be saved in the compile cache: %s' % e)
+
+    def clear(self):
+        """
+        Remove all the cached functions
+        """
+        if os.path.isdir(self.path):
+            for file in os.listdir(self.path):
+                if file.endswith('.ytf'):
+                    os.remove(os.path.join(self.path, file))
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'time_saved': format_sec(self.time_saved)}
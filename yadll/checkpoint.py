@@ -0,0 +1,236 @@
+# -*- coding: UTF-8 -*-
+"""
+Asynchronous checkpoints of the training state.
+
+A checkpoint only holds the parameters and the optimizer state of a model,
+not the data. The training loop takes an in-memory copy of the state and a
+background thread writes it to disk. Checkpoints taken by
+:meth:`yadll.model.Model.train` also hold the progress of the training
+(position in the epoch, random state, early stopping) so that the training
+can be resumed.
+"""
+import os
+import re
+import json
+import threading
+
+from .utils import *
+from .exceptions import *
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROGRESS = '__progress__'
+PROGRESS_ARRAY = 'progress_'
+
+
+class Checkpointer(object):
+    """
+    Write checkpoints of a model from a background thread
+
+    Checkpoints are `.npz` files named `<prefix>_<step>.npz`. They are written to
+    a temporary file and renamed, so a checkpoint on disk is always complete.
+    Only the last `keep` checkpoints are kept. If a new snapshot is taken while
+    the previous one is still waiting to be written, the previous one is dropped.
+    The snapshots of the best models are also written to `<prefix>_best.npz`,
+    which is never removed, so the best model is kept whatever the number of
+    checkpoints taken after it.
+
+    Parameters
+    ----------
+    path : `string`
+        directory of the checkpoints
+    keep : `int`, (default is 3)
+        number of checkpoints kept on disk
+    prefix : `string`, (default is 'checkpoint')
+        prefix of the file names
+
+    Examples
+    --------
+    >>> checkpointer = Checkpointer('my_model_checkpoints', keep=2)
+    >>> model.train(save_mode='each', checkpoint=checkpointer)
+    >>> checkpointer.restore(model)
+    >>> checkpointer.restore(model, checkpointer.best())
+
+    """
+    def __init__(self, path, keep=3, prefix='checkpoint'):
+        self.path = path
+        self.keep = keep
+        self.prefix = prefix
+        self.pattern = re.compile(re.escape(prefix) + r'_(\d+)\.npz$')
+        self.best_file = os.path.join(path, '%s_best.npz' % prefix)
+        self.n_written = 0
+        self.n_dropped = 0
+        self._pending = None
+        self._pending_best = None
+        self._error = None
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def save(self, model, step, progress=None, best=False):
+        """
+        Snapshot the state of the model and write it in the background
+
+        Parameters
+        ----------
+        model : :class:`yadll.model.Model`
+            the model to checkpoint
+        step : `int`
+            training iteration, used in the file name
+        progress : `dict`, optional
+            progress of the training, json serializable values and numpy arrays
+        best : `bool`, (default is False)
+            the model is the best one so far, the snapshot is also written to `best_file`
+        """
+        # the only blocking part: a copy of the values
+        snapshot = dict((name, variable.get_value()) for name, variable in model.state_variables().items())
+        if progress is not None:
+            values = {}
+            for key, value in progress.items():
+                if isinstance(value, np.ndarray):
+                    snapshot[PROGRESS_ARRAY + key] = value.copy()
+                else:
+                    values[key] = value
+            snapshot[PROGRESS] = np.array(json.dumps(values, default=json_default))
+        with self._condition:
+            self._raise_error()
+            if self._closed:
+                raise DlException('Checkpointer is closed')
+            if self._pending is not None:
+                self.n_dropped += 1
+            self._pending = (step, snapshot)
+            if best:
+                self._pending_best = snapshot
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name='yadll-checkpointer')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                (step, snapshot), best_snapshot = self._pending, self._pending_best
+                self._pending = self._pending_best = None
+                self._busy = True
+            try:
+                self._write(step, snapshot)
+                if best_snapshot is not None:
+                    self._write_file(self.best_file, best_snapshot)
+            except Exception as e:
+                logger.error('Checkpoint %i could not be written: %s' % (step, e))
+                with self._condition:
+                    self._error = e
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def _write(self, step, snapshot):
+        self._write_file(os.path.join(self.path, '%s_%i.npz' % (self.prefix, step)), snapshot)
+        self.n_written += 1
+        for old_file in self.files()[:-self.keep]:
+            os.remove(old_file)
+
+    def _write_file(self, file, snapshot):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp_file = file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait(self):
+        """
+        Block until the pending checkpoint is written
+        """
+        with self._condition:
+            while self._pending is not None or self._busy:
+                self._condition.wait()
+            self._raise_error()
+
+    def close(self):
+        """
+        Write the pending checkpoint and stop the background thread
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._condition:
+            self._raise_error()
+
+    def files(self):
+        """
+        Checkpoint files on disk, from the oldest to the latest
+        """
+        if not os.path.isdir(self.path):
+            return []
+        steps = []
+        for file in os.listdir(self.path):
+            match = self.pattern.match(file)
+            if match:
+                steps.append((int(match.group(1)), os.path.join(self.path, file)))
+        return [file for _, file in sorted(steps)]
+
+    def latest(self):
+        """
+        Latest checkpoint file or None
+        """
+        files = self.files()
+        return files[-1] if files else None
+
+    def best(self):
+        """
+        Checkpoint file of the best model or None
+        """
+        return self.best_file if os.path.isfile(self.best_file) else None
+
+    def restore(self, model, file=None):
+        """
+        Set the parameters and optimizer state of a model from a checkpoint
+
+        Parameters
+        ----------
+        model : :class:`yadll.model.Model`
+            the model to restore, it must be compiled if the checkpoint has an optimizer state
+        file : `string`, optional
+            checkpoint file, default is the latest one
+
+        Returns
+        -------
+            the progress of the training saved with the checkpoint or None
+        """
+        file = file or self.latest()
+        if file is None:
+            raise DlException('No checkpoint found in %s' % self.path)
+        variables = model.state_variables()
+        with np.load(file) as values:
+            names = [name for name in values.files if name != PROGRESS and not name.startswith(PROGRESS_ARRAY)]
+            missing = [name for name in names if name not in variables]
+            if missing:
+                raise DlException('Checkpoint %s does not match the model: %s' % (file, ', '.join(missing)))
+            for name in names:
+                variables[name].set_value(values[name])
+            if PROGRESS not in values.files:
+                return None
+            progress = json.loads(str(values[PROGRESS]))
+            for name in values.files:
+                if name.startswith(PROGRESS_ARRAY):
+                    progress[name[len(PROGRESS_ARRAY):]] = values[name]
+        return progress
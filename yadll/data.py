@@ -2,10 +2,17 @@
 import os
 import pickle
 import gzip
+import timeit
+import struct
+import zipfile
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
-import theano.tensor as T
+import numpy as np
 
-from .utils import *
+from .utils import intX, shared_variable, to_float_X
+from .exceptions import DataFormatException
 
 
 def normalize(x):
@@ -137,6 +144,114 @@ def one_hot_decoding(mat):
     return np.argmax(mat, axis=1)
 
 
+def pad_sequences(sequences, max_length=None, value=0., dtype=None):
+    """
+    Pad variable length sequences into an array
+
+    Parameters
+    ----------
+    sequences : `list` of numpy arrays
+        sequences of shape (n_time_steps, n_dim)
+    max_length : `int`, optional
+        number of time steps of the array, longer sequences are truncated.
+        Default is the length of the longest sequence
+    value : `float`, (default is 0.)
+        value of the padding steps, the `mask_value` of the recurrent layers
+    dtype : `string`, optional
+        type of the array, default is the type of the first sequence
+
+    Returns
+    -------
+        array of shape (n_sequences, max_length, n_dim) padded after the end of the sequences
+
+    Examples
+    --------
+    >>> pad_sequences([np.ones((2, 1)), np.ones((3, 1))])[:, :, 0]
+    array([[ 1.,  1.,  0.],
+           [ 1.,  1.,  1.]])
+    """
+    if max_length is None:
+        max_length = max(len(seq) for seq in sequences)
+    first = np.asarray(sequences[0])
+    x = np.full((len(sequences), max_length) + first.shape[1:], value, dtype=dtype or first.dtype)
+    for i, seq in enumerate(sequences):
+        seq = np.asarray(seq)[:max_length]
+        x[i, :len(seq)] = seq
+    return x
+
+
+def sequence_lengths(x, mask_value=0.):
+    """
+    Length of padded sequences
+
+    Parameters
+    ----------
+    x : numpy array
+        padded sequences of shape (n_sequences, n_time_steps, ...)
+    mask_value : `float`, (default is 0.)
+        value of the padding steps, a step is padding when all its features equal it
+
+    Returns
+    -------
+        vector of the number of time steps up to the last non padding step of each sequence
+    """
+    steps = np.any(np.asarray(x).reshape(x.shape[:2] + (-1, )) != mask_value, axis=2)
+    return np.where(steps.any(axis=1), x.shape[1] - np.argmax(steps[:, ::-1], axis=1), 0)
+
+
+def trim_sequences(x, mask_value=0., y=None):
+    """
+    Remove the padding steps shared by all the sequences of a minibatch
+
+    Parameters
+    ----------
+    x : numpy array
+        padded sequences of shape (n_sequences, n_time_steps, ...)
+    mask_value : `float`, (default is 0.)
+        value of the padding steps
+    y : numpy array, optional
+        targets of the sequences. Targets of each time step, of shape
+        (n_sequences, n_time_steps, n_dim), are cut as `x`
+
+    Returns
+    -------
+        view of `x` cut after the longest sequence, and `y` if given
+    """
+    length = max(int(sequence_lengths(x, mask_value).max()), 1)
+    if y is None:
+        return x[:, :length]
+    if np.ndim(y) > 2 and y.shape[1] == x.shape[1]:
+        y = y[:, :length]
+    return x[:, :length], y
+
+
+def stack_steps(steps_x, steps_y, mask_value=None):
+    """
+    Stack the minibatches of a multi-step training call on a new first axis
+
+    Parameters
+    ----------
+    steps_x : `list` of numpy arrays
+        inputs of the minibatches
+    steps_y : `list` of numpy arrays
+        targets of the minibatches
+    mask_value : `float`, optional
+        value of the padding steps. Minibatches of sequences trimmed to their own
+        longest sequence are padded to the longest one, and so are their targets
+        of each time step
+
+    Returns
+    -------
+        the stacked inputs and the stacked targets
+    """
+    if mask_value is not None:
+        length = max(x.shape[1] for x in steps_x)
+        steps_y = [pad_sequences(y, length, mask_value) if np.ndim(y) > 2 and y.shape[1] == x.shape[1] else y
+                   for x, y in zip(steps_x, steps_y)]
+        steps_x = [pad_sequences(x, length, mask_value) for x in steps_x]
+    return np.stack(steps_x), np.stack(steps_y)
+
+
 def mnist_loader():
     datafile = 'mnist.pkl.gz'
     if not os.path.isfile(datafile):
@@ -189,6 +304,9 @@ class Data(object):
         theano borrowable variable
     cast_y : `bool`
         cast y to `intX`
+    mask_value : `float`, optional
+        value of the padding steps of sequences. The minibatches of a non shared
+        set are trimmed to their longest sequence, see :class:`BucketSampler`
 
     Methods
     -------
@@ -197,6 +315,8 @@ class Data(object):
         [(train_set_x, train_set_y),
          (valid_set_x, valid_set_y),
          (test_set_x, test_set_y)]
+    get_batch :
+        return a minibatch of a set as floatX numpy arrays
 
     Examples
     --------
@@ -206,8 +326,9 @@ class Data(object):
 
     """
     def __init__(self, data, preprocessing=None,
-                 shared=True, borrow=True, cast_y=False):
+                 shared=True, borrow=True, cast_y=False, mask_value=None):
         self.data = data
+        self.mask_value = mask_value
         #TODO: Check data input
         if len(data) == 3:
             train_set, valid_set, test_set = data
@@ -233,6 +354,7 @@ class Data(object):
             if valid_set_x is not None:
                 valid_set_x = apply_standardize(valid_set_x, self.mean, self.std)
 
+        self.shared = shared
         if shared:
             self.train_set_x = shared_variable(train_set_x, name='train_set_x', borrow=borrow)
             self.train_set_y = shared_variable(train_set_y, name='train_set_y', borrow=borrow)
@@ -240,12 +362,20 @@ class Data(object):
             self.valid_set_y = shared_variable(valid_set_y, name='valid_set_y', borrow=borrow)
             self.test_set_x = shared_variable(test_set_x, name='test_set_x', borrow=borrow)
             self.test_set_y = shared_variable(test_set_y, name='test_set_y', borrow=borrow)
+        else:
+            self.train_set_x, self.train_set_y = train_set_x, train_set_y
+            self.valid_set_x, self.valid_set_y = valid_set_x, valid_set_y
+            self.test_set_x, self.test_set_y = test_set_x, test_set_y
 
         if cast_y:
-            self.train_set_y = T.cast(self.train_set_y, intX)
-            if self.valid_set_y is not None:
-                self.valid_set_y = T.cast(self.valid_set_y, intX)
-            self.test_set_y = T.cast(self.test_set_y, intX)
+            if shared:
+                import theano.tensor as T
+                self.train_set_y = T.cast(self.train_set_y, intX)
+                if self.valid_set_y is not None:
+                    self.valid_set_y = T.cast(self.valid_set_y, intX)
+                self.test_set_y = T.cast(self.test_set_y, intX)
+            else:
+                self.cast_y = cast_y
 
     def dataset(self):
         return [(self.train_set_x, self.train_set_y),
@@ -254,3 +384,449 @@ class Data(object):
 
     def shape(self):
         return [(data[0].shape, data[1].shape) for data in self.data]
+
+    def get_batch(self, set_name, index):
+        """
+        Return a minibatch of a non shared set.
+
+        Parameters
+        ----------
+        set_name : {'train', 'valid', 'test'}
+            the set to read from
+        index : `slice` or array of `int`
+            the rows of the minibatch
+
+        Returns
+        -------
+            x, y as numpy arrays of floatX
+        """
+        x = getattr(self, set_name + '_set_x')[index]
+        y = getattr(self, set_name + '_set_y')[index]
+        if getattr(self, 'mask_value', None) is not None:
+            x, y = trim_sequences(x, self.mask_value, y)
+        if getattr(self, 'cast_y', False):
+            return to_float_X(x), np.asarray(y, dtype=intX)
+        return to_float_X(x), to_float_X(y)
+
+
+def memmap_npz(file, key):
+    """
+    Memory-map an array stored in an uncompressed .npz file.
+
+    `numpy.load` ignores `mmap_mode` for .npz archives, but as `numpy.savez`
+    stores its members without compression the raw .npy member can be mapped
+    directly from the archive.
+
+    Parameters
+    ----------
+    file : `string`
+        .npz file name
+    key : `string`
+        name of the array in the archive
+
+    Returns
+    -------
+        a read-only `numpy.memmap`
+    """
+    with zipfile.ZipFile(file) as zf:
+        info = zf.getinfo(key + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise DataFormatException('%s in %s is compressed and can not be memory-mapped. '
+                                  'Save it with numpy.savez.' % (key, file))
+    with open(file, 'rb') as f:
+        # local file header: the name and extra field lengths are at byte 26
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(file, dtype=dtype, mode='r', shape=shape, offset=offset,
+                     order='F' if fortran_order else 'C')
+
+
+class ShardedArray(object):
+    """
+    Read-only array made of on-disk NumPy shards concatenated along the first axis.
+
+    Shards are memory-mapped, so only the rows that are indexed are read from disk.
+    It is pickled by file names, which makes it cheap to send to other processes.
+
+    Parameters
+    ----------
+    files : `string` or `list` of `string`
+        .npy or .npz file names
+    key : `string`, optional
+        name of the array in the .npz shards
+    """
+    def __init__(self, files, key=None):
+        if isinstance(files, str):
+            files = [files]
+        self.files = list(files)
+        self.key = key
+        self._open()
+
+    def _open(self):
+        self.shards = []
+        for file in self.files:
+            if file.endswith('.npz'):
+                self.shards.append(memmap_npz(file, self.key))
+            else:
+                self.shards.append(np.load(file, mmap_mode='r'))
+        for shard in self.shards[1:]:
+            if shard.shape[1:] != self.shards[0].shape[1:] or shard.dtype != self.shards[0].dtype:
+                raise DataFormatException('All shards must have the same dtype and row shape')
+        self.offsets = np.cumsum([0] + [shard.shape[0] for shard in self.shards])
+        self.shape = (int(self.offsets[-1]),) + self.shards[0].shape[1:]
+        self.dtype = self.shards[0].dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.shape[0])
+            if step == 1:
+                return self._read_range(start, stop)
+            index = np.arange(start, stop, step)
+        index = np.asarray(index)
+        if index.ndim == 0:
+            return self._read_range(int(index), int(index) + 1)[0]
+        # read the rows in increasing order for sequential disk access
+        order = np.argsort(index, kind='mergesort')
+        sorted_index = index[order]
+        out = np.empty((len(index),) + self.shape[1:], dtype=self.dtype)
+        shard_of_row = np.searchsorted(self.offsets, sorted_index, side='right') - 1
+        for s in np.unique(shard_of_row):
+            rows = shard_of_row == s
+            out[order[rows]] = self.shards[s][sorted_index[rows] - self.offsets[s]]
+        return out
+
+    def _read_range(self, start, stop):
+        first = np.searchsorted(self.offsets, start, side='right') - 1
+        parts = []
+        while start < stop:
+            end = min(stop, self.offsets[first + 1])
+            parts.append(self.shards[first][start - self.offsets[first]: end - self.offsets[first]])
+            start = end
+            first += 1
+        if len(parts) == 1:
+            return np.array(parts[0])
+        if not parts:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def __getstate__(self):
+        return {'files': self.files, 'key': self.key}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+
+class MemmapData(Data):
+    """
+    Out-of-core data container.
+
+    Each set is read from memory-mapped NumPy shards and the minibatches are
+    gathered from disk by the training loop of :class:`yadll.model.Model`.
+    The full arrays are never loaded in memory.
+
+    data is made of train_set, valid_set (optional), test_set and each set is either:
+        - a tuple (x shards, y shards) of .npy file names or lists of .npy file names
+        - an .npz file name or a list of .npz file names with arrays 'x' and 'y'
+
+    Parameters
+    ----------
+    data : `list`
+        [train_set, valid_set, test_set] or [train_set, test_set]
+    preprocessing : {None, 'Normalize', 'Standardize'}
+        statistics are computed on the training set chunk by chunk and applied to each minibatch
+    cast_y : `bool`
+        cast y to `intX`
+    chunk_size : `int`
+        number of rows read at once when computing the preprocessing statistics
+    mask_value : `float`, optional
+        value of the padding steps of sequences, the minibatches are trimmed to their longest sequence
+
+    Examples
+    --------
+    >>> data = MemmapData([(['x_0.npy', 'x_1.npy'], ['y_0.npy', 'y_1.npy']),
+    ...                    'valid.npz',
+    ...                    'test.npz'])
+
+    """
+    def __init__(self, data, preprocessing=None, cast_y=False, chunk_size=65536, mask_value=None):
+        self.data = data
+        self.shared = False
+        self.cast_y = cast_y
+        self.mask_value = mask_value
+        sets = [self._open_set(s) for s in data]
+        if len(sets) == 3:
+            (self.train_set_x, self.train_set_y), (self.valid_set_x, self.valid_set_y), \
+                (self.test_set_x, self.test_set_y) = sets
+        if len(sets) == 2:
+            (self.train_set_x, self.train_set_y), (self.test_set_x, self.test_set_y) = sets
+            self.valid_set_x, self.valid_set_y = None, None
+
+        self.preprocessing = preprocessing
+        if preprocessing == 'Normalize':
+            self.min = self.max = None
+            for chunk in self._chunks(chunk_size):
+                chunk_min, chunk_max = chunk.min(axis=0), chunk.max(axis=0)
+                self.min = chunk_min if self.min is None else np.minimum(self.min, chunk_min)
+                self.max = chunk_max if self.max is None else np.maximum(self.max, chunk_max)
+
+        if preprocessing == 'Standardize':
+            n = len(self.train_set_x)
+            self.mean = sum(chunk.sum(axis=0, dtype='float64') for chunk in self._chunks(chunk_size)) / n
+            var = sum(((chunk - self.mean) ** 2).sum(axis=0) for chunk in self._chunks(chunk_size)) / n
+            self.std = np.sqrt(var) + 1e-6
+
+    @staticmethod
+    def _open_set(set_files):
+        if isinstance(set_files, tuple):
+            return ShardedArray(set_files[0]), ShardedArray(set_files[1])
+        return ShardedArray(set_files, key='x'), ShardedArray(set_files, key='y')
+
+    def _chunks(self, chunk_size):
+        for start in range(0, len(self.train_set_x), chunk_size):
+            yield self.train_set_x[start: start + chunk_size]
+
+    def dataset(self):
+        return [(self.train_set_x, self.train_set_y),
+                (self.valid_set_x, self.valid_set_y),
+                (self.test_set_x, self.test_set_y)]
+
+    def shape(self):
+        return [(set_x.shape, set_y.shape) for set_x, set_y in self.dataset() if set_x is not None]
+
+    def get_batch(self, set_name, index):
+        x = getattr(self, set_name + '_set_x')[index]
+        if self.preprocessing == 'Normalize':
+            x = apply_normalize(x, self.min, self.max)
+        if self.preprocessing == 'Standardize':
+            x = apply_standardize(x, self.mean, self.std)
+        y = getattr(self, set_name + '_set_y')[index]
+        if self.mask_value is not None:
+            x, y = trim_sequences(x, self.mask_value, y)
+        if self.cast_y:
+            return to_float_X(x), np.asarray(y, dtype=intX)
+        return to_float_X(x), to_float_X(y)
+
+
+# data of a process worker, each process of a pool receives a copy when it starts
+_worker_data = None
+_worker_augment = None
+
+
+def _init_prefetch_worker(data, augment):
+    global _worker_data, _worker_augment
+    _worker_data = data
+    _worker_augment = augment
+
+
+def _prepare_batch(data, augment, set_name, index):
+    x, y = data.get_batch(set_name, index)
+    if augment is not None:
+        x, y = augment(x, y)
+    return x, y
+
+
+def _prepare_worker_batch(set_name, index, augment):
+    return _prepare_batch(_worker_data, _worker_augment if augment else None, set_name, index)
+
+
+class BatchPrefetcher(object):
+    """
+    Prepare the minibatches of a non shared set in background workers.
+
+    While minibatch N is being trained, the next ones are gathered in the
+    epoch order, cast to floatX and optionally augmented by a pool of thread
+    or process workers. At most `depth` minibatches are prepared in advance.
+
+    Parameters
+    ----------
+    depth : `int`
+        number of minibatches prepared in advance. 0 prepares them synchronously
+    n_workers : `int`
+        number of workers
+    workers : {'thread', 'process'}
+        thread workers share the memory of the trainer. Process workers receive
+        a pickled copy of the data, which is cheap for :class:`MemmapData`
+    augment : function, optional
+        function (x, y) -> (x, y) applied to each training minibatch.
+        It has to be picklable for process workers
+
+    Attributes
+    ----------
+    stall_time : `float`
+        time in seconds the trainer spent waiting for data
+
+    Examples
+    --------
+    >>> prefetcher = BatchPrefetcher(depth=4, n_workers=2, workers='process')
+    >>> model.train(prefetch=prefetcher)
+    >>> model.report['data_stall']
+
+    """
+    def __init__(self, depth=2, n_workers=1, workers='thread', augment=None):
+        self.depth = depth
+        self.n_workers = n_workers
+        self.workers = workers
+        self.augment = augment
+        self.stall_time = 0.
+        self.pool = None
+        self.pool_data = None
+
+    def _get_pool(self, data):
+        if self.workers == 'thread':
+            # thread workers receive the data with each task, one pool serves any data
+            if self.pool is None:
+                self.pool = ThreadPool(self.n_workers)
+        elif self.pool is None or self.pool_data is not data:
+            self.close()
+            self.pool = multiprocessing.Pool(self.n_workers, initializer=_init_prefetch_worker,
+                                             initargs=(data, self.augment))
+            self.pool_data = data
+        return self.pool
+
+    def _task(self, data, augment, set_name, index):
+        if self.workers == 'thread':
+            return self.pool.apply_async(_prepare_batch, (data, augment, set_name, index))
+        return self.pool.apply_async(_prepare_worker_batch, (set_name, index, augment is not None))
+
+    def batches(self, data, set_name, batch_indices):
+        """
+        Iterate over the minibatches of a set
+
+        Parameters
+        ----------
+        data : :class:`Data`
+            a non shared data container
+        set_name : {'train', 'valid', 'test'}
+            the set to read from
+        batch_indices : iterable
+            the rows of each minibatch in the epoch order
+
+        Yields
+        ------
+            x, y as numpy arrays of floatX
+        """
+        augment = self.augment if set_name == 'train' else None
+        if self.depth <= 0:
+            for index in batch_indices:
+                start_time = timeit.default_timer()
+                x, y = _prepare_batch(data, augment, set_name, index)
+                self.stall_time += timeit.default_timer() - start_time
+                yield x, y
+            return
+
+        self._get_pool(data)
+        batch_indices = iter(batch_indices)
+        pending = deque()
+        for index in batch_indices:
+            pending.append(self._task(data, augment, set_name, index))
+            if len(pending) == self.depth:
+                break
+        while pending:
+            start_time = timeit.default_timer()
+            batch = pending.popleft().get()
+            self.stall_time += timeit.default_timer() - start_time
+            for index in batch_indices:
+                pending.append(self._task(data, augment, set_name, index))
+                break
+            yield batch
+
+    def close(self):
+        """
+        Terminate the workers
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = self.pool_data = None
+
+    def __getstate__(self):
+        dic = self.__dict__.copy()
+        dic['pool'] = dic['pool_data'] = None
+        return dic
+
+
+class BucketSampler(object):
+    """
+    Order of the training samples grouping the sequences of similar length.
+
+    Each epoch the training set is shuffled and cut into buckets of
+    `bucket_size` sequences. A bucket is sorted by length and cut into
+    minibatches, then the minibatches are shuffled. With a `mask_value` in the
+    :class:`Data` container, the minibatches are trimmed to their longest
+    sequence, so few padding steps are computed.
+
+    Parameters
+    ----------
+    lengths : array of `int`
+        length of each training sequence, see :func:`sequence_lengths`
+    batch_size : `int`
+        size of the minibatches
+    bucket_size : `int`, optional
+        number of sequences sorted together, default is 20 minibatches.
+        Larger buckets waste less padding but give less random minibatches
+
+    Examples
+    --------
+    >>> data = Data([(x_train, y_train), (x_valid, y_valid), (x_test, y_test)], shared=False, mask_value=0.)
+    >>> sampler = BucketSampler(sequence_lengths(x_train), hp.batch_size)
+    >>> model.train(sampler=sampler)
+
+    """
+    def __init__(self, lengths, batch_size, bucket_size=None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size or 20 * batch_size
+
+    def __call__(self, rng=np.random):
+        """
+        Order of the samples of an epoch
+
+        Parameters
+        ----------
+        rng : `numpy.random.RandomState`
+            random generator
+
+        Returns
+        -------
+            array of the indexes of the complete minibatches in the epoch order
+        """
+        idx = rng.permutation(len(self.lengths))
+        for start in range(0, len(idx), self.bucket_size):
+            bucket = idx[start: start + self.bucket_size]
+            idx[start: start + self.bucket_size] = bucket[np.argsort(self.lengths[bucket], kind='mergesort')]
+        n_batches = len(idx) // self.batch_size
+        batches = idx[:n_batches * self.batch_size].reshape(n_batches, self.batch_size)
+        return batches[rng.permutation(n_batches)].ravel()
+
+    def padding_ratio(self, index=None):
+        """
+        Fraction of the computed time steps which are padding
+
+        Parameters
+        ----------
+        index : array of `int`, optional
+            order of the samples, default is a random order without bucketing
+
+        Returns
+        -------
+            the fraction of padding steps of the minibatches trimmed to their longest sequence
+        """
+        if index is None:
+            index = np.random.permutation(len(self.lengths))[:len(self.lengths) // self.batch_size * self.batch_size]
+        lengths = self.lengths[index].reshape(-1, self.batch_size)
+        return 1. - lengths.sum() / float(lengths.max(axis=1).sum() * self.batch_size)
@@ -1,5 +1,151 @@
 # -*- coding: UTF-8 -*-
-import itertools
+import numpy as np
+
+from .utils import shared_variable, to_float_X
+from .exceptions import DlException
+
+# Sobol direction numbers of dimensions 2 to 21 (s, a, m_1...m_s)
+# from S. Joe and F. Y. Kuo, new-joe-kuo-6.21201, https://web.maths.unsw.edu.au/~fkuo/sobol/
+SOBOL_DIRECTIONS = [(1, 0, [1]),
+                    (2, 1, [1, 3]),
+                    (3, 1, [1, 3, 1]),
+                    (3, 2, [1, 1, 1]),
+                    (4, 1, [1, 1, 3, 3]),
+                    (4, 4, [1, 3, 5, 13]),
+                    (5, 2, [1, 1, 5, 5, 17]),
+                    (5, 4, [1, 1, 5, 5, 5]),
+                    (5, 7, [1, 1, 7, 11, 19]),
+                    (5, 11, [1, 1, 5, 1, 1]),
+                    (5, 13, [1, 1, 1, 3, 11]),
+                    (5, 14, [1, 3, 5, 5, 31]),
+                    (6, 1, [1, 3, 3, 9, 7, 49]),
+                    (6, 13, [1, 1, 1, 15, 21, 21]),
+                    (6, 16, [1, 3, 1, 13, 27, 49]),
+                    (6, 19, [1, 1, 1, 15, 7, 5]),
+                    (6, 22, [1, 3, 1, 15, 13, 25]),
+                    (6, 25, [1, 1, 5, 5, 19, 61]),
+                    (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+                    (7, 4, [1, 3, 7, 13, 13, 15, 69])]
+
+SOBOL_BITS = 30
+
+
+def sobol(n, dim):
+    """
+    First points of the Sobol low discrepancy sequence
+
+    Parameters
+    ----------
+    n : `int`
+        number of points
+    dim : `int`
+        dimension of the points, at most 21
+
+    Returns
+    -------
+        numpy array of shape (n, dim) in [0, 1)
+
+    References
+    ----------
+    .. [1] S. Joe and F. Y. Kuo, Constructing Sobol sequences with better
+       two-dimensional projections, SIAM J. Sci. Comput. 30, 2635-2654 (2008)
+    """
+    if dim > len(SOBOL_DIRECTIONS) + 1:
+        raise DlException('Sobol sequence is limited to %i dimensions' % (len(SOBOL_DIRECTIONS) + 1))
+    v = np.zeros((dim, SOBOL_BITS), dtype=np.int64)
+    v[0] = [1 << (SOBOL_BITS - 1 - i) for i in range(SOBOL_BITS)]
+    for j in range(1, dim):
+        s, a, m = SOBOL_DIRECTIONS[j - 1]
+        for i in range(SOBOL_BITS):
+            if i < s:
+                v[j, i] = m[i] << (SOBOL_BITS - 1 - i)
+            else:
+                v[j, i] = v[j, i - s] ^ (v[j, i - s] >> s)
+                for k in range(1, s):
+                    if (a >> (s - 1 - k)) & 1:
+                        v[j, i] ^= v[j, i - k]
+    points = np.zeros((n, dim))
+    x = np.zeros(dim, dtype=np.int64)
+    for i in range(n):
+        points[i] = x
+        # gray code: flip the direction number of the lowest zero bit of i
+        c = 0
+        while (i >> c) & 1:
+            c += 1
+        x ^= v[:, c]
+    return points / float(1 << SOBOL_BITS)
+
+
+def latin_hypercube(n, dim, rng):
+    """
+    Latin hypercube sample: each dimension is divided in n strata with one point in each
+
+    Parameters
+    ----------
+    n : `int`
+        number of points
+    dim : `int`
+        dimension of the points
+    rng : numpy RandomState
+
+    Returns
+    -------
+        numpy array of shape (n, dim) in [0, 1)
+    """
+    strata = np.array([rng.permutation(n) for _ in range(dim)]).T
+    return (strata + rng.uniform(size=(n, dim))) / n
+
+
+class CartesianProduct(object):
+    """
+    Lazy Cartesian product of the hyperparameters ranges, in the order of `itertools.product`.
+    Combinations are computed on access so the space is never held in memory.
+
+    Parameters
+    ----------
+    names : `list` of `string`
+        names of the hyperparameters
+    ranges : `list` of `list`
+        values of each hyperparameter
+    """
+    def __init__(self, names, ranges):
+        self.names = list(names)
+        self.ranges = [list(r) for r in ranges]
+        self.sizes = [len(r) for r in self.ranges]
+
+    def __len__(self):
+        n = 1
+        for size in self.sizes:
+            n *= size
+        return n
+
+    def __getitem__(self, index):
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('hyperparameters combination index out of range')
+        # mixed radix decomposition, the last hyperparameter varies the fastest
+        values = [None] * len(self.sizes)
+        for i in reversed(range(len(self.sizes))):
+            index, digit = divmod(index, self.sizes[i])
+            values[i] = self.ranges[i][digit]
+        return dict(zip(self.names, values))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def from_unit(self, u):
+        """
+        Combination at a point of the unit hypercube, one coordinate per
+        hyperparameter having more than one value
+        """
+        values = [r[0] for r in self.ranges]
+        dims = [i for i, size in enumerate(self.sizes) if size > 1]
+        for i, x in zip(dims, u):
+            values[i] = self.ranges[i][min(int(x * self.sizes[i]), self.sizes[i] - 1)]
+        return dict(zip(self.names, values))
 
 
 class Hyperparameters(object):
@@ -9,6 +155,9 @@ class Hyperparameters(object):
     a list of values that will be iterated over during a grid search.
 
     It create an iterable of all the different parameters values combination.
+    The combinations are enumerated lazily, `hp[i]` is the i-th combination and
+    `len(hp)` their number. Large spaces can be explored with a fixed budget of
+    trials with :meth:`sample`.
 
     Parameters
     ----------
@@ -23,6 +172,10 @@ class Hyperparameters(object):
     -------
     reset
         reset all hyperparameters to default values.
+    shared
+        shared variable holding the value of a scalar hyperparameter.
+    sample
+        random, latin hypercube or Sobol sample of the combinations.
 
     Examples
     --------
@@ -37,13 +190,28 @@ class Hyperparameters(object):
     >>> for param in hp:
     >>>     # Do something with this set of hyperparameters
 
+    Random search on the hyperparameters space:
+
+    >>> for hp_value in hp.sample(100, method='sobol'):
+    >>>     # Do something with this set of hyperparameters values
+
+    Scalar hyperparameters used through `hp.shared(name)` in a graph can change
+    during the grid search without recompiling the model.
+
     """
     def __init__(self):
+        self.hp_shared = dict()
         self.hp_value = dict()
         self.hp_default = dict()
         self.hp_range = dict()
         self.iteration = 0
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        # keep the shared variables in sync with the hyperparameters values
+        if name in self.__dict__.get('hp_shared', ()):
+            self.hp_shared[name].set_value(to_float_X(value))
+
     def __call__(self, name, value, hp_range=None):
         self.__setattr__(name, value)
         self.hp_value[name] = value
@@ -51,12 +219,17 @@ class Hyperparameters(object):
         self.hp_range[name] = hp_range
         if not hp_range:
             self.hp_range[name] = [value]
-        product = [x for x in itertools.product(*list(self.hp_range.values()))]
-        self.hp_product = [dict(list(zip(list(self.hp_value.keys()), p))) for p in product]
+        self.hp_product = CartesianProduct(self.hp_range.keys(), self.hp_range.values())
 
     def __str__(self):
         return str(self.hp_value)
 
+    def __len__(self):
+        return len(self.hp_product)
+
+    def __getitem__(self, index):
+        return self.hp_product[index]
+
     def __iter__(self):
         return self
 
@@ -69,6 +242,56 @@ class Hyperparameters(object):
         self.iteration += 1
         return self
 
+    def shared(self, name):
+        """
+        Shared variable holding the value of a scalar hyperparameter.
+        It is created on first use and follows the value of the hyperparameter.
+
+        Parameters
+        ----------
+        name : `string`
+            The name of the hyperparameter.
+
+        Returns
+        -------
+            Theano Shared Variable
+        """
+        if name not in self.hp_shared:
+            self.hp_shared[name] = shared_variable(getattr(self, name), name=name)
+        return self.hp_shared[name]
+
+    def sample(self, n_trials, method='random', seed=None):
+        """
+        Sample the hyperparameters combinations
+
+        Parameters
+        ----------
+        n_trials : `int`
+            number of combinations
+        method : {'random', 'lhs', 'sobol'}
+            'random' draws each hyperparameter uniformly in its range,
+            'lhs' is a latin hypercube sample and 'sobol' the first points
+            of the Sobol sequence, after the origin. The last two cover the
+            space more evenly than random draws.
+        seed : `int`, optional
+            seed of the 'random' and 'lhs' methods
+
+        Returns
+        -------
+            `list` of `dict` of hyperparameters values
+        """
+        dim = sum(1 for size in self.hp_product.sizes if size > 1)
+        rng = np.random.RandomState(seed)
+        if method == 'random':
+            u = rng.uniform(size=(n_trials, dim))
+        elif method == 'lhs':
+            u = latin_hypercube(n_trials, dim, rng)
+        elif method == 'sobol':
+            u = sobol(n_trials + 1, dim)[1:]
+        else:
+            raise DlException('Unknown sampling method %s' % method)
+        return [self.hp_product.from_unit(x) for x in u]
+
     def reset(self):
         for name, value in self.hp_default.items():
             self.__setattr__(name, value)
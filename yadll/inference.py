@@ -0,0 +1,493 @@
+# -*- coding: UTF-8 -*-
+"""
+Forward pass of trained networks with numpy only.
+
+A :class:`Predictor` evaluates a network from its conf and the values of its
+parameters, i.e. an artifact saved by :func:`yadll.artifact.save_artifact`.
+Nothing is compiled, so a predictor is ready as soon as its weights are mapped.
+The layers are evaluated as by :meth:`yadll.model.Model.predict`: dropout
+layers are disabled and batch normalization uses its stored statistics.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from .exceptions import *
+
+
+################################################
+# Activations
+
+def sigmoid(x):
+    # tanh form, it does not overflow
+    return 0.5 * (1. + np.tanh(0.5 * x))
+
+
+def ultra_fast_sigmoid(x):
+    # piecewise approximation of theano.tensor.nnet.ultra_fast_sigmoid
+    a = 0.5 * np.abs(x)
+    z = np.where(a < 1.7, 1.5 * a / (1 + a),
+                 np.where(a < 3, 0.935409070603099 + 0.0458812946797165 * (a - 1.7), 0.99505475368673))
+    return 0.5 * (np.where(x < 0, -z, z) + 1.)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def softplus(x):
+    return np.logaddexp(0, x)
+
+
+def relu(x, alpha=0):
+    if alpha == 0:
+        return np.maximum(x, 0)
+    return 0.5 * (1 + alpha) * x + 0.5 * (1 - alpha) * np.abs(x)
+
+
+def elu(x, alpha=1):
+    return np.where(x > 0, x, alpha * np.expm1(np.minimum(x, 0)))
+
+
+def selu(x):
+    alpha = 1.6732632423543772848170429916717
+    scale = 1.0507009873554804934193349852946
+    return scale * elu(x, alpha)
+
+ACTIVATIONS = {'linear': lambda x: x,
+               'sigmoid': sigmoid,
+               'ultra_fast_sigmoid': ultra_fast_sigmoid,
+               'tanh': np.tanh,
+               'softmax': softmax,
+               'softplus': softplus,
+               'relu': relu,
+               'elu': elu,
+               'selu': selu}
+
+
+def get_activation(conf):
+    """
+    Numpy activation function of an activation conf, see :func:`yadll.activations.activation_to_conf`
+    """
+    name, kwargs = (conf[0], conf[1]) if isinstance(conf, (tuple, list)) else (conf, {})
+    if name not in ACTIVATIONS:
+        raise DlException('Activation %s is not supported by the numpy inference' % name)
+    func = ACTIVATIONS[name]
+    return lambda x: func(x, **kwargs)
+
+
+################################################
+# Convolution and pooling
+
+def _windows(x, ws, stride=(1, 1)):
+    # view of the (ws[0], ws[1]) windows of the last two axes, shape (..., out_h, out_w, ws[0], ws[1])
+    out_h = (x.shape[-2] - ws[0]) // stride[0] + 1
+    out_w = (x.shape[-1] - ws[1]) // stride[1] + 1
+    strides = x.strides[:-2] + (x.strides[-2] * stride[0], x.strides[-1] * stride[1]) + x.strides[-2:]
+    return as_strided(x, x.shape[:-2] + (out_h, out_w) + tuple(ws), strides, writeable=False)
+
+
+def conv2d(x, filters, border_mode='valid', subsample=(1, 1)):
+    """
+    2D convolution of `theano.tensor.nnet.conv.conv2d`, the filters are flipped
+
+    Parameters
+    ----------
+    x : array of shape (batch size, input maps, height, width)
+    filters : array of shape (filters, input maps, filter height, filter width)
+    border_mode : {'valid', 'full'}
+    subsample : `tuple` of `int`
+    """
+    kh, kw = filters.shape[2:]
+    if border_mode == 'full':
+        x = np.pad(x, ((0, 0), (0, 0), (kh - 1, kh - 1), (kw - 1, kw - 1)), mode='constant')
+    elif border_mode != 'valid':
+        raise DlException('Border mode %s is not supported by the numpy inference' % border_mode)
+    windows = _windows(np.ascontiguousarray(x), (kh, kw), subsample)
+    out = np.tensordot(windows, filters[:, :, ::-1, ::-1], axes=([1, 4, 5], [1, 2, 3]))
+    return out.transpose(0, 3, 1, 2)
+
+
+def pool_out_shape(size, ws, stride, ignore_border):
+    """
+    Output size of a pooled axis, as `theano.tensor.signal.pool.Pool.out_shape`
+    """
+    if ignore_border:
+        if ws == stride:
+            return size // stride
+        return max((size - ws) // stride + 1, 0)
+    if stride >= ws:
+        return (size - 1) // stride + 1
+    return max(0, (size - 1 - ws + stride) // stride) + 1
+
+
+def pool_2d(x, ws, stride=None, ignore_border=True, pad=(0, 0), mode='max'):
+    """
+    2D pooling of `theano.tensor.signal.pool.pool_2d` over the last two axes
+
+    Parameters
+    ----------
+    x : array
+    ws : `tuple` of `int`
+        pooling window
+    stride : `tuple` of `int`, optional
+        default is `ws`
+    ignore_border : `bool`
+        drop the partial windows
+    pad : `tuple` of `int`
+        zero padding on both sides
+    mode : {'max', 'sum', 'average_inc_pad', 'average_exc_pad'}
+    """
+    stride = tuple(ws) if stride is None else tuple(stride)
+    pad = (0, 0) if pad is None else tuple(pad)
+    img = [x.shape[-2 + i] + 2 * pad[i] for i in range(2)]
+    out = [pool_out_shape(img[i], ws[i], stride[i], ignore_border) for i in range(2)]
+    # the padded image is extended so that every window is complete, the
+    # cells out of a region are masked
+    ext = [max(img[i], (out[i] - 1) * stride[i] + ws[i]) for i in range(2)]
+    y = np.zeros(x.shape[:-2] + tuple(ext), dtype=x.dtype)
+    y[..., pad[0]: pad[0] + x.shape[-2], pad[1]: pad[1] + x.shape[-1]] = x
+    lo, hi = ((0, 0), img) if mode == 'average_inc_pad' else (pad, [img[i] - pad[i] for i in range(2)])
+    rows, cols = np.arange(ext[0]), np.arange(ext[1])
+    valid = ((rows >= lo[0]) & (rows < hi[0]))[:, None] & ((cols >= lo[1]) & (cols < hi[1]))[None, :]
+    windows = _windows(y, ws, stride)[..., :out[0], :out[1], :, :]
+    valid = _windows(valid, ws, stride)[:out[0], :out[1]]
+    if mode == 'max':
+        return np.where(valid, windows, -np.inf).max(axis=(-2, -1)).astype(x.dtype)
+    total = np.where(valid, windows, 0).sum(axis=(-2, -1))
+    if mode == 'sum':
+        return total
+    if mode in ('average_inc_pad', 'average_exc_pad'):
+        return (total / valid.sum(axis=(-2, -1))).astype(x.dtype)
+    raise DlException('Pooling mode %s is not supported by the numpy inference' % mode)
+
+
+################################################
+# Layers
+# Each layer is a function of its conf, its parameters and buffers by name and
+# its input. They are listed in the order of `Layer.params` and `Layer.buffers`.
+
+def _input(conf, params, x):
+    return x
+
+
+def _reshape(conf, params, x):
+    shape = list(conf['output_shape'])
+    if shape[0] is None:
+        shape[0] = x.shape[0]
+    return x.reshape(shape)
+
+
+def _flatten(conf, params, x):
+    n_dim = conf.get('n_dim', 2)
+    return x.reshape(x.shape[:n_dim - 1] + (-1, ))
+
+
+def _activation(conf, params, x):
+    return get_activation(conf['activation'])(x)
+
+
+def _dense(conf, params, x):
+    return get_activation(conf['activation'])(np.dot(x, params['W']) + params['b'])
+
+
+def _batch_normalization_axes(axis, ndim):
+    # as yadll.layers.BatchNormalization.normalization_axes
+    if axis == 'auto':
+        return (0, 2, 3) if ndim == 4 else tuple(range(ndim - 1))
+    axis = axis if isinstance(axis, (list, tuple)) else (axis, )
+    return tuple(sorted(a % ndim for a in axis))
+
+
+def _batch_normalization(conf, params, x):
+    axes = _batch_normalization_axes(conf.get('axis', 'auto'), x.ndim)
+    shape = [1 if i in axes else d for i, d in enumerate(x.shape)]
+
+    def bc(value):
+        return value.reshape(shape)
+    y = bc(params['gamma']) * (x - bc(params['mean'])) / np.sqrt(bc(params['var']) + conf['epsilon'])
+    if conf.get('has_beta', True):
+        y = y + bc(params['beta'])
+    return y
+
+
+def _conv(conf, params, x):
+    return conv2d(x, params['W'], conf['border_mode'], tuple(conf['subsample']))
+
+
+def _pool(conf, params, x):
+    return pool_2d(x, tuple(conf['pool_size']), conf['stride'], conf['ignore_border'],
+                   conf['pad'], conf['mode'])
+
+
+def _conv_pool(conf, params, x):
+    y = pool_2d(conv2d(x, params['W'], conf['border_mode'], tuple(conf['subsample'])),
+                tuple(conf['pool_size']), conf['stride'], conf['ignore_border'], conf['pad'], conf['mode'])
+    return get_activation(conf['activation'])(y + params['b'][None, :, None, None])
+
+
+def _sequence_mask(conf, x):
+    # (n_batch, n_time_steps, ...) -> (n_batch, n_time_steps, 1), 0 on the padding steps
+    if conf.get('mask_value') is None:
+        return None
+    x = x.reshape(x.shape[:2] + (-1, ))
+    return np.any(x != conf['mask_value'], axis=2)[..., None].astype(x.dtype)
+
+
+def _scan(conf, x, step, states, mask=None):
+    # x: (n_batch, n_time_steps, ...) -> the hidden states of the sequence
+    if x.ndim > 3:
+        x = x.reshape(x.shape[:2] + (-1, ))
+    time_steps = range(x.shape[1])
+    if conf.get('go_backwards', False):
+        time_steps = reversed(time_steps)
+    outputs = []
+    for t in time_steps:
+        new_states = step(x[:, t], states)
+        if mask is not None:
+            # the states are frozen on the padding steps
+            new_states = [mask[:, t] * s_t + (1. - mask[:, t]) * s_tm1 for s_t, s_tm1 in zip(new_states, states)]
+        states = new_states
+        outputs.append(states[0])
+    if conf.get('last_only', True):
+        return outputs[-1]
+    if conf.get('go_backwards', False):
+        outputs = outputs[::-1]
+    return np.stack(outputs, axis=1)
+
+
+def _rnn(conf, params, x):
+    activation = get_activation(conf['activation'])
+    n_hidden = params['U'].shape[0]
+    mask = _sequence_mask(conf, x)
+    # input dot product is outside of the loop
+    x = np.dot(x if x.ndim == 3 else x.reshape(x.shape[:2] + (-1, )), params['W']) + params['b']
+    h0 = activation(np.ones((x.shape[0], n_hidden), dtype=x.dtype))
+
+    def step(x_t, states):
+        return [activation(x_t + np.dot(states[0], params['U']))]
+    return _scan(conf, x, step, [h0], mask)
+
+
+def _gate_block(conf, params, block, names):
+    # fused parameters are stored as one block
+    if conf.get('fused_params', False):
+        return params[block]
+    return np.concatenate([params[name] for name in names], axis=-1)
+
+
+def _lstm(conf, params, x):
+    activation = get_activation(conf['activation'])
+    n = conf['n_units']
+    W = _gate_block(conf, params, 'W', ['W_i', 'W_f', 'W_c', 'W_o'])
+    U = _gate_block(conf, params, 'U', ['U_i', 'U_f', 'U_c', 'U_o'])
+    b = _gate_block(conf, params, 'b', ['b_i', 'b_f', 'b_c', 'b_o'])
+    P = None
+    mask = _sequence_mask(conf, x)
+    if conf.get('peepholes', False):
+        P = _gate_block(conf, params, 'P', ['P_i', 'P_f', 'P_o'])
+    x = np.dot(x if x.ndim == 3 else x.reshape(x.shape[:2] + (-1, )), W) + b
+    c0 = np.ones((x.shape[0], n), dtype=x.dtype)
+    h0 = activation(c0)
+
+    def step(x_t, states):
+        h_tm1, c_tm1 = states
+        pre_act = x_t + np.dot(h_tm1, U)
+        if P is not None:
+            # the cell state is seen by the input, forget and output gates
+            peep = np.dot(c_tm1, P)
+            pre_act[:, :2 * n] += peep[:, :2 * n]
+            pre_act[:, 3 * n:] += peep[:, 2 * n:]
+        i_t = sigmoid(pre_act[:, :n])
+        f_t = sigmoid(pre_act[:, n: 2 * n])
+        c_t = activation(pre_act[:, 2 * n: 3 * n])
+        o_t = sigmoid(pre_act[:, 3 * n:])
+        if conf.get('tied_i_f', False):
+            i_t = 1. - f_t
+        c_t = f_t * c_tm1 + i_t * c_t
+        return [o_t * activation(c_t), c_t]
+    return _scan(conf, x, step, [h0, c0], mask)
+
+
+def _gru(conf, params, x):
+    activation = get_activation(conf['activation'])
+    n = conf['n_units']
+    W = _gate_block(conf, params, 'W', ['W_z', 'W_r', 'W_o'])
+    U = _gate_block(conf, params, 'U', ['U_z', 'U_r', 'U_o'])
+    b = _gate_block(conf, params, 'b', ['b_z', 'b_r', 'b_o'])
+    mask = _sequence_mask(conf, x)
+    x = np.dot(x if x.ndim == 3 else x.reshape(x.shape[:2] + (-1, )), W) + b
+    h0 = activation(np.ones((x.shape[0], n), dtype=x.dtype))
+
+    def step(x_t, states):
+        h_tm1 = states[0]
+        pre_act = np.dot(h_tm1, U)
+        z_t = sigmoid(x_t[:, :n] + pre_act[:, :n])
+        r_t = sigmoid(x_t[:, n: 2 * n] + pre_act[:, n: 2 * n])
+        # as yadll.layers.GRU, the candidate state has no activation
+        h_t = x_t[:, 2 * n:] + r_t * pre_act[:, 2 * n:]
+        return [(1 - z_t) * h_tm1 + z_t * h_t]
+    return _scan(conf, x, step, [h0], mask)
+
+
+def _bidirectional(conf, params, x):
+    # the parameters of each direction are prefixed by the name of the direction
+    outputs = []
+    for direction in ['forward', 'backward']:
+        layer_conf = conf[direction]
+        layer_params = dict((name.split('/', 1)[1], value) for name, value in params.items()
+                            if name.startswith(direction + '/'))
+        outputs.append(LAYERS[layer_conf['type']][0](layer_conf, layer_params, x))
+    if conf['merge_mode'] == 'concat':
+        return np.concatenate(outputs, axis=-1)
+    if conf['merge_mode'] == 'sum':
+        return outputs[0] + outputs[1]
+    return (outputs[0] + outputs[1]) / 2.
+
+
+def _lstm_params(conf):
+    if conf.get('fused_params', False):
+        names = ['W', 'U', 'b']
+        return names + ['P'] if conf.get('peepholes', False) else names
+    names = ['W_i', 'U_i', 'b_i', 'W_f', 'U_f', 'b_f', 'W_c', 'U_c', 'b_c', 'W_o', 'U_o', 'b_o']
+    return names + ['P_i', 'P_f', 'P_o'] if conf.get('peepholes', False) else names
+
+
+def _gru_params(conf):
+    if conf.get('fused_params', False):
+        return ['W', 'U', 'b']
+    return ['W_z', 'U_z', 'b_z', 'W_r', 'U_r', 'b_r', 'W_o', 'U_o', 'b_o']
+
+
+def _batch_normalization_params(conf):
+    return ['gamma', 'beta'] if conf.get('has_beta', True) else ['gamma']
+
+
+def _bidirectional_params(conf):
+    names = []
+    for direction in ['forward', 'backward']:
+        layer_names = LAYERS[conf[direction]['type']][1]
+        if callable(layer_names):
+            layer_names = layer_names(conf[direction])
+        names.extend(direction + '/' + name for name in layer_names)
+    return names
+
+_DENSE = (_dense, ['W', 'b'])
+# layer type: (forward function, parameter names or function of the conf returning them)
+LAYERS = {'InputLayer': (_input, []),
+          'ReshapeLayer': (_reshape, []),
+          'FlattenLayer': (_flatten, []),
+          'Activation': (_activation, []),
+          'DenseLayer': _DENSE,
+          'LogisticRegression': _DENSE,
+          'Dropconnect': _DENSE,
+          'UnsupervisedLayer': _DENSE,
+          'AutoEncoder': _DENSE,
+          'RBM': _DENSE,
+          'Dropout': (_input, []),
+          'AlphaDropout': (_input, []),
+          'BatchNormalization': (_batch_normalization, _batch_normalization_params),
+          'PoolLayer': (_pool, []),
+          'ConvLayer': (_conv, ['W']),
+          'ConvPoolLayer': (_conv_pool, ['W', 'b']),
+          'RNN': (_rnn, ['W', 'U', 'b']),
+          'LSTM': (_lstm, _lstm_params),
+          'GRU': (_gru, _gru_params),
+          'Bidirectional': (_bidirectional, _bidirectional_params)}
+
+
+# layer type: buffer names, the buffers are initialized to 0 and 1 if they are not given
+BUFFERS = {'BatchNormalization': ['mean', 'var']}
+
+
+class Predictor(object):
+    """
+    Forward pass of a trained network with numpy
+
+    Parameters
+    ----------
+    network_conf : `dict`
+        conf of the network, see :meth:`yadll.network.Network.to_conf`
+    params : list of numpy arrays
+        values of the parameters of the network, in the order of `Network.params`
+    buffers : list of numpy arrays, optional
+        values of the buffers of the network, in the order of `Network.buffers`,
+        i.e. the running averages of :class:`yadll.layers.BatchNormalization`.
+        Default are their initial values
+
+    Examples
+    --------
+
+    >>> predictor = Predictor.from_artifact('my_model')
+    >>> predictor.predict(X)
+
+    """
+    def __init__(self, network_conf, params, buffers=None):
+        self.layers = []
+        params = list(params)
+        buffers = None if buffers is None else list(buffers)
+        names = list(network_conf['layers'].keys())
+        for name, conf in network_conf['layers'].items():
+            if conf['type'] not in LAYERS:
+                raise DlException('Layer %s is not supported by the numpy inference' % conf['type'])
+            func, param_names = LAYERS[conf['type']]
+            if callable(param_names):
+                param_names = param_names(conf)
+            if len(params) < len(param_names):
+                raise DlException('Missing parameters for layer %s' % name)
+            layer_params = dict(zip(param_names, params[:len(param_names)]))
+            del params[:len(param_names)]
+            buffer_names = BUFFERS.get(conf['type'], [])
+            if buffers is None and buffer_names:
+                shape, dtype = layer_params['gamma'].shape, layer_params['gamma'].dtype
+                layer_params.update((buffer_name, np.full(shape, value, dtype=dtype))
+                                    for buffer_name, value in zip(buffer_names, [0, 1]))
+            elif buffer_names:
+                if len(buffers) < len(buffer_names):
+                    raise DlException('Missing buffers for layer %s' % name)
+                layer_params.update(zip(buffer_names, buffers[:len(buffer_names)]))
+                del buffers[:len(buffer_names)]
+            input_layer = conf.get('input_layer')
+            if input_layer is None and self.layers:
+                input_layer = self.layers[-1][0]     # sequential networks built with Network.add
+            if isinstance(input_layer, (list, tuple)) or (input_layer is not None and input_layer not in names):
+                raise DlException('Layer %s: only sequential networks are supported' % name)
+            self.layers.append((name, func, conf, layer_params))
+        if params or buffers:
+            raise DlException('%i parameters and %i buffers left after the last layer'
+                              % (len(params), len(buffers or [])))
+
+    @classmethod
+    def from_network(cls, network):
+        """
+        Predictor of a :class:`yadll.network.Network` with its current parameters
+        """
+        return cls(network.to_conf(), [param.get_value() for param in network.params],
+                   [buffer.get_value() for buffer in network.buffers])
+
+    @classmethod
+    def from_artifact(cls, path, mmap_mode='r'):
+        """
+        Predictor of an artifact saved by :func:`yadll.artifact.save_artifact`.
+        The parameters are memory-mapped read-only by default.
+        """
+        from .artifact import read_artifact
+        conf, params, buffers = read_artifact(path, mmap_mode)
+        return cls(conf['model']['network'], params, buffers)
+
+    def predict(self, X):
+        """
+        Output of the network
+
+        Parameters
+        ----------
+        X : numpy array
+            input of the network
+
+        Returns
+        -------
+            the output of the last layer
+        """
+        for name, func, conf, params in self.layers:
+            X = func(conf, params, X)
+        return X
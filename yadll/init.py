@@ -1,11 +1,40 @@
 # -*- coding: UTF-8 -*-
+from contextlib import contextmanager
+
 import numpy as np
 
-from .utils import shared_variable, np_rng
+from .utils import shared_variable, np_rng, floatX
 from .activations import *
 
 # init_obj = glorot_uniform  or init_obj = (glorot_uniform, {'gain':tanh, 'borrow':False})
 
+_skip = False   # see skip_initialization()
+
+
+@contextmanager
+def skip_initialization():
+    """
+    Context in which the initializers return zeros without drawing random values.
+    It is used to build a network whose parameters are loaded afterwards.
+
+    Examples
+    --------
+
+    >>> with skip_initialization():
+    ...     network.from_conf(conf)
+
+    """
+    global _skip
+    skip, _skip = _skip, True
+    try:
+        yield
+    finally:
+        _skip = skip
+
+
+def _zeros(shape, name, borrow, **kwargs):
+    return shared_variable(np.zeros(shape, dtype=kwargs.pop('dtype', floatX)), name=name, borrow=borrow, **kwargs)
+
 
 def initializer(init_obj, shape, name, **kwargs):
     """
@@ -38,6 +67,8 @@ def constant(shape, value=0.0, name=None, borrow=True, **kwargs):
     shape
     scale
     """
+    if _skip:
+        return _zeros(shape, name, borrow, **kwargs)
     return shared_variable(np.ones(shape=shape) * value,
                            name=name, borrow=borrow, **kwargs)
 
@@ -58,6 +89,8 @@ def uniform(shape, scale=0.5, name=None, borrow=True, **kwargs):
     -------
 
     """
+    if _skip:
+        return _zeros(shape, name, borrow, **kwargs)
     if not isinstance(scale, tuple):
         scale = (-scale, scale)      # (low, high)
     return shared_variable(np_rng.uniform(low=scale[0], high=scale[1], size=shape),
@@ -80,6 +113,8 @@ def normal(shape, scale=0.5, name=None, borrow=True, **kwargs):
     -------
 
     """
+    if _skip:
+        return _zeros(shape, name, borrow, **kwargs)
     return shared_variable(np_rng.normal(loc=0.0, scale=scale, size=shape),
                            name=name, borrow=borrow, **kwargs)
 
@@ -189,6 +224,8 @@ def orthogonal(shape, gain=1, name=None, borrow=True, **kwargs):
     .. [1] http://smerity.com/articles/2016/orthogonal_init.html
     .. [2] https://arxiv.org/pdf/1312.6120.pdf
     """
+    if _skip:
+        return _zeros(shape, name, borrow, **kwargs)
     if gain == relu:
         gain = np.sqrt(2)
     flat_shape = (shape[0], np.prod(shape[1:]))
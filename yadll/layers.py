@@ -2,12 +2,16 @@
 """
 All the neural network layers currently supported by yaddll.
 """
+from collections import OrderedDict
+
 from .init import *
 from .objectives import *
 from .updates import *
 from .utils import *
+from .exceptions import *
 
 
+from theano.ifelse import ifelse
 from theano.tensor.signal import pool
 from theano.tensor.nnet import conv
 
@@ -16,6 +20,17 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def is_regularized(coef):
+    """
+    True if a regularisation coefficient has to be added to the graph.
+    A shared coefficient, i.e. `hp.shared('l2_reg')`, is always added so that
+    its value can be changed after compiling.
+    """
+    if isinstance(coef, theano.Variable):
+        return True
+    return bool(coef)
+
+
 class Layer(object):
     """
     Layer is the base class of any neural network layer.
@@ -60,6 +75,12 @@ class Layer(object):
         if name is None:
             self.name = self.__class__.__name__ + ' ' + str(self.id)
         self.params = []
+        # non trainable state saved with the parameters, i.e. running averages
+        self.buffers = []
+        # state carried from one minibatch to the next by stateful layers
+        self.states = []
+        # updates of the buffers built by the last stochastic get_output
+        self.updates = OrderedDict()
         self.reguls = 0
 
     @classmethod
@@ -77,6 +98,35 @@ class Layer(object):
         """
         return self.params
 
+    def get_buffers(self):
+        """
+        Theano shared variables holding the non trainable state of this layer.
+
+        Returns
+        -------
+            list of Theano shared variables updated by the training function
+        """
+        return self.buffers
+
+    def reset_states(self):
+        """
+        Forget the state carried between minibatches, the next minibatch starts
+        from the initial state
+        """
+        for state in getattr(self, 'states', []):
+            state.set_value(np.zeros((0, ) + state.get_value(borrow=True).shape[1:], dtype=state.dtype))
+
+    def get_updates(self):
+        """
+        Updates of the buffers and states of this layer, built by the last call of
+        `get_output(stochastic=True)`
+
+        Returns
+        -------
+            ordered dict of buffer to update expression
+        """
+        return self.updates
+
     def get_reguls(self):
         """
         Theano expression representing the sum of the regulators of
@@ -276,9 +326,9 @@ class DenseLayer(Layer):
         self.activation = get_activation(activation)
         self.l1 = l1
         self.l2 = l2
-        if l1 and l1 != 0:
+        if is_regularized(l1):
             self.reguls += l1 * T.mean(T.abs_(self.W))
-        if l2 and l2 != 0:
+        if is_regularized(l2):
             self.reguls += l2 * T.mean(T.sqr(self.W))
 
     @property
@@ -526,9 +576,9 @@ class ConvLayer(Layer):
         self.params.append(self.W)
         self.l1 = l1
         self.l2 = l2
-        if l1:
+        if is_regularized(l1):
             self.reguls += l1 * T.mean(T.abs_(self.W))
-        if l2:
+        if is_regularized(l2):
             self.reguls += l2 * T.mean(T.sqr(self.W))
 
     @property
@@ -777,10 +827,22 @@ class BatchNormalization(Layer):
 
         y = \gamma * \hat{x} + \beta
 
-    .. warning::
-       When a BatchNormalization layer is used the batch size has to be given at compile time.
-       You can not use None as the first dimension anymore.
-       Prediction has to be made on the same batch size.
+    The statistics are computed per feature over the batch. The running
+    averages `mean` and `var` are updated by the training function and used
+    for inference, so the network predicts any batch size.
+
+    Parameters
+    ----------
+    axis : 'auto', `int` or `tuple` of `int`, (default is 'auto')
+        axes the statistics are computed over. 'auto' is every axis but the
+        channels (axis 1) of a 4D input and every axis but the last one otherwise
+    alpha : `float`, (default is 0.1)
+        weight of the running averages in their update:
+        `mean := alpha * mean + (1 - alpha) * batch mean`
+    epsilon : `float`, (default is 1e-5)
+        added to the variance
+    has_beta : `bool`, (default is True)
+        learn the shift `beta`
 
     References
     ----------
@@ -789,7 +851,7 @@ class BatchNormalization(Layer):
     """
     n_instances = 0
 
-    def __init__(self, incoming, axis=-2, alpha=0.1, epsilon=1e-5, has_beta=True, **kwargs):
+    def __init__(self, incoming, axis='auto', alpha=0.1, epsilon=1e-5, has_beta=True, **kwargs):
         super(BatchNormalization, self).__init__(incoming, **kwargs)
         self.axis = axis
         self.alpha = alpha
@@ -799,29 +861,49 @@ class BatchNormalization(Layer):
         if self.input_shape is not None:
             self.init_params(self.input_shape, has_beta=has_beta)
 
+    @staticmethod
+    def normalization_axes(axis, ndim):
+        """
+        Axes the statistics are computed over for an input of `ndim` dimensions
+        """
+        if axis == 'auto':
+            return (0, 2, 3) if ndim == 4 else tuple(range(ndim - 1))
+        axis = axis if isinstance(axis, (list, tuple)) else (axis, )
+        return tuple(sorted(a % ndim for a in axis))
+
     def init_params(self, input_shape, has_beta):
-        self.gamma = initializer(constant, shape=input_shape, value=1, name='gamma')
+        self.axes = self.normalization_axes(self.axis, len(input_shape))
+        shape = tuple(d for i, d in enumerate(input_shape) if i not in self.axes)
+        self.gamma = initializer(constant, shape=shape, value=1, name='gamma')
         self.params.append(self.gamma)
         if has_beta:
-            self.beta = initializer(constant, shape=(input_shape[1],), value=0, name='beta')
+            self.beta = initializer(constant, shape=shape, value=0, name='beta')
             self.params.append(self.beta)
-        self.mean = initializer(constant, shape=input_shape, value=0, name='mean')
-        self.var = initializer(constant, shape=input_shape, value=1, name='var')
+        self.mean = initializer(constant, shape=shape, value=0, name='mean')
+        self.var = initializer(constant, shape=shape, value=1, name='var')
+        self.buffers.extend([self.mean, self.var])
 
     def get_output(self, stochastic=True, **kwargs):
         x = self.input_layer.get_output(stochastic=stochastic, **kwargs)
         if stochastic:
-            mean = T.mean(x, axis=self.axis)                           # mini-batch mean
-            var = T.var(x, axis=self.axis)                             # mini-batch variance
-            self.mean = self.alpha * self.mean + (1 - self.alpha) * mean
-            self.var = self.alpha * self.var + (1 - self.alpha) * var
+            mean = T.mean(x, axis=self.axes)                           # mini-batch mean
+            var = T.var(x, axis=self.axes)                             # mini-batch variance
+            self.updates = OrderedDict([(self.mean, self.alpha * self.mean + (1 - self.alpha) * mean),
+                                        (self.var, self.alpha * self.var + (1 - self.alpha) * var)])
         else:
             mean = self.mean
             var = self.var
-        x_hat = (x - mean) / T.sqrt(var + self.epsilon)     # normalize
-        y = self.gamma * x_hat                              # scale
+        # broadcast the statistics and the parameters over the normalization axes
+        pattern = []
+        for i in range(x.ndim):
+            pattern.append('x' if i in self.axes else i - len([a for a in self.axes if a < i]))
+
+        def bc(variable):
+            return variable.dimshuffle(pattern)
+        x_hat = (x - bc(mean)) / T.sqrt(bc(var) + self.epsilon)    # normalize
+        y = bc(self.gamma) * x_hat                                 # scale
         if self.has_beta:
-            y += self.beta                                  # shift
+            y += bc(self.beta)                                     # shift
         return y
 
     def to_conf(self):
@@ -833,6 +915,100 @@ class BatchNormalization(Layer):
         return conf
 
 
+def sequence_mask(X, mask_value):
+    """
+    Mask of the time steps of padded sequences
+
+    Parameters
+    ----------
+    X : tensor of shape (n_time_steps, n_batch, n_dim)
+        the padded sequences
+    mask_value : `float`
+        value of the padding steps, a step is padding when all its features equal it
+
+    Returns
+    -------
+        tensor of shape (n_time_steps, n_batch, 1), 0 on the padding steps and 1 elsewhere
+    """
+    return T.any(T.neq(X, mask_value), axis=2, keepdims=True).astype(floatX)
+
+
+def mask_step(step, n_states):
+    """
+    Wrap the step function of a scan so that the states are frozen on the padding steps
+
+    The returned function takes the mask of the step after the input of the step.
+    """
+    def masked_step(x_t, m_t, *args):
+        states = step(x_t, *args)
+        if n_states == 1:
+            return m_t * states + (1. - m_t) * args[0]
+        return [m_t * s_t + (1. - m_t) * s_tm1 for s_t, s_tm1 in zip(states, args[:n_states])]
+    return masked_step
+
+
+def fuse_gates(layer):
+    """
+    Build the parameter blocks of the gates of a recurrent layer
+
+    `layer.gates` maps each block, i.e. 'W', to the names of its gate
+    parameters, laid side by side on the last axis of the block. With
+    `layer.fused_params` each block is one contiguous shared variable added to
+    the parameters and the gate attributes become views of it. Otherwise the
+    block is the concatenation of the gate shared variables.
+    """
+    for block, names in layer.gates.items():
+        gates = [getattr(layer, name) for name in names]
+        axis = gates[0].ndim - 1
+        if not layer.fused_params:
+            setattr(layer, block, T.concatenate(gates, axis=axis))
+            continue
+        fused = shared_variable(np.concatenate([gate.get_value() for gate in gates], axis=axis), name=block)
+        n = gates[0].get_value(borrow=True).shape[axis]
+        for k, name in enumerate(names):
+            setattr(layer, name, fused[:, k * n: (k + 1) * n] if axis else fused[k * n: (k + 1) * n])
+        setattr(layer, block, fused)
+        layer.params.append(fused)
+
+
+def gate_values(layer):
+    """
+    Values of the gate parameters of a recurrent layer
+
+    Returns
+    -------
+        OrderedDict of the gate names and numpy arrays. With fused parameters
+        they are views of the blocks, so writing into them sets the gates in place.
+    """
+    values = OrderedDict()
+    for block, names in layer.gates.items():
+        if not layer.fused_params:
+            values.update((name, getattr(layer, name).get_value(borrow=True)) for name in names)
+            continue
+        value = getattr(layer, block).get_value(borrow=True)
+        n = value.shape[-1] // len(names)
+        values.update((name, value[..., k * n: (k + 1) * n]) for k, name in enumerate(names))
+    return values
+
+
+def carried_state(state, initial):
+    """
+    Initial state of a stateful recurrent layer
+
+    Parameters
+    ----------
+    state : theano shared variable
+        final state of the previous minibatch, empty after a reset
+    initial : tensor
+        initial state of a new sequence
+
+    Returns
+    -------
+        `state` if it has the batch size of `initial`, `initial` otherwise
+    """
+    return ifelse(T.eq(state.shape[0], initial.shape[0]), state, T.unbroadcast(initial, 0, 1))
+
+
 class RNN(Layer):
     r"""
     Recurrent Neural Network
@@ -849,9 +1025,13 @@ class RNN(Layer):
     """
     n_instances = 0
 
-    def __init__(self, incoming, n_units, n_out=None, activation=sigmoid,
-                 last_only=True, grad_clipping=0, go_backwards=False, allow_gc=False, **kwargs):
+    def __init__(self, incoming, n_units, n_out=None, activation=sigmoid, last_only=True, grad_clipping=0,
+                 go_backwards=False, allow_gc=False, mask_value=None, stateful=False, **kwargs):
         super(RNN, self).__init__(incoming, **kwargs)
+        if stateful and go_backwards:
+            raise DlException('A stateful layer can not go backwards')
+        self.stateful = stateful
+        self.mask_value = mask_value
         self.allow_gc = allow_gc
         self.go_backwards = go_backwards
         self.grad_clipping = grad_clipping
@@ -871,6 +1051,9 @@ class RNN(Layer):
         self.params.extend([self.W, self.U, self.b])
         # Non sequence for the scan operator
         self.non_seq = [self.U]
+        if stateful:
+            self.h_state = shared_variable(np.zeros((0, self.n_hidden)), name='h_state')
+            self.states.extend([self.h_state])
 
     @property
     def output_shape(self):
@@ -880,6 +1063,52 @@ class RNN(Layer):
             out_shape = (self.input_shape[0], self.input_shape[1], self.n_out)
         return out_shape
 
+    def initial_states(self, n_batch):
+        """
+        Initial hidden state of a sequence
+
+        Parameters
+        ----------
+        n_batch : `int` or symbolic scalar
+            number of sequences
+
+        Returns
+        -------
+            [h0] of shape (n_batch, n_units)
+        """
+        return [self.activation(T.ones((n_batch, self.n_hidden), dtype=floatX))]
+
+    def one_step(self, x_t, h_tm1, *args):
+        """
+        Recurrence of the scan, `x_t` is the input of the step projected by W and b
+        """
+        # pre-activation
+        pre_act = x_t + T.dot(h_tm1, self.U)
+        # Clip gradients
+        if self.grad_clipping:
+            pre_act = theano.gradient.grad_clip(pre_act, -self.grad_clipping, self.grad_clipping)
+        h_t = self.activation(pre_act)
+
+        return h_t
+
+    def step(self, x_t, states):
+        """
+        One time step of the layer, see :meth:`yadll.network.Network.get_step_output`
+
+        Parameters
+        ----------
+        x_t : symbolic matrix
+            input of the step of shape (n_batch, n_dim)
+        states : list of symbolic matrices
+            hidden state of the previous step, see :meth:`initial_states`
+
+        Returns
+        -------
+            the output of the step and the list of the new states
+        """
+        h_t = self.one_step(T.dot(x_t, self.W) + self.b, *states)
+        return h_t, [h_t]
+
     def get_output(self, **kwargs):
         X = self.input_layer.get_output(**kwargs)
 
@@ -888,29 +1117,28 @@ class RNN(Layer):
         # (n_batch, n_time_steps, n_dim) ->  (n_time_steps, n_batch, n_dim)
         X = X.dimshuffle(1, 0, 2)
         n_batch = X.shape[1]
-        # Input dot product is outside of the scan
-        X = T.dot(X, self.W) + self.b
-
-        c0 = T.ones((n_batch, self.n_hidden), dtype=floatX)
-        h0 = self.activation(c0)
-
-        def one_step(x_t, h_tm1, *args):
-            # pre-activation
-            pre_act = x_t + T.dot(h_tm1, self.U)
-            # Clip gradients
-            if self.grad_clipping:
-                pre_act = theano.gradient.grad_clip(pre_act, -self.grad_clipping, self.grad_clipping)
-            h_t = self.activation(pre_act)
-
-            return h_t
-
+        sequences = [T.dot(X, self.W) + self.b]    # Input dot product is outside of the scan
+        if self.mask_value is not None:
+            sequences.append(sequence_mask(X, self.mask_value))
+
+        h0, = self.initial_states(n_batch)
+        stateful = self.stateful and kwargs.get('stochastic', True)
+        if stateful:
+            h0 = carried_state(self.h_state, h0)
+
+        one_step = self.one_step
+        if self.mask_value is not None:
+            one_step = mask_step(one_step, 1)
         h_vals, _ = theano.scan(fn=one_step,
-                                sequences=X,
+                                sequences=sequences,
                                 outputs_info=h0,
                                 non_sequences=self.non_seq,
                                 go_backwards=self.go_backwards,
                                 allow_gc=self.allow_gc,
                                 strict=True)
+        if stateful:
+            # the final state is the initial state of the next minibatch
+            self.updates = OrderedDict([(self.h_state, h_vals[-1])])
         if self.last_only:
             h_vals = h_vals[-1]
         else:
@@ -928,6 +1156,8 @@ class RNN(Layer):
         conf['grad_clipping'] = self.grad_clipping
         conf['go_backwards'] = self.go_backwards
         conf['allow_gc'] = self.allow_gc
+        conf['mask_value'] = self.mask_value
+        conf['stateful'] = self.stateful
         return conf
 
     def __getstate__(self):
@@ -938,6 +1168,8 @@ class RNN(Layer):
 
     def __setstate__(self, dic):
         self.__dict__.update(dic)
+        self.__dict__.setdefault('mask_value', None)
+        self.__dict__.setdefault('stateful', False)
         self.activation = get_activation(self.activation)
 
 
@@ -980,6 +1212,20 @@ class LSTM(Layer):
     last_only : boolean default is True
         set to true if you only need the last element of the output sequence.
         Theano will optimize graph.
+    mask_value : float, optional
+        value of the padding steps of variable length sequences, a step is padding
+        when all its features equal it. The states are frozen on the padding steps
+        so that the last element is the one of the last step of each sequence.
+    stateful : boolean default is False
+        carry the final hidden and cell states of a training minibatch to the next
+        one, for the truncated backpropagation through time of
+        :meth:`yadll.model.Model.train`. The states are reset by
+        :meth:`Layer.reset_states` and when the batch size changes. The deterministic
+        output, i.e. the predictions, starts from the initial states.
+    fused_params : boolean default is False
+        store the gates of W, U, b and P in one contiguous shared variable each, the
+        gate attributes are views of it. The forward and backward passes then
+        skip the concatenation of the weights and the splitting of their gradients.
 
     References
     ----------
@@ -991,9 +1237,14 @@ class LSTM(Layer):
     """
     n_instances = 0
 
-    def __init__(self, incoming, n_units, peepholes=False, tied_i_f=False, activation=tanh,
-                 last_only=True, grad_clipping=0, go_backwards=False, allow_gc=False, **kwargs):
+    def __init__(self, incoming, n_units, peepholes=False, tied_i_f=False, activation=tanh, last_only=True,
+                 grad_clipping=0, go_backwards=False, allow_gc=False, mask_value=None, stateful=False,
+                 fused_params=False, **kwargs):
         super(LSTM, self).__init__(incoming, **kwargs)
+        if stateful and go_backwards:
+            raise DlException('A stateful layer can not go backwards')
+        self.stateful = stateful
+        self.mask_value = mask_value
         self.allow_gc = allow_gc
         self.grad_clipping = grad_clipping
         self.go_backwards = go_backwards
@@ -1019,32 +1270,35 @@ class LSTM(Layer):
         self.W_o = orthogonal(shape=(self.n_feature, self.n_og), name='W_o')
         self.U_o = orthogonal(shape=(self.n_hidden, self.n_og), name='U_o')
         self.b_o = uniform(shape=(self.n_ig,), scale=(-0.5, .5), name='b_o')
-        # Row representation
-        self.W = T.concatenate([self.W_i, self.W_f, self.W_c, self.W_o], axis=1)
-        self.U = T.concatenate([self.U_i, self.U_f, self.U_c, self.U_o], axis=1)
-        self.b = T.concatenate([self.b_i, self.b_f, self.b_c, self.b_o], axis=0)
-        # Non sequence for the scan operator
-        self.non_seq = [self.U]
+        if peepholes:
+            # the cell state is seen by the input, forget and output gates
+            self.P_i = orthogonal(shape=(self.n_cg, self.n_ig), name='P_i')
+            self.P_f = orthogonal(shape=(self.n_cg, self.n_fg), name='P_f')
+            self.P_o = orthogonal(shape=(self.n_cg, self.n_og), name='P_o')
 
-        if True:
+        self.fused_params = fused_params
+        self.gates = OrderedDict([('W', ['W_i', 'W_f', 'W_c', 'W_o']),
+                                  ('U', ['U_i', 'U_f', 'U_c', 'U_o']),
+                                  ('b', ['b_i', 'b_f', 'b_c', 'b_o'])])
+        if peepholes:
+            self.gates['P'] = ['P_i', 'P_f', 'P_o']
+        if not fused_params:
             self.params.extend([self.W_i, self.U_i, self.b_i,
                                 self.W_f, self.U_f, self.b_f,
                                 self.W_c, self.U_c, self.b_c,
                                 self.W_o, self.U_o, self.b_o])
-        else:
-            self.params.extend([self.W, self.U, self.b])
-
+            if peepholes:
+                self.params.extend([self.P_i, self.P_f, self.P_o])
+        # Row representation
+        fuse_gates(self)
+        # Non sequence for the scan operator
+        self.non_seq = [self.U]
         if peepholes:
-            self.P_i = orthogonal(shape=(self.n_cg, self.n_ig), name='P_i')
-            self.P_f = orthogonal(shape=(self.n_cg, self.n_fg), name='P_f')
-            self.P_c = constant((self.n_cg, self.n_cg), name='P_c')
-            self.P_o = orthogonal(shape=(self.n_cg, self.n_og), name='P_o')
-            self.P = T.concatenate([self.P_i, self.P_f, self.P_c, self.P_o], axis=1)
             self.non_seq.append(self.P)
-            if True:
-                self.params.extend([self.P_i, self.P_f, self.P_o])  # P_c is not a param
-            else:
-                self.params.extend([self.P])
+        if stateful:
+            self.h_state = shared_variable(np.zeros((0, self.n_hidden)), name='h_state')
+            self.c_state = shared_variable(np.zeros((0, self.n_hidden)), name='c_state')
+            self.states.extend([self.h_state, self.c_state])
 
     @property
     def output_shape(self):
@@ -1054,6 +1308,69 @@ class LSTM(Layer):
             out_shape = (self.input_shape[0], self.input_shape[1], self.n_units)
         return out_shape
 
+    def initial_states(self, n_batch):
+        """
+        Initial hidden and cell states of a sequence
+
+        Parameters
+        ----------
+        n_batch : `int` or symbolic scalar
+            number of sequences
+
+        Returns
+        -------
+            [h0, c0] of shape (n_batch, n_units)
+        """
+        c0 = T.ones((n_batch, self.n_hidden), dtype=floatX)
+        return [self.activation(c0), c0]
+
+    def one_step(self, x_t, h_tm1, c_tm1, *args):
+        """
+        Recurrence of the scan, `x_t` is the input of the step projected by W and b
+        """
+        # pre-activation
+        pre_act = x_t + T.dot(h_tm1, self.U)
+        n = self.n_units
+        pre_i, pre_f, pre_c, pre_o = [pre_act[:, k * n: (k + 1) * n] for k in range(4)]
+        if self.peepholes:
+            peep = T.dot(c_tm1, self.P)
+            pre_i, pre_f, pre_o = pre_i + peep[:, 0: n], pre_f + peep[:, n: 2*n], pre_o + peep[:, 2*n: 3*n]
+        # Clip gradients
+        if self.grad_clipping:
+            pre_i, pre_f, pre_c, pre_o = [theano.gradient.grad_clip(pre, -self.grad_clipping, self.grad_clipping)
+                                          for pre in [pre_i, pre_f, pre_c, pre_o]]
+        # gates
+        i_t = sigmoid(pre_i)
+        f_t = sigmoid(pre_f)
+        c_t = self.activation(pre_c)
+        o_t = sigmoid(pre_o)
+
+        if self.tied:
+            i_t = 1. - f_t
+        # cell state
+        c_t = f_t * c_tm1 + i_t * c_t
+        h_t = o_t * self.activation(c_t)
+
+        return [h_t, c_t]
+
+    def step(self, x_t, states):
+        """
+        One time step of the layer, see :meth:`yadll.network.Network.get_step_output`
+
+        Parameters
+        ----------
+        x_t : symbolic matrix
+            input of the step of shape (n_batch, n_dim)
+        states : list of symbolic matrices
+            hidden and cell states of the previous step, see :meth:`initial_states`
+
+        Returns
+        -------
+            the output of the step and the list of the new states
+        """
+        h_t, c_t = self.one_step(T.dot(x_t, self.W) + self.b, *states)
+        return h_t, [h_t, c_t]
+
     def get_output(self, **kwargs):
         X = self.input_layer.get_output(**kwargs)
 
@@ -1062,42 +1379,29 @@ class LSTM(Layer):
         # (n_batch, n_time_steps, n_dim) ->  (n_time_steps, n_batch, n_dim)
         X = X.dimshuffle(1, 0, 2)
         n_batch = X.shape[1]
-        # Input dot product is outside of the scan
-        X = T.dot(X, self.W) + self.b
-
-        c0 = T.ones((n_batch, self.n_hidden), dtype=floatX)
-        h0 = self.activation(c0)
-
-        def one_step(x_t, h_tm1, c_tm1, *args):
-            # pre-activation
-            if self.peepholes:
-                pre_act = x_t + T.dot(h_tm1, self.U) + T.dot(c_tm1, self.P)
-            else:
-                pre_act = x_t + T.dot(h_tm1, self.U)
-            # Clip gradients
-            if self.grad_clipping:
-                pre_act = theano.gradient.grad_clip(pre_act, -self.grad_clipping, self.grad_clipping)
-            # gates
-            i_t = sigmoid(pre_act[:, 0: self.n_units])
-            f_t = sigmoid(pre_act[:, self.n_units: 2*self.n_units])
-            c_t = self.activation(pre_act[:, 2*self.n_units: 3*self.n_units])
-            o_t = sigmoid(pre_act[:, 3*self.n_units: 4*self.n_units])
-
-            if self.tied:
-                i_t = 1. - f_t
-            # cell state
-            c_t = f_t * c_tm1 + i_t * c_t
-            h_t = o_t * self.activation(c_t)
-
-            return [h_t, c_t]
-
-        [h_vals, _], _ = theano.scan(fn=one_step,
-                                     sequences=X,
-                                     outputs_info=[h0, c0],
-                                     non_sequences=self.non_seq,
-                                     go_backwards=self.go_backwards,
-                                     allow_gc=self.allow_gc,
-                                     strict=True)
+        sequences = [T.dot(X, self.W) + self.b]    # Input dot product is outside of the scan
+        if self.mask_value is not None:
+            sequences.append(sequence_mask(X, self.mask_value))
+
+        h0, c0 = self.initial_states(n_batch)
+        stateful = self.stateful and kwargs.get('stochastic', True)
+        if stateful:
+            h0 = carried_state(self.h_state, h0)
+            c0 = carried_state(self.c_state, c0)
+
+        one_step = self.one_step
+        if self.mask_value is not None:
+            one_step = mask_step(one_step, 2)
+        [h_vals, c_vals], _ = theano.scan(fn=one_step,
+                                          sequences=sequences,
+                                          outputs_info=[h0, c0],
+                                          non_sequences=self.non_seq,
+                                          go_backwards=self.go_backwards,
+                                          allow_gc=self.allow_gc,
+                                          strict=True)
+        if stateful:
+            # the final state is the initial state of the next minibatch
+            self.updates = OrderedDict([(self.h_state, h_vals[-1]), (self.c_state, c_vals[-1])])
         if self.last_only:
             h_vals = h_vals[-1]
         else:
@@ -1107,16 +1411,25 @@ class LSTM(Layer):
 
         return h_vals
 
+    def gate_values(self):
+        """
+        Values of the gate parameters, see :func:`gate_values`
+        """
+        return gate_values(self)
+
     def to_conf(self):
         conf = super(LSTM, self).to_conf()
         conf['n_units'] = self.n_units
         conf['peepholes'] = self.peepholes
         conf['tied_i_f'] = self.tied
+        conf['fused_params'] = self.fused_params
         conf['activation'] = activation_to_conf(self.activation)
         conf['last_only'] = self.last_only
         conf['grad_clipping'] = self.grad_clipping
         conf['go_backwards'] = self.go_backwards
         conf['allow_gc'] = self.allow_gc
+        conf['mask_value'] = self.mask_value
+        conf['stateful'] = self.stateful
         return conf
 
     def __getstate__(self):
@@ -1127,7 +1440,18 @@ class LSTM(Layer):
 
     def __setstate__(self, dic):
         self.__dict__.update(dic)
+        self.__dict__.setdefault('mask_value', None)
+        self.__dict__.setdefault('stateful', False)
         self.activation = get_activation(self.activation)
+        if 'gates' not in dic:
+            # layers pickled before the gate blocks had 4 peephole blocks
+            self.fused_params = False
+            self.gates = OrderedDict([('W', ['W_i', 'W_f', 'W_c', 'W_o']), ('U', ['U_i', 'U_f', 'U_c', 'U_o']),
+                                      ('b', ['b_i', 'b_f', 'b_c', 'b_o'])])
+            if self.peepholes:
+                self.gates['P'] = ['P_i', 'P_f', 'P_o']
+                self.P = T.concatenate([self.P_i, self.P_f, self.P_o], axis=1)
+                self.non_seq = [self.U, self.P]
 
 
 class GRU(Layer):
@@ -1140,6 +1464,9 @@ class GRU(Layer):
         \tilde{h_t} &= \tanh(x_t.W_h + (r_t*h_{t-1}).U_h + b_h)\\
         h_t &= (1 - z_t) * h_{t-1} + z_t * \tilde{h_t}
 
+    With `fused_params` the gates of W, U and b are stored in one contiguous
+    shared variable each, as in :class:`LSTM`.
+
     References
     ----------
     .. [1] http://deeplearning.net/tutorial/lstm.html
@@ -1148,9 +1475,13 @@ class GRU(Layer):
     """
     n_instances = 0
 
-    def __init__(self, incoming, n_units, activation=tanh, last_only=True, grad_clipping=0,
-                 go_backwards=False, allow_gc=False, **kwargs):
+    def __init__(self, incoming, n_units, activation=tanh, last_only=True, grad_clipping=0, go_backwards=False,
+                 allow_gc=False, mask_value=None, stateful=False, fused_params=False, **kwargs):
         super(GRU, self).__init__(incoming, **kwargs)
+        if stateful and go_backwards:
+            raise DlException('A stateful layer can not go backwards')
+        self.stateful = stateful
+        self.mask_value = mask_value
         self.allow_gc = allow_gc
         self.grad_clipping = grad_clipping
         self.go_backwards = go_backwards
@@ -1170,19 +1501,21 @@ class GRU(Layer):
         self.W_o = orthogonal(shape=(self.n_feature, self.n_og), name='W_o')
         self.U_o = orthogonal(shape=(self.n_hidden, self.n_og), name='U_o')
         self.b_o = uniform(shape=(self.n_ig,), scale=(-0.5, .5), name='b_o')
-        # Row representation
-        self.W = T.concatenate([self.W_z, self.W_r, self.W_o], axis=1)
-        self.U = T.concatenate([self.U_z, self.U_r, self.U_o], axis=1)
-        self.b = T.concatenate([self.b_z, self.b_r, self.b_o], axis=0)
-        # Non sequence for the scan operator
-        self.non_seq = [self.U]
-
-        if True:
+        self.fused_params = fused_params
+        self.gates = OrderedDict([('W', ['W_z', 'W_r', 'W_o']),
+                                  ('U', ['U_z', 'U_r', 'U_o']),
+                                  ('b', ['b_z', 'b_r', 'b_o'])])
+        if not fused_params:
             self.params.extend([self.W_z, self.U_z, self.b_z,
                                 self.W_r, self.U_r, self.b_r,
                                 self.W_o, self.U_o, self.b_o])
-        else:
-            self.params.extend([self.W, self.U, self.b])
+        # Row representation
+        fuse_gates(self)
+        # Non sequence for the scan operator
+        self.non_seq = [self.U]
+        if stateful:
+            self.h_state = shared_variable(np.zeros((0, self.n_hidden)), name='h_state')
+            self.states.extend([self.h_state])
 
     @property
     def output_shape(self):
@@ -1192,6 +1525,58 @@ class GRU(Layer):
             out_shape = (self.input_shape[0], self.input_shape[1], self.n_units)
         return out_shape
 
+    def initial_states(self, n_batch):
+        """
+        Initial hidden state of a sequence
+
+        Parameters
+        ----------
+        n_batch : `int` or symbolic scalar
+            number of sequences
+
+        Returns
+        -------
+            [h0] of shape (n_batch, n_units)
+        """
+        return [self.activation(T.ones((n_batch, self.n_hidden), dtype=floatX))]
+
+    def one_step(self, x_t, h_tm1, *args):
+        """
+        Recurrence of the scan, `x_t` is the input of the step projected by W and b
+        """
+        # pre-activation
+        pre_act = T.dot(h_tm1, self.U)
+        # Clip gradients
+        if self.grad_clipping:
+            pre_act = theano.gradient.grad_clip(pre_act, -self.grad_clipping, self.grad_clipping)
+        # gates
+        z_t = sigmoid(x_t[:, 0: self.n_units] + pre_act[:, 0: self.n_units])
+        r_t = sigmoid(x_t[:, self.n_units: 2*self.n_units] + pre_act[:, self.n_units: 2*self.n_units])
+        h_t = x_t[:, 2*self.n_units: 3*self.n_units] + r_t * pre_act[:, 2*self.n_units: 3*self.n_units]
+
+        # hidden state
+        h_t = (1 - z_t) * h_tm1 + z_t * h_t
+
+        return h_t
+
+    def step(self, x_t, states):
+        """
+        One time step of the layer, see :meth:`yadll.network.Network.get_step_output`
+
+        Parameters
+        ----------
+        x_t : symbolic matrix
+            input of the step of shape (n_batch, n_dim)
+        states : list of symbolic matrices
+            hidden state of the previous step, see :meth:`initial_states`
+
+        Returns
+        -------
+            the output of the step and the list of the new states
+        """
+        h_t = self.one_step(T.dot(x_t, self.W) + self.b, *states)
+        return h_t, [h_t]
+
     def get_output(self, **kwargs):
         X = self.input_layer.get_output(**kwargs)
 
@@ -1200,35 +1585,28 @@ class GRU(Layer):
         # (n_batch, n_time_steps, n_dim) ->  (n_time_steps, n_batch, n_dim)
         X = X.dimshuffle(1, 0, 2)
         n_batch = X.shape[1]
-        # Input dot product is outside of the scan
-        X = T.dot(X, self.W) + self.b
-
-        c0 = T.ones((n_batch, self.n_hidden), dtype=floatX)
-        h0 = self.activation(c0)
-
-        def one_step(x_t, h_tm1, *args):
-            # pre-activation
-            pre_act = T.dot(h_tm1, self.U)
-            # Clip gradients
-            if self.grad_clipping:
-                pre_act = theano.gradient.grad_clip(pre_act, -self.grad_clipping, self.grad_clipping)
-            # gates
-            z_t = sigmoid(x_t[:, 0: self.n_units] + pre_act[:, 0: self.n_units])
-            r_t = sigmoid(x_t[:, self.n_units: 2*self.n_units] + pre_act[:, self.n_units: 2*self.n_units])
-            h_t = x_t[:, 2*self.n_units: 3*self.n_units] + r_t * pre_act[:, 2*self.n_units: 3*self.n_units]
-
-            # hidden state
-            h_t = (1 - z_t) * h_tm1 + z_t * h_t
-
-            return h_t
-
+        sequences = [T.dot(X, self.W) + self.b]    # Input dot product is outside of the scan
+        if self.mask_value is not None:
+            sequences.append(sequence_mask(X, self.mask_value))
+
+        h0, = self.initial_states(n_batch)
+        stateful = self.stateful and kwargs.get('stochastic', True)
+        if stateful:
+            h0 = carried_state(self.h_state, h0)
+
+        one_step = self.one_step
+        if self.mask_value is not None:
+            one_step = mask_step(one_step, 1)
         h_vals, _ = theano.scan(fn=one_step,
-                                sequences=X,
+                                sequences=sequences,
                                 outputs_info=[h0],
                                 non_sequences=self.non_seq,
                                 go_backwards=self.go_backwards,
                                 allow_gc=self.allow_gc,
                                 strict=True)
+        if stateful:
+            # the final state is the initial state of the next minibatch
+            self.updates = OrderedDict([(self.h_state, h_vals[-1])])
         if self.last_only:
             h_vals = h_vals[-1]
         else:
@@ -1238,14 +1616,23 @@ class GRU(Layer):
 
         return h_vals
 
+    def gate_values(self):
+        """
+        Values of the gate parameters, see :func:`gate_values`
+        """
+        return gate_values(self)
+
     def to_conf(self):
         conf = super(GRU, self).to_conf()
         conf['n_units'] = self.n_units
+        conf['fused_params'] = self.fused_params
         conf['activation'] = activation_to_conf(self.activation)
         conf['last_only'] = self.last_only
         conf['grad_clipping'] = self.grad_clipping
         conf['go_backwards'] = self.go_backwards
         conf['allow_gc'] = self.allow_gc
+        conf['mask_value'] = self.mask_value
+        conf['stateful'] = self.stateful
         return conf
 
     def __getstate__(self):
@@ -1256,7 +1643,158 @@ class GRU(Layer):
 
     def __setstate__(self, dic):
         self.__dict__.update(dic)
+        self.__dict__.setdefault('mask_value', None)
+        self.__dict__.setdefault('stateful', False)
         self.activation = get_activation(self.activation)
+        if 'gates' not in dic:
+            self.fused_params = False
+            self.gates = OrderedDict([('W', ['W_z', 'W_r', 'W_o']), ('U', ['U_z', 'U_r', 'U_o']),
+                                      ('b', ['b_z', 'b_r', 'b_o'])])
+
+
+class Bidirectional(Layer):
+    r"""
+    Bidirectional recurrent layer
+
+    A forward and a backward recurrent layer of the same type read the sequence
+    in both directions. Their input projections are computed by a single dot
+    product and both directions are computed by a single scan, the backward
+    direction reading the reversed projection.
+
+    .. math ::
+        h_t = merge(\overrightarrow{h_t}, \overleftarrow{h_t})
+
+    Parameters
+    ----------
+    incoming : a `Layer`
+        The incoming layer with an output_shape = (n_batches, n_time_steps, n_dim)
+    n_units : int
+        number of units of each direction
+    layer_type : {'RNN', 'LSTM', 'GRU'}, default is 'LSTM'
+        type of the recurrent layers
+    merge_mode : {'concat', 'sum', 'average'}, default is 'concat'
+        merge of the outputs of the two directions
+    last_only : boolean default is True
+        only output the last element of each direction, i.e. the forward output
+        of the last step and the backward output of the first step
+    mask_value : float, optional
+        value of the padding steps of variable length sequences, see :class:`LSTM`
+    layer_conf : dict, optional
+        other arguments of the recurrent layers, i.e. {'peepholes': True}
+
+    References
+    ----------
+    .. [1] https://www.cs.toronto.edu/~graves/asru_2013.pdf
+    """
+    n_instances = 0
+
+    def __init__(self, incoming, n_units, layer_type='LSTM', merge_mode='concat', last_only=True,
+                 mask_value=None, layer_conf=None, **kwargs):
+        super(Bidirectional, self).__init__(incoming, **kwargs)
+        if layer_type not in ['RNN', 'LSTM', 'GRU']:
+            raise DlException('Bidirectional layer of unknown type %s' % layer_type)
+        if merge_mode not in ['concat', 'sum', 'average']:
+            raise DlException('Unknown merge mode %s' % merge_mode)
+        self.n_units = n_units
+        self.layer_type = layer_type
+        self.merge_mode = merge_mode
+        self.last_only = last_only
+        self.mask_value = mask_value
+        self.layer_conf = dict(layer_conf or {})
+        layer_class = globals()[layer_type]
+        self.forward = layer_class(incoming, n_units, last_only=last_only, mask_value=mask_value,
+                                   name=self.name + ' forward', **self.layer_conf)
+        self.backward = layer_class(incoming, n_units, last_only=last_only, mask_value=mask_value, go_backwards=True,
+                                    name=self.name + ' backward', **self.layer_conf)
+        self.params.extend(self.forward.params + self.backward.params)
+        # Row representation of the two directions
+        self.W = T.concatenate([self.forward.W, self.backward.W], axis=1)
+        self.b = T.concatenate([self.forward.b, self.backward.b], axis=0)
+        # Non sequence for the scan operator
+        self.non_seq = self.forward.non_seq + self.backward.non_seq
+
+    @property
+    def output_shape(self):
+        n_out = 2 * self.n_units if self.merge_mode == 'concat' else self.n_units
+        if self.last_only:
+            return self.input_shape[0], n_out
+        return self.input_shape[0], self.input_shape[1], n_out
+
+    def initial_states(self, n_batch):
+        """
+        The backward direction reads the sequence from its end, a bidirectional
+        layer can not compute a single time step
+        """
+        raise DlException('Bidirectional layer %s can not compute a single time step' % self.name)
+
+    def step(self, x_t, states):
+        """
+        The backward direction reads the sequence from its end, a bidirectional
+        layer can not compute a single time step
+        """
+        raise DlException('Bidirectional layer %s can not compute a single time step' % self.name)
+
+    def get_output(self, **kwargs):
+        X = self.input_layer.get_output(**kwargs)
+
+        if X.ndim > 3:
+            X = T.flatten(X, 3)
+        # (n_batch, n_time_steps, n_dim) ->  (n_time_steps, n_batch, n_dim)
+        X = X.dimshuffle(1, 0, 2)
+        n_batch = X.shape[1]
+        # Input dot product of both directions is outside of the scan
+        X_proj = T.dot(X, self.W) + self.b
+        n_forward = self.forward.W.shape[1]
+        sequences = [X_proj[:, :, :n_forward], X_proj[::-1, :, n_forward:]]
+        if self.mask_value is not None:
+            mask = sequence_mask(X, self.mask_value)
+            sequences.extend([mask, mask[::-1]])
+        forward_states = self.forward.initial_states(n_batch)
+        backward_states = self.backward.initial_states(n_batch)
+        n_states = len(forward_states)
+
+        def one_step(*args):
+            sequences_t, states = args[:len(sequences)], args[len(sequences): len(sequences) + 2 * n_states]
+            new_states = []
+            for layer, x_t, k in [(self.forward, sequences_t[0], 0), (self.backward, sequences_t[1], n_states)]:
+                layer_states = layer.one_step(x_t, *states[k: k + n_states])
+                new_states.extend(layer_states if isinstance(layer_states, list) else [layer_states])
+            if self.mask_value is not None:
+                # the states are frozen on the padding steps
+                masks = [sequences_t[2]] * n_states + [sequences_t[3]] * n_states
+                new_states = [m_t * s_t + (1. - m_t) * s_tm1 for m_t, s_t, s_tm1 in zip(masks, new_states, states)]
+            return new_states
+
+        vals, _ = theano.scan(fn=one_step,
+                              sequences=sequences,
+                              outputs_info=forward_states + backward_states,
+                              non_sequences=self.non_seq,
+                              allow_gc=self.forward.allow_gc,
+                              strict=True)
+        h_forward, h_backward = vals[0], vals[n_states]
+        if self.last_only:
+            h_forward, h_backward = h_forward[-1], h_backward[-1]
+        else:
+            # the backward outputs are aligned on the time steps
+            h_forward, h_backward = h_forward.dimshuffle(1, 0, 2), h_backward[::-1].dimshuffle(1, 0, 2)
+        if self.merge_mode == 'concat':
+            return T.concatenate([h_forward, h_backward], axis=h_forward.ndim - 1)
+        if self.merge_mode == 'sum':
+            return h_forward + h_backward
+        return (h_forward + h_backward) / 2.
+
+    def to_conf(self):
+        conf = super(Bidirectional, self).to_conf()
+        conf['n_units'] = self.n_units
+        conf['layer_type'] = self.layer_type
+        conf['merge_mode'] = self.merge_mode
+        conf['last_only'] = self.last_only
+        conf['mask_value'] = self.mask_value
+        conf['layer_conf'] = self.layer_conf
+        # confs of the two directions for the numpy inference
+        conf['forward'] = self.forward.to_conf()
+        conf['backward'] = self.backward.to_conf()
+        return conf
 
 
 # class BNLSTM(LSTM):
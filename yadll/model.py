@@ -1,9 +1,12 @@
 # -*- coding: UTF-8 -*-
+import os
 import pickle
+from collections import OrderedDict
 import sys
 import yadll
 from .layers import *
 from .exceptions import *
+from .cache import CompileCache, hash_conf, network_structure
 
 import logging
 
@@ -83,10 +86,15 @@ class Model(object):
     file : `string`
         name of the file to save the model. If omitted a name is generated with
         the model name + date + time of training
+    compile_cache : `bool`, `string` or :class:`yadll.cache.CompileCache`, optional
+        persistent cache of the compiled functions. True uses the default
+        cache directory, a string is the cache directory.
+        Hits, misses and compile time saved are reported in `report['compile_cache']`
 
     """
     def __init__(self, network=None, data=None, hyperparameters=None, name='model',
-                 updates=sgd, objective=CCE, evaluation_metric=categorical_accuracy, file=None):
+                 updates=sgd, objective=CCE, evaluation_metric=categorical_accuracy, file=None,
+                 compile_cache=None):
         self.network = network
         self.data = data             # data [(train_set_x, train_set_y), (valid_set_x, valid_set_y), (test_set_x, test_set_y)]
         self.data_shape = None
@@ -100,21 +108,43 @@ class Model(object):
         self.file = file
         self.save_mode = None          # None, 'end' or 'each'
         self.index = T.iscalar()       # index to a [mini]batch
-        self.epoch_index = T.ivector() # index per epoch
+        self.epoch_index = None        # shared permutation of the training set, reshuffled each epoch
+        self.initial_state = None      # parameters and optimizer state after compiling, see reset()
         self.x = self.y = None  # T.matrix(name='y')
         self.train_func = self.validate_func = self.test_func = self.predict_func = None
+        self.evaluate_func = None      # validation and test errors of a chunk of each set in one call
+        self.train_steps_func = None   # steps_per_call minibatches in one call
+        self.step_func = None          # one time step of the recurrent layers, see predict_step
+        self.initial_states_func = None
+        self.steps_per_call = 1
         self.report = dict()
+        if compile_cache is True:
+            compile_cache = CompileCache()
+        elif isinstance(compile_cache, str):
+            compile_cache = CompileCache(compile_cache)
+        self.compile_cache = compile_cache
 
     @timer(' Compiling')
-    def compile(self, compile_arg):
+    def compile(self, compile_arg, steps_per_call=None):
         """
         Compile theano functions of the model
 
         Parameters
         ----------
         compile_arg: `string` or `List` of `string`
-            value can be 'train', 'validate', 'test', 'predict' and 'all'
+            value can be 'train', 'train_steps', 'validate', 'test', 'evaluate', 'predict', 'step' and 'all'.
+            'evaluate' is the fused validation and test function used by `train(evaluation='fused')`.
+            'train_steps' trains `steps_per_call` consecutive minibatches in one call.
+            'step' computes one time step of a recurrent network, see :meth:`predict_step`.
+            It is not compiled by 'all'
+        steps_per_call : `int`, optional
+            number of minibatches of `train_steps_func`. 'all' only compiles
+            `train_steps_func` if it is greater than 1.
         """
+        if isinstance(compile_arg, str):
+            compile_arg = [compile_arg]
+        if steps_per_call is not None:
+            self.steps_per_call = steps_per_call
         if self.data is None and self.data_shape is None:
             raise NoDataFoundException
         if self.data_shape is None:
@@ -136,29 +166,51 @@ class Model(object):
             if self.network.layers[0].input is None:
                 self.network.layers[0].input = self.x
 
+        func_names = [name for name in ['train', 'validate', 'test', 'evaluate', 'predict']
+                      if name in compile_arg or 'all' in compile_arg]
+        if 'step' in compile_arg:
+            func_names.append('step')
+        if 'train_steps' in compile_arg or ('all' in compile_arg and self.steps_per_call > 1):
+            func_names.append('train_steps')
+        host_data = self.data is not None and not self.data.shared
+        if ('train' in func_names or 'train_steps' in func_names) and not host_data and self.epoch_index is None:
+            # the permutation lives on device so train_func only receives the minibatch index
+            n_train = self.data.train_set_x.get_value(borrow=True).shape[0]
+            self.epoch_index = shared_variable(np.arange(n_train), dtype=intX, name='epoch_index')
+
+        ################################################
+        # Compilation cache
+        if self.compile_cache is not None:
+            shared_variables = self.cache_shared_variables()
+            for name in list(func_names):
+                func = self.compile_cache.load(self.cache_key(name), shared_variables, T_rng)
+                if func is not None:
+                    setattr(self, name + '_func', func)
+                    func_names.remove(name)
+            self.report['compile_cache'] = self.compile_cache.stats()
+            if not func_names:
+                self.save_initial_state()
+                return
+
+        def function(name, *args, **kwargs):
+            start_time = timeit.default_timer()
+            func = theano.function(*args, name=name, **kwargs)
+            if self.compile_cache is not None:
+                self.compile_cache.save(self.cache_key(name), func, self.cache_shared_variables(),
+                                        timeit.default_timer() - start_time)
+                self.report['compile_cache'] = self.compile_cache.stats()
+            return func
+
         ################################################
         # cost
-        cost = T.mean(self.objective(prediction=self.network.get_output(stochastic=True), target=self.y))
-        # add regularisation
-        cost += self.network.reguls
+        cost = self.get_cost()
 
         ################################################
         # Updates
         # updates of the model as a list of (variable, update expression) pairs
-        update_param = {}
-        if hasattr(self.hp, 'learning_rate'):
-            update_param['learning_rate'] = self.hp.learning_rate
-        if hasattr(self.hp, 'momentum'):
-            update_param['momentum'] = self.hp.momentum
-        if hasattr(self.hp, 'epsilon'):
-            update_param['epsilon'] = self.hp.epsilon
-        if hasattr(self.hp, 'rho'):
-            update_param['rho'] = self.hp.rho
-        if hasattr(self.hp, 'beta1'):
-            update_param['beta1'] = self.hp.beta1
-        if hasattr(self.hp, 'beta2'):
-            update_param['beta2'] = self.hp.beta1
-        updates = self.updates(cost, self.network.params, **update_param)
+        updates = self.updates(cost, self.network.params, **self.update_parameters())
+        # running averages of the layers
+        updates.update(self.network.get_updates())
 
         ################################################
         # Validation & Test functions
@@ -167,23 +219,208 @@ class Model(object):
         ################################################
         # functions for training, validating and testing the model
         logger.info('... Compiling the model')
-        if 'train' in compile_arg or 'all' in compile_arg:
-            self.train_func = theano.function(inputs=[self.index, self.epoch_index], outputs=cost, updates=updates, name='train', # on_unused_input='ignore', # mode='DebugMode',
-                                              givens={self.x: self.data.train_set_x[self.epoch_index[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]],
-                                                      self.y: self.data.train_set_y[self.epoch_index[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]]})
-        if 'validate' in compile_arg or 'all' in compile_arg:
-            self.validate_func = theano.function(inputs=[self.index], outputs=error, name='validate',
-                                                 givens={self.x: self.data.valid_set_x[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size],
-                                                         self.y: self.data.valid_set_y[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]})
-        if 'test' in compile_arg or 'all' in compile_arg:
-            self.test_func = theano.function(inputs=[self.index], outputs=error, name='test',
-                                             givens={self.x: self.data.test_set_x[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size],
-                                                     self.y: self.data.test_set_y[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]})
+        if host_data:
+            # minibatches are fed from the host by the training loop
+            if 'train' in func_names:
+                self.train_func = function('train', inputs=[self.x, self.y], outputs=cost, updates=updates)
+            if 'validate' in func_names:
+                self.validate_func = function('validate', inputs=[self.x, self.y], outputs=error)
+            if 'test' in func_names:
+                self.test_func = function('test', inputs=[self.x, self.y], outputs=error)
+        else:
+            if 'train' in func_names:
+                self.train_func = function('train', inputs=[self.index], outputs=cost, updates=updates, # on_unused_input='ignore', # mode='DebugMode',
+                                           givens={self.x: self.data.train_set_x[self.epoch_index[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]],
+                                                   self.y: self.data.train_set_y[self.epoch_index[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]]})
+            if 'validate' in func_names:
+                self.validate_func = function('validate', inputs=[self.index], outputs=error,
+                                              givens={self.x: self.data.valid_set_x[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size],
+                                                      self.y: self.data.valid_set_y[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]})
+            if 'test' in func_names:
+                self.test_func = function('test', inputs=[self.index], outputs=error,
+                                          givens={self.x: self.data.test_set_x[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size],
+                                                  self.y: self.data.test_set_y[self.index * self.hp.batch_size: (self.index + 1) * self.hp.batch_size]})
+        ################################################
+        # function training steps_per_call consecutive minibatches
+        if 'train_steps' in func_names:
+            n_steps = self.steps_per_call
+            if host_data:
+                # minibatches are stacked on a new first axis
+                steps_x = T.TensorType(self.x.dtype, (False,) + self.x.broadcastable)('steps_x')
+                steps_y = T.TensorType(self.y.dtype, (False,) + self.y.broadcastable)('steps_y')
+                inputs, sequences = [steps_x, steps_y], [steps_x, steps_y]
+            else:
+                inputs = [self.index]
+                sequences = [T.arange(self.index, self.index + n_steps)]
+
+            def step(*args):
+                if host_data:
+                    x, y = args
+                else:
+                    batch = self.epoch_index[args[0] * self.hp.batch_size: (args[0] + 1) * self.hp.batch_size]
+                    x, y = self.data.train_set_x[batch], self.data.train_set_y[batch]
+                # each step reads the shared variables updated by the previous one
+                variables = list(updates.keys())
+                outputs = theano.clone([cost] + [updates[v] for v in variables], replace={self.x: x, self.y: y})
+                return outputs[0], OrderedDict(zip(variables, outputs[1:]))
+            costs, steps_updates = theano.scan(step, sequences=sequences, n_steps=n_steps)
+            self.train_steps_func = function('train_steps', inputs=inputs, outputs=costs, updates=steps_updates)
+
+        ################################################
+        # fused function for evaluating chunks of the validation and test sets
+        if 'evaluate' in func_names:
+            if host_data:
+                valid_x, valid_y, test_x, test_y = self.x.type(), self.y.type(), self.x.type(), self.y.type()
+                inputs = [valid_x, valid_y, test_x, test_y]
+            else:
+                inputs = T.iscalars(4)
+                valid_x = self.data.valid_set_x[inputs[0]: inputs[1]]
+                valid_y = self.data.valid_set_y[inputs[0]: inputs[1]]
+                test_x = self.data.test_set_x[inputs[2]: inputs[3]]
+                test_y = self.data.test_set_y[inputs[2]: inputs[3]]
+            prediction = self.network.get_output(stochastic=False)
+            # sums of the errors so that chunks of different sizes can be accumulated
+            errors = [categorical_error(theano.clone(prediction, replace={self.x: x}), y) * T.cast(y.shape[0], floatX)
+                      for x, y in [(valid_x, valid_y), (test_x, test_y)]]
+            self.evaluate_func = function('evaluate', inputs=inputs, outputs=errors)
+
         ################################################
         # functions for predicting
-        if 'predict' in compile_arg or 'all' in compile_arg:
+        if 'predict' in func_names:
             prediction = self.network.get_output(stochastic=False)
-            self.predict_func = theano.function(inputs=[self.x], outputs=prediction, name='predict')
+            self.predict_func = function('predict', inputs=[self.x], outputs=prediction)
+
+        ################################################
+        # function computing one time step of the recurrent layers
+        if 'step' in func_names:
+            x_t = T.TensorType(floatX, self.x.broadcastable[1:])('x_t')
+            states = [T.matrix('state_%i' % i, dtype=floatX) for i in range(len(self.network.initial_states(1)))]
+            output, new_states = self.network.get_step_output(x_t, states)
+            self.step_func = function('step', inputs=[x_t] + states, outputs=[output] + new_states)
+
+        self.save_initial_state()
+
+    def get_cost(self):
+        """
+        Training cost: the objective on the stochastic output of the network plus the regularisation
+        """
+        cost = T.mean(self.objective(prediction=self.network.get_output(stochastic=True), target=self.y))
+        # add regularisation
+        cost += self.network.reguls
+        return cost
+
+    def save_initial_state(self):
+        """
+        Keep a copy of the parameters and of the optimizer state updated by the training
+        function so that :meth:`reset` can restore them.
+        """
+        if self.train_func is not None:
+            self.initial_state = [(i.variable, i.variable.get_value())
+                                  for i in self.train_func.maker.inputs if i.update is not None]
+
+    def state_variables(self):
+        """
+        Shared variables holding the training state: the parameters of the network,
+        named `param_<i>`, its buffers (running averages), named `buffer_<i>`,
+        the state registered by the update rule, named
+        `optimizer_<slot>_<i>` or `optimizer_<slot>` (see :func:`yadll.updates.state_variable`),
+        and the other variables updated by the training function (random generators),
+        named `state_<i>`.
+
+        Returns
+        -------
+            an ordered dict of name to shared variable
+        """
+        variables = OrderedDict(('param_%i' % i, param) for i, param in enumerate(self.network.params))
+        variables.update(('buffer_%i' % i, buffer) for i, buffer in enumerate(self.network.buffers))
+        if self.train_func is not None:
+            params = set(self.network.params + self.network.buffers)
+            updated = [i.variable for i in self.train_func.maker.inputs
+                       if i.update is not None and i.variable not in params]
+            n_others = 0
+            for variable in updated:
+                optimizer_state = getattr(variable.tag, 'optimizer_state', None)
+                if optimizer_state is None:
+                    variables['state_%i' % n_others] = variable
+                    n_others += 1
+                elif optimizer_state[1] is None:
+                    variables['optimizer_%s' % optimizer_state[0]] = variable
+                else:
+                    variables['optimizer_%s_%i' % optimizer_state] = variable
+        return variables
+
+    def reset(self):
+        """
+        Reset the parameters and the optimizer state to their values after compiling.
+        The model can then be trained again, i.e. with other values of the shared
+        hyperparameters, without recompiling.
+        """
+        if self.initial_state is None:
+            raise DlException('Model has to be compiled before being reset')
+        for variable, value in self.initial_state:
+            variable.set_value(value.copy())
+
+    def update_parameters(self):
+        """
+        Hyperparameters passed to the updates function.
+        They are shared variables so that they can be changed without recompiling.
+        """
+        update_param = {}
+        for name in ['learning_rate', 'momentum', 'epsilon', 'rho', 'beta1', 'beta2']:
+            if hasattr(self.hp, name):
+                update_param[name] = self.hp.shared(name)
+        return update_param
+
+    def cache_shared_variables(self):
+        """
+        Shared variables of the model that are not stored in the compilation cache
+        """
+        shared_variables = dict(('param_%i' % i, param) for i, param in enumerate(self.network.params))
+        shared_variables.update(('buffer_%i' % i, buffer) for i, buffer in enumerate(self.network.buffers))
+        layer_states = [state for layer in self.network.layers for state in layer.states]
+        shared_variables.update(('layer_state_%i' % i, state) for i, state in enumerate(layer_states))
+        shared_variables['epoch_index'] = self.epoch_index
+        if self.hp is not None:
+            self.update_parameters()
+            for name, variable in self.hp.hp_shared.items():
+                shared_variables['hp_' + name] = variable
+        if self.data is not None:
+            for set_name in ['train', 'valid', 'test']:
+                for axis in ['x', 'y']:
+                    variable = getattr(self.data, '%s_set_%s' % (set_name, axis))
+                    if isinstance(variable, theano.Variable):
+                        for i, v in enumerate(theano.gof.graph.inputs([variable])):
+                            if isinstance(v, theano.compile.SharedVariable):
+                                shared_variables['%s_set_%s_%i' % (set_name, axis, i)] = v
+        return shared_variables
+
+    def cache_key(self, func_name):
+        """
+        Key of a compiled function in the compilation cache.
+        It is a stable hash of the network structure, the updates, the objective,
+        the batch size and everything else that changes the compiled graph.
+        """
+        conf = {'function': func_name,
+                'network': network_structure(self.network.to_conf()),
+                'x': str(self.x.type),
+                'versions': [theano.__version__, yadll.__version__],
+                'config': [floatX, str(theano.config.mode), str(theano.config.device),
+                           str(theano.config.optimizer)]}
+        if func_name not in ('predict', 'step'):
+            if self.data is None or self.hp is None:
+                raise NoDataFoundException('Function %s needs the data and the hyperparameters of the model'
+                                           % func_name)
+            conf['y'] = str(self.y.type)
+            conf['updates'] = self.updates
+            conf['update_parameters'] = self.update_parameters()
+            conf['objective'] = self.objective
+            conf['batch_size'] = self.hp.batch_size
+            if func_name == 'train_steps':
+                conf['steps_per_call'] = self.steps_per_call
+            conf['shared_data'] = self.data.shared
+            conf['data'] = sorted((name, str(v.type)) for name, v in self.cache_shared_variables().items()
+                                  if name.endswith(('_x_0', '_y_0')))
+        return hash_conf(conf)
 
     @timer(' Unsupervised Pre-Training')
     def pretrain(self):
@@ -203,12 +440,17 @@ class Model(object):
             if self.network.layers[0].input is None:
                 self.network.layers[0].input = self.x
 
+        if not self.data.shared:
+            raise DataFormatException('Unsupervised pre-training requires shared data')
+
         for layer in self.network.layers:
             if isinstance(layer, UnsupervisedLayer):
                 layer.unsupervised_training(self.x, self.data.train_set_x)
 
     @timer(' Training')
-    def train(self, unsupervised_training=True, save_mode=None, early_stop=True, shuffle=True, **kwargs):
+    def train(self, unsupervised_training=True, save_mode=None, early_stop=True, shuffle=True, prefetch=0,
+              evaluation='batch', eval_memory=2 ** 28, steps_per_call=1, checkpoint=None, checkpoint_frequency=None,
+              resume=None, sampler=None, tbptt=None, **kwargs):
         """
         Training the network
 
@@ -220,11 +462,50 @@ class Model(object):
             None (default), model will not be saved unless name specified in the
             model definition.
             'end', model will only be saved at the end of the training
-            'each', model will be saved each time the model is improved
+            'each', the parameters and optimizer state are checkpointed in the background
+            each time the model is improved, and the model is saved at the end of the training.
+            The best model is kept in the checkpoint `<checkpoint>/checkpoint_best.npz`,
+            which is never pruned, see :meth:`yadll.checkpoint.Checkpointer.best`
         early_stop : `bool`, (default is True)
             early stopping when validation score is not improving
         shuffle : `bool`, (default is True)
-            reshuffle the training set at each epoch. Batches will then be different from one epoch to another
+            reshuffle the training set at each epoch. Batches will then be different from one epoch to another.
+            The permutation is stored in the shared variable `epoch_index` and is only
+            copied to the device once per epoch
+        prefetch : `int` or :class:`yadll.data.BatchPrefetcher`, (default is 0)
+            only used when the data is not shared. Number of minibatches prepared in
+            advance by a background thread, or a configured prefetcher. The time the
+            training waited for data is reported in `data_stall`
+        evaluation : {'batch', 'fused'}, (default is 'batch')
+            'batch' calls the validation and test functions once per minibatch.
+            'fused' evaluates the validation and test sets together in a few large
+            chunks with `evaluate_func`, see :meth:`evaluate_fused`
+        eval_memory : `int`, (default is 256 MB)
+            memory budget of a chunk of the 'fused' evaluation in bytes
+        steps_per_call : `int`, (default is 1)
+            number of consecutive minibatches trained by one call of `train_steps_func`.
+            Calls never go past a validation or an early stopping check, the
+            minibatches before them are trained one at a time with `train_func`
+        checkpoint : `string` or :class:`yadll.checkpoint.Checkpointer`, optional
+            checkpointer, or its directory, of the 'each' save mode. Default is the
+            directory `<file>_checkpoints` keeping the last 3 checkpoints
+        checkpoint_frequency : `int`, optional
+            number of minibatches between two checkpoints of the 'each' save mode.
+            By default only the best models are checkpointed
+        resume : `string` or :class:`yadll.checkpoint.Checkpointer`, optional
+            checkpoint file, checkpoint directory or checkpointer to resume the training
+            from. The parameters, optimizer state, random state, position in the epoch and
+            early stopping state are restored from the latest checkpoint of a directory,
+            so that the training continues as if it had not been interrupted
+        sampler : function, optional
+            function of the random generator returning the order of the training samples
+            of an epoch, i.e. a :class:`yadll.data.BucketSampler` grouping the sequences
+            of similar length. It replaces the shuffling
+        tbptt : `int`, optional
+            length of the windows of the truncated backpropagation through time, only
+            used when the data is not shared. Each minibatch of sequences is trained
+            window by window with :meth:`train_tbptt`, the stateful recurrent layers
+            carry their states from one window to the next
 
         Returns
         -------
@@ -241,19 +522,35 @@ class Model(object):
         if self.data.valid_set_x is not None:
             self.has_validation = True
 
+        if tbptt and self.data.shared:
+            raise DataFormatException('Truncated backpropagation through time requires non shared data')
+
         self.early_stop = early_stop and self.has_validation
 
         ################################################
         # Compile if not done already
         if self.train_func is None:
             compile_arg = kwargs.pop('compile_arg', ['train', 'test'])
+            # the caller's list is not modified
+            compile_arg = [compile_arg] if isinstance(compile_arg, str) else list(compile_arg)
             if self.has_validation:
                 compile_arg.append('validate')
-            self.compile(compile_arg=compile_arg)
+            if evaluation == 'fused':
+                compile_arg.append('evaluate')
+            if steps_per_call > 1:
+                compile_arg.append('train_steps')
+            self.compile(compile_arg=compile_arg, steps_per_call=steps_per_call)
+        else:
+            if evaluation == 'fused' and self.evaluate_func is None:
+                self.compile(compile_arg='evaluate')
+            if steps_per_call > 1 and (self.train_steps_func is None or self.steps_per_call != steps_per_call):
+                self.compile(compile_arg='train_steps', steps_per_call=steps_per_call)
 
-        if unsupervised_training and self.network.has_unsupervised_layer:
+        if unsupervised_training and self.network.has_unsupervised_layer and resume is None:
             self.pretrain()
 
+        if (checkpoint is not None or checkpoint_frequency) and save_mode is None:
+            save_mode = 'each'
         if save_mode is not None:
             if save_mode not in ['end', 'each']:
                 self.save_mode = 'end'
@@ -266,12 +563,26 @@ class Model(object):
         if self.file is not None and save_mode is None:
             self.save_mode = 'end'
 
-        n_train_batches = self.data.train_set_x.get_value(borrow=True).shape[0] // self.hp.batch_size
-        n_test_batches = self.data.test_set_x.get_value(borrow=True).shape[0] // self.hp.batch_size
+        checkpointer = None
+        if self.save_mode == 'each':
+            if isinstance(checkpoint, yadll.checkpoint.Checkpointer):
+                checkpointer = checkpoint
+            else:
+                checkpointer = yadll.checkpoint.Checkpointer(
+                    checkpoint or os.path.splitext(self.file)[0] + '_checkpoints')
+
+        n_train_batches = self.n_batches(self.data.train_set_x)
+        n_test_batches = self.n_batches(self.data.test_set_x)
         if self.has_validation:
-            n_valid_batches = self.data.valid_set_x.get_value(borrow=True).shape[0] // self.hp.batch_size
+            n_valid_batches = self.n_batches(self.data.valid_set_x)
 
-        train_idx = np.arange(n_train_batches * self.hp.batch_size, dtype='int32')
+        train_idx = np.arange(n_train_batches * self.hp.batch_size, dtype=intX)
+        if self.data.shared:
+            self.epoch_index.set_value(train_idx, borrow=True)
+        else:
+            prefetcher = prefetch if isinstance(prefetch, yadll.data.BatchPrefetcher) \
+                else yadll.data.BatchPrefetcher(depth=prefetch)
+            stall_time = prefetcher.stall_time
 
         self.report['test_values'] = []
         self.report['validation_values'] = []
@@ -292,28 +603,99 @@ class Model(object):
         epoch = 0
         done_looping = False
 
+        progress = None
+        if resume is not None:
+            resume_file = None
+            if not isinstance(resume, yadll.checkpoint.Checkpointer):
+                if os.path.isdir(resume):
+                    resume = yadll.checkpoint.Checkpointer(resume)
+                else:
+                    resume, resume_file = yadll.checkpoint.Checkpointer(os.path.dirname(resume)), resume
+            progress = resume.restore(self, resume_file)
+            if progress is None:
+                raise DlException('Checkpoint has no training progress, it can not be resumed')
+            np_rng.set_state(tuple([progress['np_rng'][0], progress['np_rng_keys']] + progress['np_rng'][1:]))
+            epoch = progress['epoch'] - 1
+            patience = progress['patience']
+            best_validation_loss = progress['best_validation_loss']
+            best_iter = progress['best_iter']
+            test_score = progress['test_score']
+            self.report['validation_values'] = [tuple(v) for v in progress['validation_values']]
+            self.report['test_values'] = [tuple(v) for v in progress['test_values']]
+            logger.info('... Resuming the training at epoch %i, minibatch %i/%i'
+                        % (progress['epoch'], progress['minibatch_index'] + 1, n_train_batches))
+
+        def training_progress():
+            rng_state = np_rng.get_state()
+            return {'epoch': epoch, 'minibatch_index': int(minibatch_index), 'train_idx': train_idx,
+                    'patience': patience, 'best_validation_loss': float(best_validation_loss),
+                    'best_iter': int(best_iter), 'test_score': float(test_score),
+                    'validation_values': self.report['validation_values'],
+                    'test_values': self.report['test_values'],
+                    'np_rng': [rng_state[0]] + [float(v) if isinstance(v, float) else int(v) for v in rng_state[2:]],
+                    'np_rng_keys': rng_state[1]}
+        last_checkpoint = 0
+
         while (epoch < self.hp.n_epochs) and (not done_looping):
             epoch += 1
-            if shuffle:
+            minibatch_index = -1
+            if progress is not None:
+                # the resumed epoch continues with its own permutation
+                minibatch_index = progress['minibatch_index']
+                train_idx[:] = progress['train_idx']
+                last_checkpoint = (epoch - 1) * n_train_batches + minibatch_index + 1
+                progress = None
+                if self.data.shared:
+                    self.epoch_index.set_value(train_idx, borrow=True)
+            elif sampler is not None:
+                train_idx[:] = sampler(np_rng)
+                if self.data.shared:
+                    self.epoch_index.set_value(train_idx, borrow=True)
+            elif shuffle:
                 np_rng.shuffle(train_idx)
-            for minibatch_index in range(n_train_batches):
+                if self.data.shared:
+                    self.epoch_index.set_value(train_idx, borrow=True)
+            if not self.data.shared:
+                batches = prefetcher.batches(self.data, 'train',
+                                             train_idx.reshape(n_train_batches, -1)[minibatch_index + 1:])
+            while minibatch_index + 1 < n_train_batches:
+                # the steps of a multi-step call must not skip a validation or an early stopping check
+                first_iter = (epoch - 1) * n_train_batches + minibatch_index + 1
+                n_steps = 1
+                if steps_per_call > 1 and not tbptt and minibatch_index + 1 + steps_per_call <= n_train_batches and \
+                        all((first_iter + i + 1) % validation_frequency != 0 for i in range(steps_per_call - 1)) and \
+                        not (self.early_stop and patience <= first_iter + steps_per_call - 2):
+                    n_steps = steps_per_call
                 # train
-                minibatch_avg_cost = self.train_func(minibatch_index, train_idx)
+                if self.data.shared:
+                    step_func = self.train_func if n_steps == 1 else self.train_steps_func
+                    minibatch_avg_cost = step_func(minibatch_index + 1)
+                elif tbptt:
+                    minibatch_avg_cost = self.train_tbptt(*next(batches), window=tbptt)
+                elif n_steps == 1:
+                    minibatch_avg_cost = self.train_func(*next(batches))
+                else:
+                    steps_x, steps_y = zip(*[next(batches) for _ in range(n_steps)])
+                    minibatch_avg_cost = self.train_steps_func(
+                        *yadll.data.stack_steps(steps_x, steps_y, getattr(self.data, 'mask_value', None)))
+                minibatch_index += n_steps
                 # iteration number
                 iter = (epoch - 1) * n_train_batches + minibatch_index
 
                 if (iter + 1) % validation_frequency == 0:
                     # compute zero-one loss on validation set
-                    validation_losses = [self.validate_func(i) for i
-                                         in range(n_valid_batches)]
-                    this_validation_loss = np.mean(validation_losses)
+                    if evaluation == 'fused':
+                        this_validation_loss, this_test_score = self.evaluate_fused(eval_memory)
+                    else:
+                        this_validation_loss = self.evaluate(self.validate_func, 'valid', n_valid_batches)
 
                     logger.info('epoch %i, minibatch %i/%i, validation error %.3f %%' %
                                 (epoch, minibatch_index + 1, n_train_batches, this_validation_loss * 100.))
                     self.report['validation_values'].append((iter + 1, this_validation_loss * 100.))
 
                     # if we got the best validation score until now
-                    if this_validation_loss < best_validation_loss:
+                    improved = this_validation_loss < best_validation_loss
+                    if improved:
                         # improve patience if loss improvement is good enough
                         if this_validation_loss < best_validation_loss * improvement_threshold:
                             patience = max(patience, iter * patience_increase)
@@ -322,26 +704,46 @@ class Model(object):
                         best_iter = iter
 
                         # test it on the test set
-                        test_losses = [self.test_func(i) for i in range(n_test_batches)]
-                        test_score = np.mean(test_losses)
+                        if evaluation == 'fused':
+                            test_score = this_test_score
+                        else:
+                            test_score = self.evaluate(self.test_func, 'test', n_test_batches)
 
                         logger.info('  epoch %i, minibatch %i/%i, test error of best model %.3f %%' %
                                     (epoch, minibatch_index + 1, n_train_batches, test_score * 100.))
                         self.report['test_values'].append((epoch, test_score * 100))
+                else:
+                    improved = False
 
-                        # save and overwrite each best model
-                        if self.save_mode == 'each':
-                            save_model(self)
-                            logger.info(' Best model saved')
-
-                if patience <= iter:
+                if self.early_stop and patience <= iter:
                     done_looping = True
                     break
 
+                # checkpoint each best model and every checkpoint_frequency minibatches,
+                # the files are written in the background
+                if checkpointer is not None and (improved or (checkpoint_frequency and
+                                                              iter + 1 - last_checkpoint >= checkpoint_frequency)):
+                    checkpointer.save(self, iter + 1, training_progress(), best=improved)
+                    last_checkpoint = iter + 1
+                    logger.info(' Best model checkpointed' if improved else ' Model checkpointed')
+
         end_time = timeit.default_timer()
 
+        if not self.data.shared:
+            self.report['data_stall'] = format_sec(prefetcher.stall_time - stall_time)
+            if prefetcher is not prefetch:
+                prefetcher.close()
+
+        if checkpointer is not None:
+            if checkpointer is checkpoint:
+                checkpointer.wait()
+            else:
+                checkpointer.close()
+            self.report['checkpoint'] = checkpointer.latest()
+            self.report['best_checkpoint'] = checkpointer.best()
+
         # save the final model
-        if self.save_mode == 'end':
+        if self.save_mode in ['end', 'each']:
             save_model(self)
             logger.info(' Final model saved as : ' + self.file)
 
@@ -361,10 +763,238 @@ class Model(object):
 
         return self.report
 
-    def predict(self, X):
+    def train_tbptt(self, x, y, window, reset=True):
+        """
+        Truncated backpropagation through time on a minibatch of sequences
+
+        The states of the stateful layers are reset, as the minibatch starts new
+        sequences, then `train_func` is called on consecutive windows of time
+        steps, each window starting from the final states of the previous one.
+        The gradients do not flow back across the windows.
+
+        Parameters
+        ----------
+        x : numpy array
+            input sequences of shape (batch_size, n_time_steps, ...)
+        y : numpy array
+            targets of each time step, of shape (batch_size, n_time_steps, ...)
+        window : `int`
+            number of time steps of a window
+        reset : `bool`, (default is True)
+            reset the states before the first window. False continues from the states
+            of the previous call, when its minibatch holds the preceding time steps of
+            the same sequences
+
+        Returns
+        -------
+            the mean cost of the windows
+        """
+        if y.ndim < 3 or y.shape[1] != x.shape[1]:
+            raise DataFormatException('Truncated backpropagation through time requires targets for each time step')
+        if reset:
+            self.network.reset_states()
+        costs = [self.train_func(x[:, start: start + window], y[:, start: start + window])
+                 for start in range(0, x.shape[1], window)]
+        return np.mean(costs)
+
+    def n_batches(self, set_x):
+        """
+        Number of complete minibatches in a set
+        """
+        if isinstance(set_x, theano.compile.SharedVariable):
+            return set_x.get_value(borrow=True).shape[0] // self.hp.batch_size
+        return set_x.shape[0] // self.hp.batch_size
+
+    def evaluate(self, func, set_name, n_batches):
+        """
+        Mean of a validation or test function over the minibatches of a set
+
+        Parameters
+        ----------
+        func : compiled theano function
+            `validate_func` or `test_func`
+        set_name : {'valid', 'test'}
+            the set to evaluate
+        n_batches : `int`
+            number of minibatches
+        """
+        if self.data.shared:
+            return np.mean([func(i) for i in range(n_batches)])
+        batch_size = self.hp.batch_size
+        return np.mean([func(*self.data.get_batch(set_name, slice(i * batch_size, (i + 1) * batch_size)))
+                        for i in range(n_batches)])
+
+    def bytes_per_sample(self):
+        """
+        Estimate of the memory used by the activations of one sample during evaluation
+        """
+        def n_values(shape):
+            if isinstance(shape, list):
+                return sum(n_values(s) for s in shape)
+            return int(np.prod([d for d in shape[1:] if d is not None]))
+        # inputs and outputs of the layers are alive at the same time
+        return 2 * np.dtype(floatX).itemsize * sum(n_values(layer.output_shape) for layer in self.network.layers)
+
+    def evaluate_fused(self, memory=2 ** 28):
+        """
+        Validation and test errors over the whole sets with the fused `evaluate_func`.
+        Each call evaluates a chunk of the validation set and a chunk of the test set,
+        chunks are as large as the memory budget allows.
+
+        Parameters
+        ----------
+        memory : `int`, (default is 256 MB)
+            memory budget of the activations of a chunk in bytes
+
+        Returns
+        -------
+            validation error, test error
+        """
+        batch_size = self.hp.batch_size
+        # complete minibatches only, so that the errors are the same as with evaluate
+        n_samples = [self.n_batches(self.data.valid_set_x) * batch_size,
+                     self.n_batches(self.data.test_set_x) * batch_size]
+        if min(n_samples) == 0:
+            raise DlException('The validation and test sets need at least one complete minibatch of %i samples'
+                              % batch_size)
+        n_chunks = int(np.ceil(max(n_samples) * self.bytes_per_sample() / float(memory)))
+        n_chunks = max(1, min(n_chunks, min(n_samples)))
+        bounds = [np.linspace(0, n, n_chunks + 1).astype(int) for n in n_samples]
+        errors = np.zeros(2)
+        for c in range(n_chunks):
+            valid_slice, test_slice = [slice(b[c], b[c + 1]) for b in bounds]
+            if self.data.shared:
+                errors += self.evaluate_func(valid_slice.start, valid_slice.stop, test_slice.start, test_slice.stop)
+            else:
+                errors += self.evaluate_func(*(self.data.get_batch('valid', valid_slice) +
+                                               self.data.get_batch('test', test_slice)))
+        return errors / n_samples
+
+    def predict(self, X, chunk_size=None, memory=None, out=None):
+        """
+        Prediction of the network
+
+        Parameters
+        ----------
+        X : numpy array, memmap or iterable of chunks
+            input of the network. A memmap, a list or an iterator of chunks is predicted
+            by chunks with :meth:`predict_iter`, an array is predicted in one call unless
+            `chunk_size`, `memory` or `out` is given
+        chunk_size : `int`, optional
+            see :meth:`predict_iter`
+        memory : `int`, optional
+            see :meth:`predict_iter`
+        out : array, optional
+            array or memmap of the output shape the predictions are written to,
+            i.e. an `np.lib.format.open_memmap`. Default is to return a new array
+
+        Returns
+        -------
+            the predictions, `out` if it is given
+        """
+        if self.predict_func is None:
+            self.compile(compile_arg='predict')
+        if (chunk_size is None and memory is None and out is None and
+                isinstance(X, np.ndarray) and not isinstance(X, np.memmap)):
+            return self.predict_func(X)
+        predictions = self.predict_iter(X, chunk_size=chunk_size, memory=memory or 2 ** 28)
+        if out is None:
+            return np.concatenate(list(predictions))
+        n_samples = 0
+        for y in predictions:
+            out[n_samples: n_samples + len(y)] = y
+            n_samples += len(y)
+        if n_samples != len(out):
+            raise DlException('Predicted %i samples, out has %i' % (n_samples, len(out)))
+        return out
+
+    def initial_states(self, n_batch=1):
+        """
+        Initial states of the recurrent layers for :meth:`predict_step`
+
+        Parameters
+        ----------
+        n_batch : `int`, (default is 1)
+            number of sequences
+
+        Returns
+        -------
+            list of numpy arrays
+        """
+        if self.initial_states_func is None:
+            n = T.iscalar('n_batch')
+            self.initial_states_func = theano.function([n], self.network.initial_states(n))
+        return self.initial_states_func(n_batch)
+
+    def predict_step(self, x_t, states=None):
+        """
+        Predict one time step of a recurrent network
+
+        The step starts from the states returned by the previous step, so that
+        generating a sequence of N steps costs N steps instead of recomputing the
+        whole sequence for each step.
+
+        Parameters
+        ----------
+        x_t : numpy array
+            input of the step of shape (n_batch, n_dim)
+        states : list of numpy arrays, optional
+            states returned by the previous step, default are the initial states
+
+        Returns
+        -------
+            the output of the network and the new states
+
+        Examples
+        --------
+        >>> y, states = model.predict_step(x[:, 0])
+        >>> for t in range(n_steps):
+        ...     y, states = model.predict_step(one_hot(y.argmax(axis=1)), states)
+        """
+        if self.step_func is None:
+            self.compile(compile_arg='step')
+        x_t = np.asarray(x_t, dtype=floatX)
+        if states is None:
+            states = self.initial_states(len(x_t))
+        outputs = self.step_func(x_t, *states)
+        return outputs[0], outputs[1:]
+
+    def predict_iter(self, X, chunk_size=None, memory=2 ** 28):
+        """
+        Predict an input of any size by chunks, only one chunk and its activations
+        are in memory at a time
+
+        Parameters
+        ----------
+        X : numpy array, memmap or iterator of chunks
+            input of the network. Chunks larger than `chunk_size` are split
+        chunk_size : `int`, optional
+            number of samples of a chunk, default is the memory budget divided
+            by :meth:`bytes_per_sample`
+        memory : `int`, (default is 256 MB)
+            memory budget of the activations of a chunk in bytes
+
+        Returns
+        -------
+            generator of the predictions of the chunks
+
+        Examples
+        --------
+
+        >>> X = np.load('features.npy', mmap_mode='r')
+        >>> for y in model.predict_iter(X, memory=2 ** 26):
+        >>>     write(y)
+
+        """
         if self.predict_func is None:
             self.compile(compile_arg='predict')
-        return self.predict_func(X)
+        if chunk_size is None:
+            chunk_size = max(1, int(memory // self.bytes_per_sample()))
+        chunks = [X] if hasattr(X, 'shape') else X
+        for chunk in chunks:
+            for start in range(0, len(chunk), chunk_size):
+                # slicing a memmap only reads the chunk
+                yield self.predict_func(np.asarray(chunk[start: start + chunk_size], dtype=floatX))
 
     def to_conf(self, file=None):
         """
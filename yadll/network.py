@@ -9,6 +9,15 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class _StepInput(object):
+    # stands for the input layer of a layer during a single time step
+    def __init__(self, output):
+        self.output = output
+
+    def get_output(self, **kwargs):
+        return self.output
+
+
 class Network(object):
     """
     The :class:`Network` class is the container of all the layers of the network.
@@ -26,6 +35,9 @@ class Network(object):
         the list of layers in the network
     params : list of `theano shared variables`
         the list of all the parameters of the network
+    buffers : list of `theano shared variables`
+        the non trainable state of the layers, i.e. the running averages of
+        batch normalization
     reguls : symbolic expression
         regularization cost for the network
     has_unsupervised_layer : `bool`
@@ -36,6 +48,7 @@ class Network(object):
         self.layers = []
         self.layer_names = []
         self.params = []
+        self.buffers = []
         self.reguls = 0
         self.has_unsupervised_layer = False
         self.name = name
@@ -55,6 +68,7 @@ class Network(object):
         self.layers.append(layer)
         self.layer_names.append(layer.name)
         self.params.extend(layer.params)
+        self.buffers.extend(layer.buffers)
         self.reguls += layer.reguls
         if isinstance(layer, UnsupervisedLayer):
             self.has_unsupervised_layer = True
@@ -71,6 +85,79 @@ class Network(object):
         """
         return self.layers[-1].get_output(**kwargs)
 
+    def get_updates(self):
+        """
+        Updates of the buffers of the layers built by the last stochastic
+        :meth:`get_output`, they are added to the updates of the training function
+
+        Returns
+        -------
+            ordered dict of buffer to update expression
+        """
+        updates = OrderedDict()
+        for layer in self.layers:
+            updates.update(layer.get_updates())
+        return updates
+
+    def initial_states(self, n_batch):
+        """
+        Initial states of the recurrent layers
+
+        Parameters
+        ----------
+        n_batch : `int` or symbolic scalar
+            number of sequences
+
+        Returns
+        -------
+            list of the symbolic states of the recurrent layers, in the order of the layers
+        """
+        return [state for layer in self.layers if hasattr(layer, 'step') for state in layer.initial_states(n_batch)]
+
+    def get_step_output(self, x_t, states):
+        """
+        Output of the network for a single time step
+
+        The recurrent layers compute one step from the previous states instead of
+        the whole sequence, and the other layers are applied to the output of
+        the step. Only sequential networks are supported.
+
+        Parameters
+        ----------
+        x_t : symbolic tensor
+            input of the network at the step, without the time axis
+        states : list of symbolic matrices
+            states of the recurrent layers at the previous step, see :meth:`initial_states`
+
+        Returns
+        -------
+            the output of the network and the list of the new states
+        """
+        states = list(states)
+        new_states = []
+        output = x_t
+        for layer in self.layers[1:]:
+            if hasattr(layer, 'step'):
+                n_states = len(layer.initial_states(1))
+                output, layer_states = layer.step(output, states[:n_states])
+                del states[:n_states]
+                new_states.extend(layer_states)
+            else:
+                input_layer = layer.input_layer
+                layer.input_layer = _StepInput(output)
+                try:
+                    output = layer.get_output(stochastic=False)
+                finally:
+                    layer.input_layer = input_layer
+        return output, new_states
+
+    def reset_states(self):
+        """
+        Forget the states carried between minibatches by the stateful layers
+        """
+        for layer in self.layers:
+            layer.reset_states()
+
     def get_layer(self, layer_name):
         """
         Get a layer of the network from its name
@@ -93,7 +180,7 @@ class Network(object):
 
     def save_params(self, file):
         """
-        Save the parameters of the network to file with cPickle
+        Save the parameters and the buffers of the network to file with cPickle
 
         Parameters
         ----------
@@ -113,7 +200,7 @@ class Network(object):
 
         with open(file, 'wb') as f:
             pickle.dump(self.name, f, pickle.HIGHEST_PROTOCOL)
-            for param in self.params:
+            for param in self.params + self.buffers:
                 pickle.dump(param.get_value(borrow=True), f,
                              pickle.HIGHEST_PROTOCOL)
 
@@ -143,6 +230,11 @@ class Network(object):
 
             for param in self.params:
                 param.set_value(pickle.load(f), borrow=True)
+            try:
+                for buffer in self.buffers:
+                    buffer.set_value(pickle.load(f), borrow=True)
+            except EOFError:
+                logger.warning('No buffers saved in %s, they keep their values' % file)
 
     def to_conf(self):
         return {'name': self.name,
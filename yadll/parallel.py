@@ -0,0 +1,486 @@
+# -*- coding: UTF-8 -*-
+"""
+Parallel training on the local cpus.
+
+Workers are forked from the process holding the compiled model, so they
+inherit the compiled functions, the parameters and the data without copying
+or recompiling them. Fork is only available on unix.
+"""
+import os
+import time
+import ctypes
+import timeit
+import logging
+import threading
+import multiprocessing
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+import theano
+import theano.tensor as T
+
+import yadll
+from .utils import *
+from .exceptions import *
+
+logger = logging.getLogger(__name__)
+
+_CTYPES = {'float32': ctypes.c_float, 'float64': ctypes.c_double}
+
+
+def shared_array(shape, dtype=floatX):
+    """
+    Numpy array in shared memory. Processes forked after its creation
+    read and write the same memory.
+
+    Parameters
+    ----------
+    shape : `int` or `tuple` of `int`
+        shape of the array
+    dtype : {'float32', 'float64'}, default is floatX
+        type of the array
+
+    Returns
+    -------
+        numpy array backed by a `multiprocessing.RawArray`
+    """
+    shape = (shape, ) if isinstance(shape, int) else tuple(shape)
+    raw = multiprocessing.RawArray(_CTYPES[np.dtype(dtype).name], int(np.prod(shape)))
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _shard(batch_size, n_workers, rank):
+    # rows of a minibatch processed by a worker
+    bounds = np.linspace(0, batch_size, n_workers + 1).astype(int)
+    return bounds[rank], bounds[rank + 1]
+
+
+def _compile_gradients(model):
+    # cost and gradients of the rows [start, stop) of a minibatch, the
+    # running averages of the network are updated on the rows
+    cost = model.get_cost()
+    grads = T.grad(cost, model.network.params)
+    updates = model.network.get_updates()
+    if model.data.shared:
+        start, stop = T.iscalar('start'), T.iscalar('stop')
+        offset = model.index * model.hp.batch_size
+        batch = model.epoch_index[offset + start: offset + stop]
+        return theano.function([model.index, start, stop], [cost] + grads, updates=updates, name='gradients',
+                               givens={model.x: model.data.train_set_x[batch],
+                                       model.y: model.data.train_set_y[batch]})
+    return theano.function([model.x, model.y], [cost] + grads, updates=updates, name='gradients')
+
+
+def _compile_apply(model):
+    # update rule applied to given gradients
+    params = model.network.params
+    grads = [param.type() for param in params]
+    updates = model.updates(grads, params, **model.update_parameters())
+    return theano.function(grads, [], updates=updates, name='apply_gradients')
+
+
+def _compile_hogwild_step(model):
+    # cost of a minibatch and the changes of the parameters and running averages
+    # given by the update rule of the model. The changes are added in place to
+    # the shared memory, the state of the update rule is updated in the worker
+    cost = model.get_cost()
+    params = model.network.params
+    updates = model.updates(cost, params, **model.update_parameters())
+    updates.update(model.network.get_updates())
+    deltas = [updates.pop(variable, variable) - variable for variable in params + model.network.buffers]
+    if model.data.shared:
+        batch = model.epoch_index[model.index * model.hp.batch_size: (model.index + 1) * model.hp.batch_size]
+        return theano.function([model.index], [cost] + deltas, updates=updates, name='hogwild_step',
+                               givens={model.x: model.data.train_set_x[batch],
+                                       model.y: model.data.train_set_y[batch]})
+    return theano.function([model.x, model.y], [cost] + deltas, updates=updates, name='hogwild_step')
+
+
+def _state_variables(func):
+    # shared variables updated by a function: parameters, optimizer state and running averages
+    return [i.variable for i in func.maker.inputs if i.update is not None]
+
+
+class AllReduceStep(object):
+    """
+    Training step of a data-parallel worker, it replaces `train_func`.
+
+    The worker computes the gradients of its shard of the minibatch and writes
+    them in shared memory. The gradients are averaged by all the workers, each
+    one reducing a slice of them, then every worker applies the same update rule
+    to the averaged gradients so that the replicas of the network stay identical.
+
+    Parameters
+    ----------
+    model : :class:`yadll.model.Model`
+        the replica of the worker
+    rank : `int`
+        index of the worker
+    n_workers : `int`
+        number of workers
+    grad_func : compiled theano function
+        cost and gradients of a shard
+    apply_func : compiled theano function
+        update rule applied to the averaged gradients
+    grads : numpy array in shared memory
+        gradients of each worker, shape (n_workers, n_values)
+    result : numpy array in shared memory
+        averaged gradients, shape (n_values, )
+    barrier : `multiprocessing.Barrier`
+        synchronisation of the workers
+    """
+    def __init__(self, model, rank, n_workers, grad_func, apply_func, grads, result, barrier):
+        self.model = model
+        self.rank = rank
+        self.n_workers = n_workers
+        self.grad_func = grad_func
+        self.apply_func = apply_func
+        self.grads = grads
+        self.result = result
+        self.barrier = barrier
+        self.shapes = [param.get_value(borrow=True).shape for param in model.network.params]
+        self.offsets = np.cumsum([0] + [int(np.prod(shape)) for shape in self.shapes])
+        self.start, self.stop = _shard(model.hp.batch_size, n_workers, rank)
+        self.chunk = _shard(result.shape[0], n_workers, rank)
+
+    def __call__(self, *batch):
+        batch_size = self.model.hp.batch_size
+        if self.model.data.shared:
+            outputs = self.grad_func(batch[0], self.start, self.stop)
+        else:
+            outputs = self.grad_func(*[b[self.start: self.stop] for b in batch])
+        # the cost is a mean over the shard, gradients are weighted by the shard size
+        weight = (self.stop - self.start) / float(batch_size)
+        for i, grad in enumerate(outputs[1:]):
+            self.grads[self.rank, self.offsets[i]: self.offsets[i + 1]] = grad.ravel() * weight
+        self.barrier.wait()
+        # reduce-scatter: each worker sums a slice of the gradients of all workers
+        start, stop = self.chunk
+        self.result[start: stop] = self.grads[:, start: stop].sum(axis=0)
+        self.barrier.wait()
+        self.apply_func(*[self.result[self.offsets[i]: self.offsets[i + 1]].reshape(shape)
+                          for i, shape in enumerate(self.shapes)])
+        return outputs[0]
+
+
+class BroadcastEvaluation(object):
+    """
+    Evaluation of a data-parallel worker, it replaces `Model.evaluate` or
+    `Model.evaluate_fused`.
+
+    Only the worker of rank 0 evaluates the validation and test sets. It writes
+    the errors in shared memory and the other workers read them, so that all the
+    workers take the same early stopping decisions.
+
+    Parameters
+    ----------
+    evaluate : function
+        the evaluation of the replica
+    rank : `int`
+        index of the worker
+    values : numpy array in shared memory
+        the errors returned by `evaluate`, one value or two for the fused evaluation
+    barrier : `multiprocessing.Barrier`
+        synchronisation of the workers
+    """
+    def __init__(self, evaluate, rank, values, barrier):
+        self.evaluate = evaluate
+        self.rank = rank
+        self.values = values
+        self.barrier = barrier
+
+    def __call__(self, *args, **kwargs):
+        if self.rank == 0:
+            self.values[:] = self.evaluate(*args, **kwargs)
+        self.barrier.wait()
+        values = self.values.copy()
+        # rank 0 does not write the next errors before they are all read
+        self.barrier.wait()
+        return values[0] if len(values) == 1 else values
+
+
+def _average_buffers(model, rank, buffer_values, barrier):
+    # each replica updated the running averages on its own shards
+    buffers = model.network.buffers
+    offsets = np.cumsum([0] + [buffer.get_value(borrow=True).size for buffer in buffers])
+    buffer_values[rank] = np.concatenate([buffer.get_value().ravel() for buffer in buffers])
+    barrier.wait()
+    mean = buffer_values.mean(axis=0)
+    for i, buffer in enumerate(buffers):
+        value = buffer.get_value(borrow=True)
+        buffer.set_value(mean[offsets[i]: offsets[i + 1]].reshape(value.shape).astype(value.dtype))
+
+
+def _data_parallel_worker(model, rank, step, state, seed, queue, evaluation, buffer_values, kwargs):
+    try:
+        # replicas share the shuffling but not the random masks
+        T_rng.seed(seed + rank)
+        if rank > 0:
+            for name in ['yadll.model', 'yadll.data', 'yadll.utils']:
+                logging.getLogger(name).disabled = True
+        model.train_func = step
+        model.evaluate = BroadcastEvaluation(model.evaluate, rank, evaluation[:1], step.barrier)
+        model.evaluate_fused = BroadcastEvaluation(model.evaluate_fused, rank, evaluation, step.barrier)
+        report = model.train(**kwargs)
+        if model.network.buffers:
+            _average_buffers(model, rank, buffer_values, step.barrier)
+        if rank == 0:
+            queue.put((dict(report), [variable.get_value() for variable in state]))
+    except threading.BrokenBarrierError:
+        # another worker failed
+        os._exit(1)
+    except BaseException:
+        step.barrier.abort()
+        raise
+
+
+def train_data_parallel(model, n_workers=None, **kwargs):
+    """
+    Synchronous data-parallel training on local processes.
+
+    Each minibatch is split between `n_workers` forked processes holding a
+    replica of the network. Their gradients are averaged through shared memory
+    and the update rule of the model is applied on every replica. The training
+    loop, validation and early stopping are the ones of :meth:`yadll.model.Model.train`.
+    The validation and test sets are only evaluated by the first worker, see
+    :class:`BroadcastEvaluation`, and the running averages of the network are
+    averaged over the replicas at the end of the training.
+
+    Parameters
+    ----------
+    model : :class:`yadll.model.Model`
+        the model to train
+    n_workers : `int`, optional
+        number of processes, default is the number of cpus
+    kwargs :
+        arguments passed to :meth:`yadll.model.Model.train`
+
+    Returns
+    -------
+        report of the training. The parameters of `model` are the trained ones.
+
+    Notes
+    -----
+    The optimizer state of the data-parallel update rule is not the one of
+    `model.train_func`. The model is saved, if requested, at the end of the training.
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if model.data is None:
+        raise NoDataFoundException
+    compile_arg = ['train', 'test']
+    if model.data.valid_set_x is not None:
+        compile_arg.append('validate')
+    compile_arg = [name for name in compile_arg if getattr(model, name + '_func') is None]
+    if compile_arg:
+        model.compile(compile_arg)
+    if model.hp.batch_size < n_workers:
+        raise DlException('batch size %i is smaller than the number of workers %i'
+                          % (model.hp.batch_size, n_workers))
+    grad_func = _compile_gradients(model)
+    apply_func = _compile_apply(model)
+    state = _state_variables(apply_func) + _state_variables(grad_func)
+
+    n_values = sum(param.get_value(borrow=True).size for param in model.network.params)
+    grads = shared_array((n_workers, n_values))
+    result = shared_array(n_values)
+    evaluation = shared_array(2, dtype='float64')
+    buffer_values = None
+    if model.network.buffers:
+        n_buffer_values = sum(buffer.get_value(borrow=True).size for buffer in model.network.buffers)
+        buffer_values = shared_array((n_workers, n_buffer_values), dtype='float64')
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(n_workers)
+    queue = context.Queue()
+    save_mode, file = kwargs.pop('save_mode', None), model.file
+    kwargs['steps_per_call'] = 1
+    model.file = None
+    # np_rng is left untouched so that the shuffling is the one of Model.train
+    seed = int(T_rng.rstate[0])
+
+    train_func = model.train_func
+    workers = []
+    for rank in range(n_workers):
+        step = AllReduceStep(model, rank, n_workers, grad_func, apply_func, grads, result, barrier)
+        workers.append(context.Process(target=_data_parallel_worker,
+                                       args=(model, rank, step, state, seed, queue, evaluation, buffer_values,
+                                             kwargs)))
+    try:
+        for worker in workers:
+            worker.start()
+        while True:
+            try:
+                report, values = queue.get(timeout=1)
+                break
+            except Empty:
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    raise DlException('A data-parallel worker failed')
+        for worker in workers:
+            worker.join()
+    except BaseException:
+        barrier.abort()
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        raise
+    finally:
+        model.file = file
+        model.train_func = train_func
+
+    # rank 0 replica, with the averaged running averages, is the trained model
+    for variable, value in zip(state, values):
+        variable.set_value(value)
+    model.report = report
+    model.report['n_workers'] = n_workers
+    if save_mode is not None or model.file is not None:
+        if model.file is None:
+            import datetime
+            model.file = model.name + '_' + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + '.ym'
+        yadll.model.save_model(model)
+    return model.report
+
+
+def _hogwild_worker(model, rank, n_workers, step_func, values, n_samples, seed):
+    # lock-free steps on the parameters in shared memory
+    np_rng.seed(seed + rank)
+    T_rng.seed(seed + rank)
+    batch_size = model.hp.batch_size
+    n_rows = model.n_batches(model.data.train_set_x) * batch_size
+    bounds = np.linspace(0, n_rows, n_workers + 1).astype(int)
+    shard = np.arange(bounds[rank], bounds[rank + 1], dtype=intX)
+    n_shard_batches = len(shard) // batch_size
+    for epoch in range(model.hp.n_epochs):
+        np_rng.shuffle(shard)
+        if model.data.shared:
+            model.epoch_index.set_value(shard[:n_shard_batches * batch_size], borrow=True)
+        for index in range(n_shard_batches):
+            if model.data.shared:
+                outputs = step_func(index)
+            else:
+                outputs = step_func(*model.data.get_batch('train', shard[index * batch_size:
+                                                                          (index + 1) * batch_size]))
+            for value, delta in zip(values, outputs[1:]):
+                value += delta
+            n_samples[rank] += batch_size
+
+
+def train_hogwild(model, n_workers=None, eval_frequency=1.):
+    """
+    Hogwild! asynchronous sgd on local processes.
+
+    The parameters of the network are moved to shared memory. Each of the
+    `n_workers` forked processes trains on its own shard of the training set
+    for `hp.n_epochs` epochs, and adds the steps of the update rule of the model
+    to the shared parameters without any lock. Meanwhile the parent process measures the validation error
+    every `eval_frequency` seconds.
+
+    Parameters
+    ----------
+    model : :class:`yadll.model.Model`
+        the model to train
+    n_workers : `int`, optional
+        number of processes, default is the number of cpus
+    eval_frequency : `float`, (default is 1 second)
+        time between two evaluations of the validation error
+
+    Returns
+    -------
+        report of the training with the throughput in samples per second and the
+        validation errors in percent along the training time in seconds.
+        The parameters of `model` are the trained ones.
+
+    Notes
+    -----
+    The state of the update rule, i.e. the velocities of momentum, is local to
+    each worker. The changes of the running averages of batch normalization are
+    added to the shared ones like the steps of the parameters.
+    There is no early stopping.
+
+    References
+    ----------
+    .. [1] Recht, B., Re, C., Wright, S., Niu, F. (2011):
+           Hogwild!: A lock-free approach to parallelizing stochastic gradient descent.
+           NIPS 2011.
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if model.data is None:
+        raise NoDataFoundException
+    compile_arg = ['train', 'test']
+    if model.data.valid_set_x is not None:
+        compile_arg.append('validate')
+    compile_arg = [name for name in compile_arg if getattr(model, name + '_func') is None]
+    if compile_arg:
+        model.compile(compile_arg)
+    n_train_batches = model.n_batches(model.data.train_set_x)
+    if n_train_batches < n_workers:
+        raise DlException('%i minibatches cannot be split between %i workers' % (n_train_batches, n_workers))
+    step_func = _compile_hogwild_step(model)
+
+    # the parameters are read and written in place by all the processes
+    params = model.network.params + model.network.buffers
+    values = []
+    for param in params:
+        value = shared_array(param.get_value(borrow=True).shape, param.dtype)
+        value[...] = param.get_value(borrow=True)
+        param.set_value(value, borrow=True)
+        values.append(value)
+    n_samples = shared_array(n_workers, 'float64')
+    seed = int(T_rng.rstate[0])
+
+    if model.data.valid_set_x is not None:
+        def validation_error():
+            return model.evaluate(model.validate_func, 'valid', model.n_batches(model.data.valid_set_x)) * 100.
+    else:
+        def validation_error():
+            return np.nan
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_hogwild_worker,
+                               args=(model, rank, n_workers, step_func, values, n_samples, seed))
+               for rank in range(n_workers)]
+    validation_values = [(0., validation_error())]
+    logger.info('... Training the model with %i Hogwild workers' % n_workers)
+    start_time = timeit.default_timer()
+    try:
+        for worker in workers:
+            worker.start()
+        next_eval = eval_frequency
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(min(0.05, eval_frequency))
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                raise DlException('A Hogwild worker failed')
+            elapsed = timeit.default_timer() - start_time
+            if elapsed >= next_eval:
+                validation_values.append((elapsed, validation_error()))
+                logger.info('%.1f s, validation error %.3f %%' % validation_values[-1])
+                next_eval = elapsed + eval_frequency
+        duration = timeit.default_timer() - start_time
+        for worker in workers:
+            worker.join()
+        if any(worker.exitcode != 0 for worker in workers):
+            raise DlException('A Hogwild worker failed')
+    except BaseException:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        raise
+    finally:
+        # the parameters leave the shared memory
+        for param, value in zip(params, values):
+            param.set_value(np.array(value), borrow=True)
+
+    validation_values.append((duration, validation_error()))
+    model.report['n_workers'] = n_workers
+    model.report['epoch'] = model.hp.n_epochs
+    model.report['training_duration'] = format_sec(duration)
+    model.report['samples_per_sec'] = n_samples.sum() / duration
+    model.report['validation_values'] = validation_values
+    model.report['best_validation'] = validation_values[-1][1]
+    model.report['test_score'] = model.evaluate(model.test_func, 'test',
+                                                model.n_batches(model.data.test_set_x)) * 100.
+    logger.info('Hogwild training: %.1f samples/s, validation error %.3f %%, test error %.3f %%'
+                % (model.report['samples_per_sec'], model.report['best_validation'], model.report['test_score']))
+    return model.report
@@ -0,0 +1,383 @@
+# -*- coding: UTF-8 -*-
+"""
+Hyperparameters search.
+
+The trials of a search are run on a local pool of processes. Each worker
+builds its model with a user defined `model_builder(hp)` function, trains it
+and sends back the report of :meth:`yadll.model.Model.train`.
+Results are appended to a json lines file as soon as a trial ends, so that
+a search that crashed can be resumed where it stopped.
+
+Successive halving and Hyperband stop the worst trials early. They run in
+the current process so that the surviving trials resume from their state.
+"""
+import os
+import json
+import timeit
+import multiprocessing
+
+import numpy as np
+
+from .hyperparameters import Hyperparameters
+from .exceptions import DlException
+from .utils import format_sec, json_default
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BLAS_THREADS_ENV = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+# hyperparameters read by Model.train that do not change the compiled graph
+TRAINING_HYPERPARAMETERS = ['n_epochs', 'patience']
+
+# model kept by a worker between two trials, see _run_trial
+_worker_state = {'model': None}
+
+
+def load_results(file):
+    """
+    Load the results of a search
+
+    Parameters
+    ----------
+    file : `string`
+        json lines results file
+
+    Returns
+    -------
+        `dict` of trial index to result. Failed trials are not returned.
+    """
+    results = dict()
+    if file is None or not os.path.isfile(file):
+        return results
+    with open(file, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # last line of a crashed search
+                continue
+            if 'error' not in result:
+                results[result['trial']] = result
+    return results
+
+
+def _drop_incomplete_line(file):
+    # a search killed while writing leaves an incomplete last line
+    if file is None or not os.path.isfile(file):
+        return
+    with open(file, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+
+
+def build_hyperparameters(hp_value):
+    """
+    :class:`yadll.hyperparameters.Hyperparameters` holding one trial values
+    """
+    hp = Hyperparameters()
+    for name, value in hp_value.items():
+        hp(name, value)
+    return hp
+
+
+def _reusable(model, hp_value):
+    # a model can be reused if only its shared and training hyperparameters change
+    if model is None:
+        return False
+    hp = model.hp
+    runtime = set(hp.hp_shared) | set(TRAINING_HYPERPARAMETERS)
+    if set(hp.hp_value) != set(hp_value):
+        return False
+    return all(name in runtime or hp.hp_value[name] == value for name, value in hp_value.items())
+
+
+def _run_trial(args):
+    model_builder, trial, hp_value, train_kwargs = args
+    start_time = timeit.default_timer()
+    try:
+        model = _worker_state['model']
+        if _reusable(model, hp_value):
+            for name, value in hp_value.items():
+                setattr(model.hp, name, value)
+            model.hp.hp_value = dict(hp_value)
+            model.reset()
+        else:
+            model = model_builder(build_hyperparameters(hp_value))
+            _worker_state['model'] = model
+        report = dict(model.train(**train_kwargs))
+    except Exception as e:
+        logger.exception('Trial %i failed' % trial)
+        _worker_state['model'] = None
+        return {'trial': trial, 'hyperparameters': hp_value, 'error': repr(e)}
+    return {'trial': trial, 'hyperparameters': hp_value, 'report': report,
+            'duration': timeit.default_timer() - start_time}
+
+
+def _pool(n_workers, blas_threads):
+    # BLAS reads its number of threads when it is loaded by the new process
+    saved_env = dict((name, os.environ.get(name)) for name in BLAS_THREADS_ENV)
+    try:
+        if blas_threads is not None:
+            for name in BLAS_THREADS_ENV:
+                os.environ[name] = str(blas_threads)
+        return multiprocessing.get_context('spawn').Pool(n_workers)
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def run_trials(model_builder, trials, results_file=None, n_workers=None, blas_threads=1, **kwargs):
+    """
+    Train a model for each set of hyperparameters values on a pool of processes
+
+    Parameters
+    ----------
+    model_builder : function
+        `model_builder(hp)` returns a :class:`yadll.model.Model` with `hp` as hyperparameters.
+        It must be picklable, i.e. defined at the top level of a module.
+    trials : iterable of `dict`
+        hyperparameters values of each trial
+    results_file : `string`, optional
+        json lines file where results are written as soon as a trial ends.
+        Trials already in the file are not run again.
+    n_workers : `int`, optional
+        number of processes, default is the number of cpus.
+        0 runs the trials in the current process.
+    blas_threads : `int`, (default is 1)
+        number of BLAS threads of each worker. None keeps the environment value.
+    kwargs :
+        arguments passed to :meth:`yadll.model.Model.train`
+
+    Returns
+    -------
+        `list` of the results of all the trials sorted by trial index
+    """
+    start_time = timeit.default_timer()
+    _drop_incomplete_line(results_file)
+    results = load_results(results_file)
+    if results:
+        logger.info('... Resuming search, %i trials already done' % len(results))
+    done = set(results)
+    # the trials are enumerated as the workers need them, a grid is never held in memory
+    tasks = ((model_builder, trial, dict(hp_value), kwargs)
+             for trial, hp_value in enumerate(trials) if trial not in done)
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if hasattr(trials, '__len__'):
+        n_workers = min(n_workers, len(trials) - len(done))
+    if n_workers > 0:
+        pool = _pool(n_workers, blas_threads)
+        # chunksize 1 keeps the workers busy when trials have different durations
+        trial_results = pool.imap_unordered(_run_trial, tasks, chunksize=1)
+    else:
+        pool = None
+        trial_results = (_run_trial(task) for task in tasks)
+
+    n_trials = 0
+    try:
+        for result in trial_results:
+            n_trials += 1
+            if results_file is not None:
+                with open(results_file, 'a') as f:
+                    f.write(json.dumps(result, default=json_default) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            if 'error' in result:
+                continue
+            results[result['trial']] = json.loads(json.dumps(result, default=json_default))
+            logger.info('Trial %i done in %s, hyperparameters: %s'
+                        % (result['trial'], format_sec(result['duration']), result['hyperparameters']))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    logger.info('Search of %i trials took %s' % (n_trials, format_sec(timeit.default_timer() - start_time)))
+    return [results[trial] for trial in sorted(results)]
+
+
+def grid_search(model_builder, hyperparameters, results_file=None, n_workers=None, blas_threads=1, **kwargs):
+    """
+    Grid search over all the combinations of hyperparameters values,
+    in the order of the :class:`yadll.hyperparameters.Hyperparameters` iterator.
+    See :func:`run_trials` for the parameters.
+
+    Examples
+    --------
+    >>> def build_model(hp):
+    >>>     ...
+    >>>     return model
+    >>> hp = Hyperparameters()
+    >>> hp('learning_rate', 0.1, [0.001, 0.01, 0.1])
+    >>> ...
+    >>> results = grid_search(build_model, hp, 'results.jsonl', n_workers=8)
+    >>> best = min(results, key=lambda r: r['report']['best_validation'])
+
+    """
+    return run_trials(model_builder, hyperparameters.hp_product, results_file, n_workers, blas_threads, **kwargs)
+
+
+def random_search(model_builder, hyperparameters, n_trials, method='random', seed=None, results_file=None,
+                  n_workers=None, blas_threads=1, **kwargs):
+    """
+    Search over a sample of the hyperparameters combinations.
+    See :meth:`yadll.hyperparameters.Hyperparameters.sample` for the sampling
+    methods and :func:`run_trials` for the other parameters.
+    The sample has to be the same to resume a search, use a `seed`
+    with the 'random' and 'lhs' methods.
+
+    Examples
+    --------
+    >>> hp = Hyperparameters()
+    >>> hp('learning_rate', 0.1, list(np.logspace(-4, 0, 100)))
+    >>> hp('l2_reg', 0., list(np.logspace(-6, -2, 100)))
+    >>> ...
+    >>> results = random_search(build_model, hp, 64, method='sobol', results_file='results.jsonl')
+
+    """
+    trials = hyperparameters.sample(n_trials, method, seed)
+    return run_trials(model_builder, trials, results_file, n_workers, blas_threads, **kwargs)
+
+
+def _validation_loss(model):
+    if not model.has_validation:
+        raise DlException('Successive halving ranks the trials on the validation set')
+    return model.evaluate(model.validate_func, 'valid', model.n_batches(model.data.valid_set_x))
+
+
+def successive_halving(model_builder, trials, min_epochs=1, eta=3, n_rounds=None, models=None, **kwargs):
+    """
+    Successive halving: all the trials are trained for a small number of epochs,
+    only the best `1 / eta` are trained `eta` times longer, and so on.
+
+    Trials are not restarted between two rounds, the parameters and the
+    optimizer state of each trial are kept in memory and the survivors resume
+    training from them. Trials that only differ by their shared and training
+    hyperparameters share one compiled model.
+
+    Parameters
+    ----------
+    model_builder : function
+        `model_builder(hp)` returns a :class:`yadll.model.Model` with `hp` as hyperparameters.
+    trials : iterable of `dict`
+        hyperparameters values of each trial
+    min_epochs : `int`, (default is 1)
+        number of epochs of the first round
+    eta : `int`, (default is 3)
+        a trial out of eta is kept after each round
+    n_rounds : `int`, optional
+        number of rounds, default is until one trial is left
+    models : `list`, optional
+        compiled models that can be reused
+    kwargs :
+        arguments passed to :meth:`yadll.model.Model.train`
+
+    Returns
+    -------
+        `list` of the results of the trials sorted by validation loss,
+        with the number of epochs each trial was trained for.
+    """
+    trials = [{'trial': i, 'hyperparameters': dict(hp_value), 'epochs': 0, 'state': None}
+              for i, hp_value in enumerate(trials)]
+    if models is None:
+        models = []
+    if n_rounds is None:
+        n_rounds = int(np.floor(np.log(max(len(trials), 1)) / np.log(eta) + 1e-9)) + 1
+    kwargs['early_stop'] = False
+    alive = trials
+    for rnd in range(n_rounds):
+        epochs = max(int(round(min_epochs * eta ** rnd)), 1)
+        for trial in alive:
+            if trial['epochs'] >= epochs:
+                continue
+            hp_value = trial['hyperparameters']
+            model = next((m for m in models if _reusable(m, hp_value)), None)
+            if model is None:
+                model = model_builder(build_hyperparameters(hp_value))
+                model.compile(['train', 'validate', 'test'])
+                models.append(model)
+            for name, value in hp_value.items():
+                setattr(model.hp, name, value)
+            model.hp.hp_value = dict(hp_value)
+            if trial['state'] is None:
+                model.reset()
+            else:
+                for (variable, _), value in zip(model.initial_state, trial['state']):
+                    variable.set_value(value)
+            # only the missing epochs are trained
+            model.hp.n_epochs = epochs - trial['epochs']
+            model.train(**kwargs)
+            trial['state'] = [variable.get_value() for variable, _ in model.initial_state]
+            trial['epochs'] = epochs
+            trial['validation'] = _validation_loss(model) * 100.
+        alive = sorted(alive, key=lambda t: t['validation'])
+        logger.info('Successive halving round %i: %i trials trained for %i epochs, best validation error %.3f %%'
+                    % (rnd, len(alive), epochs, alive[0]['validation']))
+        # the states of the eliminated trials are released
+        for trial in alive[max(len(alive) // eta, 1):]:
+            trial['state'] = None
+        alive = alive[:max(len(alive) // eta, 1)]
+    for trial in trials:
+        trial['state'] = None
+    return sorted([dict((k, v) for k, v in t.items() if k != 'state') for t in trials],
+                  key=lambda t: t['validation'])
+
+
+def hyperband(model_builder, hyperparameters, max_epochs, eta=3, method='random', seed=None, **kwargs):
+    """
+    Hyperband: successive halving brackets trading the number of sampled trials
+    against the number of epochs of their first round.
+
+    Parameters
+    ----------
+    model_builder : function
+        `model_builder(hp)` returns a :class:`yadll.model.Model` with `hp` as hyperparameters.
+    hyperparameters : :class:`yadll.hyperparameters.Hyperparameters`
+        the hyperparameters space, trials are sampled from it
+    max_epochs : `int`
+        maximum number of epochs of a trial
+    eta : `int`, (default is 3)
+        a trial out of eta is kept after each round
+    method : {'random', 'lhs', 'sobol'}
+        sampling method of the trials, see :meth:`yadll.hyperparameters.Hyperparameters.sample`
+    seed : `int`, optional
+        seed of the sampling
+    kwargs :
+        arguments passed to :meth:`yadll.model.Model.train`
+
+    Returns
+    -------
+        `list` of the results of all the trials sorted by validation loss
+
+    References
+    ----------
+    .. [1] L. Li, K. Jamieson, G. DeSalvo, A. Rostamizadeh and A. Talwalkar, Hyperband: A Novel
+       Bandit-Based Approach to Hyperparameter Optimization, https://arxiv.org/abs/1603.06560
+    """
+    start_time = timeit.default_timer()
+    s_max = int(np.floor(np.log(max_epochs) / np.log(eta) + 1e-9))
+    brackets = list(reversed(range(s_max + 1)))
+    n_trials = [int(np.ceil((s_max + 1) * eta ** s / float(s + 1))) for s in brackets]
+    # one sample for all the brackets so that they explore different points
+    trials = hyperparameters.sample(sum(n_trials), method, seed)
+    models = []
+    results = []
+    for s, n in zip(brackets, n_trials):
+        bracket = successive_halving(model_builder, trials[:n], max_epochs * eta ** -float(s), eta,
+                                     s + 1, models, **kwargs)
+        trials = trials[n:]
+        for result in bracket:
+            result['bracket'] = s
+        results.extend(bracket)
+    n_epochs = sum(r['epochs'] for r in results)
+    logger.info('Hyperband of %i trials trained for %i epochs instead of %i, took %s'
+                % (len(results), n_epochs, len(results) * max_epochs,
+                   format_sec(timeit.default_timer() - start_time)))
+    return sorted(results, key=lambda r: r['validation'])
@@ -0,0 +1,321 @@
+# -*- coding: UTF-8 -*-
+"""
+Micro-batching inference server.
+
+Concurrent requests of a few rows each are coalesced into one batch before
+calling the model, so a single prediction call serves many clients. A batch
+is sent to the model when it holds `max_batch_size` rows or when its first
+request has waited `max_latency` seconds.
+
+The server speaks JSON over HTTP on localhost or on a unix socket:
+
+* `POST /predict` with `{"inputs": [row, ...]}` returns `{"outputs": [row, ...]}`
+* `GET /stats` returns the latency percentiles and the batch size histogram
+"""
+import os
+import json
+import queue
+import timeit
+import threading
+import socketserver
+from collections import deque, Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+from .utils import json_default
+from .exceptions import *
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Request(object):
+    __slots__ = ('x', 'start', 'done', 'result', 'error')
+
+    def __init__(self, x):
+        self.x = x
+        self.start = timeit.default_timer()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchPredictor(object):
+    """
+    Coalesce concurrent predictions into batches
+
+    Parameters
+    ----------
+    model :
+        a :class:`yadll.model.Model` or any object with a `predict` method
+        taking a batch of rows, i.e. a :class:`yadll.inference.Predictor`
+    max_batch_size : `int`, (default is 64)
+        maximum number of rows of a batch. A single larger request is sent alone.
+    max_latency : `float`, (default is 0.005)
+        seconds a request waits for other requests before its batch is sent
+    history : `int`, (default is 10000)
+        number of latencies kept for the percentiles
+
+    Examples
+    --------
+    >>> predictor = BatchPredictor(model, max_batch_size=32, max_latency=0.002)
+    >>> y = predictor.predict(x[None])    # called from many threads
+    >>> predictor.stats()
+
+    """
+    def __init__(self, model, max_batch_size=64, max_latency=0.005, history=10000):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = Counter()
+        self.n_requests = 0
+        # the statistics are updated by the batching thread and read by the server threads
+        self._stats_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='yadll-batch-predictor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, x):
+        """
+        Predict a batch of rows, blocks until the batch holding them is computed
+
+        Parameters
+        ----------
+        x : numpy array
+            rows to predict, a single sample is `x[None]`
+
+        Returns
+        -------
+            the prediction of the rows
+        """
+        if self._closed:
+            raise DlException('BatchPredictor is closed')
+        request = _Request(np.asarray(x))
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self, first):
+        # gather the requests arriving before the deadline of the first one
+        batch = [first]
+        n_rows = len(first.x)
+        deadline = first.start + self.max_latency
+        while n_rows < self.max_batch_size:
+            try:
+                request = self.queue.get(timeout=max(deadline - timeit.default_timer(), 0))
+            except queue.Empty:
+                break
+            if request is None or n_rows + len(request.x) > self.max_batch_size:
+                return batch, request
+            batch.append(request)
+            n_rows += len(request.x)
+        return batch, False
+
+    def _run(self):
+        carry = False
+        while True:
+            request = self.queue.get() if carry is False else carry
+            if request is None:
+                break
+            batch, carry = self._next_batch(request)
+            self._compute(batch)
+
+    def _compute(self, batch):
+        try:
+            y = self.model.predict(np.concatenate([request.x for request in batch]))
+            offsets = np.cumsum([len(request.x) for request in batch])[:-1]
+            for request, result in zip(batch, np.split(y, offsets)):
+                request.result = result
+        except Exception as e:
+            logger.warning('Prediction of a batch of %i requests failed: %s' % (len(batch), e))
+            for request in batch:
+                request.error = e
+        end = timeit.default_timer()
+        with self._stats_lock:
+            self.batch_sizes[sum(len(request.x) for request in batch)] += 1
+            self.n_requests += len(batch)
+            self.latencies.extend(end - request.start for request in batch)
+        for request in batch:
+            request.done.set()
+
+    def stats(self):
+        """
+        Statistics of the served requests
+
+        Returns
+        -------
+            `dict` of the number of requests and batches, the 50th, 90th and 99th
+            percentiles of the latency in seconds over the last `history`
+            requests, the mean batch size and the histogram of the batch sizes
+        """
+        with self._stats_lock:
+            latencies = np.asarray(self.latencies)
+            batch_sizes = dict(self.batch_sizes)
+            n_requests = self.n_requests
+        n_batches = sum(batch_sizes.values())
+        stats = {'requests': n_requests,
+                 'batches': n_batches,
+                 'mean_batch_size': sum(k * v for k, v in batch_sizes.items()) / float(max(n_batches, 1)),
+                 'batch_sizes': dict(sorted(batch_sizes.items()))}
+        for p in [50, 90, 99]:
+            stats['latency_p%i' % p] = float(np.percentile(latencies, p)) if len(latencies) else None
+        return stats
+
+    def close(self):
+        """
+        Compute the pending requests and stop the batching thread
+        """
+        if not self._closed:
+            self._closed = True
+            self.queue.put(None)
+            self._thread.join()
+            # requests that raced with close
+            while not self.queue.empty():
+                request = self.queue.get()
+                if request is not None:
+                    request.error = DlException('BatchPredictor is closed')
+                    request.done.set()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, code, obj):
+        body = json.dumps(obj, default=json_default).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.predictor.stats())
+        else:
+            self._send(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'unknown path %s' % self.path})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+            x = np.asarray(body['inputs'], dtype=self.server.dtype)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': 'invalid request: %s' % e})
+            return
+        try:
+            y = self.server.predictor.predict(x)
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+            return
+        self._send(200, {'outputs': y.tolist()})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer only exists from python 3.7
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class InferenceServer(object):
+    """
+    Serve the predictions of a model over HTTP with micro-batching
+
+    Parameters
+    ----------
+    model :
+        a :class:`yadll.model.Model` or any object with a `predict` method
+    address : `tuple` or `string`, (default is ('127.0.0.1', 0))
+        (host, port) to listen on localhost, port 0 picks a free port,
+        or the path of a unix socket
+    dtype : `string`, optional
+        type of the inputs, default is `floatX`
+    **kwargs :
+        arguments of :class:`BatchPredictor`
+
+    Examples
+    --------
+    >>> server = InferenceServer(load_model('my_model.ym'), ('127.0.0.1', 8000), max_latency=0.002)
+    >>> server.start()
+    >>> # curl -d '{"inputs": [[0.1, 0.2]]}' http://127.0.0.1:8000/predict
+    >>> server.close()
+
+    """
+    def __init__(self, model, address=('127.0.0.1', 0), dtype=None, **kwargs):
+        self.predictor = BatchPredictor(model, **kwargs)
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = _UnixHTTPServer(address, _Handler)
+        else:
+            self.server = _ThreadingHTTPServer(tuple(address), _Handler)
+        if dtype is None:
+            from .utils import floatX as dtype
+        self.server.dtype = dtype
+        self.server.predictor = self.predictor
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        (host, port) or path of the unix socket the server listens on
+        """
+        return self.server.server_address
+
+    def start(self):
+        """
+        Serve from a background thread
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name='yadll-inference-server')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info('Serving on %s' % (self.address, ))
+        return self
+
+    def serve_forever(self):
+        """
+        Serve from the calling thread until interrupted
+        """
+        logger.info('Serving on %s' % (self.address, ))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def stats(self):
+        return self.predictor.stats()
+
+    def close(self):
+        """
+        Stop the server and the batching thread
+        """
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self.predictor.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
@@ -4,11 +4,14 @@ Updates functions
 
 Arguments
 ---------
-cost : cost function
-    The cost function that will be minimised during training
+cost : cost function or list of gradients
+    The cost function that will be minimised during training, or the
+    gradients of the cost with respect to each parameter
 params : list of parameters
     The list of all the weights of the network that will be modified
 
+The state of an update rule, i.e. the velocities of momentum or the moments
+of adam, is created with :func:`state_variable` so that it can be checkpointed.
 """
 
 from collections import OrderedDict
@@ -18,12 +21,55 @@ import theano.tensor as T
 from .utils import *
 
 
+def get_or_compute_grads(cost, params):
+    """
+    Gradients of the cost with respect to the parameters.
+    If `cost` is already a list of gradients, i.e. averaged over several
+    replicas of the network, it is returned as is.
+    """
+    if isinstance(cost, (list, tuple)):
+        if len(cost) != len(params):
+            raise ValueError('Got %i gradients for %i parameters' % (len(cost), len(params)))
+        return list(cost)
+    return T.grad(cost, params)
+
+
+def state_variable(slot, params=None, index=None):
+    """
+    Shared variable of the state of an update rule, initialized to zeros.
+    It is tagged with its slot and the index of its parameter so that
+    :meth:`yadll.model.Model.state_variables` can name it.
+
+    Parameters
+    ----------
+    slot : `string`
+        name of the state in the update rule, i.e. 'velocity'
+    params : list of parameters, optional
+        the parameters given to the update rule
+    index : `int`, optional
+        index of the parameter the state belongs to. The state is a scalar
+        shared by all the parameters if it is omitted
+
+    Returns
+    -------
+        Theano Shared Variable
+    """
+    if index is None:
+        variable = shared_variable(to_float_X(0.), name=slot)
+    else:
+        param = params[index]
+        variable = shared_variable(np.zeros(param.get_value(borrow=True).shape), name=slot,
+                                   broadcastable=param.broadcastable)
+    variable.tag.optimizer_state = (slot, index)
+    return variable
+
+
 def sgd(cost, params, learning_rate=0.1, **kwargs):
     """Stochastic Gradient Descent (SGD) updates
 
     `param := param - learning_rate * gradient`
     """
-    gparams = T.grad(cost, params)
+    gparams = get_or_compute_grads(cost, params)
     updates = OrderedDict()
     for param, gparam in zip(params, gparams):
         updates[param] = param - learning_rate * gparam
@@ -38,8 +84,8 @@ def momentum(cost, params, learning_rate=0.1, momentum=0.9, **kwargs):
     `param := param + velocity`
     """
     updates = sgd(cost, params, learning_rate)
-    for param in params:
-        velocity = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
+    for i, param in enumerate(params):
+        velocity = state_variable('velocity', params, i)
         p = momentum * velocity + updates[param]
         updates[velocity] = p - param
         updates[param] = p
@@ -58,8 +104,8 @@ def nesterov_momentum(cost, params, learning_rate=0.1, momentum=0.9, **kwargs):
     .. [1] https://github.com/lisa-lab/pylearn2/pull/136#issuecomment-10381617
     """
     updates = sgd(cost, params, learning_rate)
-    for param in params:
-        velocity = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
+    for i, param in enumerate(params):
+        velocity = state_variable('velocity', params, i)
         p = momentum * velocity + updates[param] - param
         updates[velocity] = p
         updates[param] += momentum * p
@@ -75,10 +121,10 @@ def adagrad(cost, params, learning_rate=0.1, epsilon=1e-6, **kwargs):
     ----------
     .. [1] http://www.jmlr.org/papers/volume12/duchi11a/duchi11a.pdf
     """
-    gparams = T.grad(cost, params)
+    gparams = get_or_compute_grads(cost, params)
     updates = OrderedDict()
-    for param, gparam in zip(params, gparams):
-        accu = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
+    for i, (param, gparam) in enumerate(zip(params, gparams)):
+        accu = state_variable('accu', params, i)
         accu_new = accu + gparam ** 2
         updates[accu] = accu_new
         updates[param] = param - learning_rate * gparam / T.sqrt(accu_new + epsilon)
@@ -90,10 +136,10 @@ def rmsprop(cost, params, learning_rate=0.01, rho=0.9, epsilon=1e-6, **kwargs):
     Scale learning rates by dividing with the moving average of the root mean
     squared (RMS) gradients
     """
-    gparams = T.grad(cost, params)
+    gparams = get_or_compute_grads(cost, params)
     updates = OrderedDict()
-    for param, gparam in zip(params, gparams):
-        accu = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
+    for i, (param, gparam) in enumerate(zip(params, gparams)):
+        accu = state_variable('accu', params, i)
         accu_new = rho * accu + (1. - rho) * gparam ** 2
         updates[accu] = accu_new
         updates[param] = param - learning_rate * gparam / T.sqrt(accu_new + epsilon)
@@ -109,12 +155,12 @@ def adadelta(cost, params, learning_rate=0.1, rho=0.95, epsilon=1e-6, **kwargs):
     ----------
     .. [1] https://arxiv.org/pdf/1212.5701v1.pdf
     """
-    gparams = T.grad(cost, params)
+    gparams = get_or_compute_grads(cost, params)
     updates = OrderedDict()
 
-    for param, gparam in zip(params, gparams):
-        accu = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
-        delta_accu = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
+    for i, (param, gparam) in enumerate(zip(params, gparams)):
+        accu = state_variable('accu', params, i)
+        delta_accu = state_variable('delta_accu', params, i)
 
         # update accu (as in rmsprop)
         accu_new = rho * accu + (1. - rho) * gparam ** 2
@@ -140,14 +186,14 @@ def adam(cost, params, learning_rate=0.001, beta1=0.9, beta2=0.999, epsilon=1e-6
     ----------
     .. [1] https://arxiv.org/pdf/1412.6980v8.pdf
     """
-    gparams = T.grad(cost, params)
+    gparams = get_or_compute_grads(cost, params)
     updates = OrderedDict()
-    t = shared_variable(to_float_X(0.))
+    t = state_variable('t')
     t_t = 1. + t
     l_r_t = learning_rate * T.sqrt(1. - beta2 ** t_t) / (1. - beta1 ** t_t)
-    for param, gparam in zip(params, gparams):
-        m = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
-        v = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
+    for i, (param, gparam) in enumerate(zip(params, gparams)):
+        m = state_variable('m', params, i)
+        v = state_variable('v', params, i)
         m_t = beta1 * m + (1. - beta1) * gparam
         v_t = beta2 * v + (1. - beta2) * T.sqr(gparam)
         updates[m] = m_t
@@ -165,14 +211,14 @@ def adamax(cost, params, learning_rate=0.001, beta1=0.9, beta2=0.999, epsilon=1e
     ----------
     .. [1] https://arxiv.org/pdf/1412.6980v8.pdf
     """
-    gparams = T.grad(cost, params)
+    gparams = get_or_compute_grads(cost, params)
     updates = OrderedDict()
-    t = shared_variable(to_float_X(0.))
+    t = state_variable('t')
     t_t = 1. + t
     l_r_t = learning_rate / (1. - beta1 ** t_t)
-    for param, gparam in zip(params, gparams):
-        m = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
-        u = shared_variable(np.zeros(param.get_value(borrow=True).shape), broadcastable=param.broadcastable)
+    for i, (param, gparam) in enumerate(zip(params, gparams)):
+        m = state_variable('m', params, i)
+        u = state_variable('u', params, i)
         m_t = beta1 * m + (1. - beta1) * gparam
         u_t = T.maximum(beta2 * u, abs(gparam))
         updates[m] = m_t
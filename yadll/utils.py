@@ -1,23 +1,67 @@
 # -*- coding: UTF-8 -*-
+"""
+Helpers shared by the yadll modules.
+
+`theano`, `floatX` and the theano random streams `T_rng` are resolved on first
+access, so importing this module does not import theano.
+"""
+import sys
+import types
 import timeit
 from functools import wraps
 
 import numpy as np
 
-import theano
-from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
-
 import logging
 
 logger = logging.getLogger(__name__)
 
-floatX = theano.config.floatX
+__all__ = ['timeit', 'wraps', 'np', 'logging', 'logger', 'theano', 'RandomStreams',
+           'floatX', 'intX', 'EPSILON', 'np_rng', 'T_rng',
+           'to_float_X', 'shared_variable', 'format_sec', 'json_default', 'timer']
+
 intX = 'int32'
 
 EPSILON = 1e-8
 
 np_rng = np.random.RandomState(1234)
-T_rng = RandomStreams(np_rng.randint(2 ** 30))
+# drawn now so that np_rng is in the same state whether T_rng is used or not
+_T_rng_seed = np_rng.randint(2 ** 30)
+
+
+def _import_theano():
+    import theano
+    return theano
+
+
+def _random_streams():
+    from theano.sandbox.rng_mrg import MRG_RandomStreams
+    return MRG_RandomStreams
+
+# theano is imported on first access of one of these globals, so that the
+# modules which do not build graphs (data, hyperparameters) load without it
+_LAZY = {'theano': _import_theano,
+         'floatX': lambda: _lazy('theano').config.floatX,
+         'RandomStreams': _random_streams,
+         'T_rng': lambda: _lazy('RandomStreams')(_T_rng_seed)}
+
+
+def _lazy(name):
+    if name not in globals():
+        globals()[name] = _LAZY[name]()
+    return globals()[name]
+
+
+class _LazyModule(types.ModuleType):
+    # a module type with __getattr__ rather than a module level __getattr__ (PEP 562),
+    # which is only supported from python 3.7
+    def __getattr__(self, name):
+        if name not in _LAZY:
+            raise AttributeError('module %r has no attribute %r' % (__name__, name))
+        return _lazy(name)
+
+
+sys.modules[__name__].__class__ = _LazyModule
 
 
 def to_float_X(arr):
@@ -32,10 +76,10 @@ def to_float_X(arr):
     -------
         numpy array of floatX
     """
-    return np.asarray(arr, dtype=floatX)
+    return np.asarray(arr, dtype=_lazy('floatX'))
 
 
-def shared_variable(value, dtype=floatX, name=None, borrow=True, **kwargs):
+def shared_variable(value, dtype=None, name=None, borrow=True, **kwargs):
     """
     Create a Theano Shared Variable
 
@@ -57,8 +101,8 @@ def shared_variable(value, dtype=floatX, name=None, borrow=True, **kwargs):
     """
     if value is None:
         return None
-    value = np.asarray(value, dtype=dtype)
-    return theano.shared(value=value, name=name, borrow=borrow, **kwargs)
+    value = np.asarray(value, dtype=dtype or _lazy('floatX'))
+    return _lazy('theano').shared(value=value, name=name, borrow=borrow, **kwargs)
 
 
 def format_sec(sec):
@@ -87,6 +131,33 @@ def format_sec(sec):
     return '%.3f s' % s
 
 
+def json_default(obj):
+    """
+    Fallback of `json.dumps` for the objects used in yadll confs and reports
+
+    Parameters
+    ----------
+    obj :
+        object that json can not serialize
+
+    Returns
+    -------
+        functions are represented by their module and name, numpy values by
+        their python value and shared variables by their type
+    """
+    if callable(obj) and hasattr(obj, '__name__'):
+        return getattr(obj, '__module__', '') + '.' + obj.__name__
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    # a shared variable can only exist once theano is imported
+    if 'theano' in sys.modules and isinstance(obj, sys.modules['theano'].compile.SharedVariable):
+        # the value of a shared variable can change without recompiling
+        return 'shared %s' % obj.type
+    return repr(obj)
+
+
 def timer(what_to_show="Function execution"):
     """
     decorator that send the execution time of the argument function to the logger